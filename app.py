@@ -1,15 +1,26 @@
+import time
+startup_started = time.perf_counter()  # 模块开始导入的时间，用于统计冷启动耗时
+
 from flask import Flask, render_template, Response, request, jsonify, redirect, url_for, session
 import cv2
-from ultralytics import YOLO
-import ollama
-import pyttsx3
 import threading
-import time
+import queue
+import concurrent.futures
+import collections
+import itertools
 import os
+import shutil
+import tempfile
+import socket
+import ipaddress
+import urllib.parse
+import subprocess
 import pymysql
 import hashlib
 import random
 import string
+import uuid
+import json
 import smtplib
 from email.mime.text import MIMEText
 from email.header import Header
@@ -17,7 +28,7 @@ from werkzeug.utils import secure_filename
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import functools
-import geopy.distance
+import atexit
 
 app = Flask(__name__)
 app.secret_key = 'super_secret_key_for_blind_navigation_app'  # 用于session加密
@@ -32,6 +43,15 @@ DB_CONFIG = {
     'cursorclass': pymysql.cursors.DictCursor
 }
 
+# 数据库连接池配置
+DB_POOL_CONFIG = {
+    'min_size': 1,  # 回收空闲连接时至少保留的连接数
+    'max_size': 10,  # 最多同时打开的连接数
+    'checkout_timeout': 5,  # 连接全部被占用时，取连接最多等待的秒数
+    'idle_timeout': 300,  # 连接空闲超过该秒数后关闭，避免被MySQL的 wait_timeout 断开
+    'health_check_after': 30  # 连接空闲超过该秒数时，取出前先 ping 确认连接可用
+}
+
 # 邮件发送配置
 EMAIL_CONFIG = {
     'sender': 'your_email@example.com',  # 发件人邮箱
@@ -49,25 +69,190 @@ ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 300 * 1024 * 1024  # 限制上传大小为300MB
 
+# 分块上传配置
+UPLOAD_CONFIG = {
+    'chunk_size': 4 * 1024 * 1024,  # 前端每个分块的大小
+    'block_size': 64 * 1024,  # 写入磁盘时每次从请求体读取的字节数
+    'stall_timeout': 60,  # 边上传边分析时，等待新数据超过该秒数则视为上传中断
+    'reopen_interval': 0.5,  # 边上传边分析时，读到文件末尾后至少间隔该秒数再重新打开文件
+    'stale_timeout': 60 * 60  # 上传超过该秒数没有新分块则作废并删除文件
+}
+
 # 确保上传目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# 模型加载
-model_weights = "models/weights/best.pt"  # 使用相对路径
-model = YOLO(model_weights)
+# 模型配置
+MODEL_CONFIG = {
+    'weights': "models/weights/best.pt",  # 使用相对路径
+    'backend': 'pytorch',  # 推理后端：pytorch / onnx(ONNX Runtime) / openvino，非pytorch后端首次启动时自动导出并缓存
+    'imgsz': 640,  # 推理输入尺寸(320/416/640)，越小越快但远处的小目标更容易漏检；训练时 models/args.yaml 中为640，导出模型也按该尺寸导出和校准
+    'int8': False,  # 是否对导出的模型做INT8训练后量化
+    'calibration_source': 'models/calibration',  # INT8校准用的视频文件，或包含图片/视频的目录
+    'calibration_samples': 64,  # INT8校准使用的帧数
+    'export_dir': 'models/exported',  # 导出模型的缓存目录
+    'conf': 0.25,  # 导出模型的置信度阈值，与 ultralytics 预测默认值相同
+    'iou': 0.7,  # 导出模型的NMS IoU阈值，与 ultralytics 预测默认值相同
+    'fallback_to_pytorch': True,  # onnx/openvino 后端导出或加载失败时是否退回PyTorch；False时直接报错，不在未察觉的情况下用PyTorch运行
+    'warmup': False  # 服务启动后是否在后台预先加载模型并做一次空白推理，避免第一位用户等待模型加载
+}
+
+# 视频处理流水线配置
+PIPELINE_CONFIG = {
+    'enabled': True,  # 是否启用 解码/推理/编码 流水线模式，关闭时按顺序逐帧处理
+    'decode_queue_size': 4,  # 解码 -> 推理 队列深度
+    'infer_queue_size': 4,  # 推理 -> 编码 队列深度
+    'output_queue_size': 4,  # 编码 -> 输出 队列深度
+    'drop_policy': 'block',  # 队列满时的策略：block(等待下游) / drop_oldest(丢弃最旧帧)
+    'idle_timeout': 5  # 没有观看者后分析引擎继续保留的秒数
+}
+
+# 推理配置
+INFERENCE_CONFIG = {
+    'batching': True,  # 是否启用微批推理，将多帧/多个视频源的帧合并为一个批次
+    'max_batch_size': 4,  # 每批最多帧数
+    'max_wait_ms': 15,  # 凑批最长等待时间(毫秒)，限制批处理带来的额外延迟
+    # 检测区域(左, 上, 右, 下)，取值为相对画面宽高的比例，只把该区域送入模型；
+    # 盲道通常位于行走视角的中下方，例如 (0.15, 0.4, 0.85, 1.0)，默认为整个画面
+    'roi': (0.0, 0.0, 1.0, 1.0)
+}
+
+# 检测频率配置
+DETECTION_CONFIG = {
+    'mode': 'every_frame',  # every_frame(每帧检测) / interval(每N帧检测) / adaptive(画面变化时检测)
+    'interval': 3,  # interval模式下每隔多少帧运行一次检测
+    'diff_threshold': 6.0,  # adaptive模式下触发检测的帧差能量(灰度平均绝对差)
+    'max_skip': 5  # adaptive模式下最多连续复用检测框的帧数
+}
+
+# 检测框跟踪配置(在跳过检测的帧上外推检测框位置)
+TRACKER_CONFIG = {
+    'enabled': True,  # 关闭时跳过检测的帧直接复用上一次的检测框
+    'iou_threshold': 0.3,  # 轨迹与检测框匹配所需的最小IoU
+    'max_missed': 2,  # 轨迹在连续多少次检测中未匹配后删除
+    'velocity_smoothing': 0.6  # 速度更新的平滑系数，越大越相信最新观测
+}
+
+# 画面标注配置
+OVERLAY_CONFIG = {
+    'enabled': True  # 是否在画面上绘制检测框和标签，无需画面的离线分析可关闭
+}
+
+# 视频流编码档位：width 为输出宽度(None为原始分辨率)，quality 为JPEG质量，max_fps 为最高帧率(None为不限制)
+# 按画质从高到低排列，网络拥塞时逐档降低
+ENCODING_PROFILES = collections.OrderedDict([
+    ('full', {'width': None, 'quality': 95, 'max_fps': None}),  # 与 cv2.imencode 默认质量相同
+    ('high', {'width': 960, 'quality': 80, 'max_fps': 20}),
+    ('medium', {'width': 640, 'quality': 70, 'max_fps': 12}),
+    ('low', {'width': 480, 'quality': 55, 'max_fps': 6}),
+    ('minimal', {'width': 320, 'quality': 40, 'max_fps': 3})
+])
+
+# 视频流推送配置
+STREAM_CONFIG = {
+    'default_profile': 'full',  # 未指定 ?profile= 时的编码档位，分析流水线会预先编码该档位
+    'family_profile': 'medium',  # 家属端用户默认使用的档位(多在移动网络上观看)
+    'slow_send': 0.25,  # 每帧平均发送耗时超过该秒数视为客户端发送缓冲区积压，降低一档
+    'send_smoothing': 0.2,  # 平均发送耗时的平滑系数，越大对单次卡顿越敏感
+    'step_up_after': 15  # 降档后连续多少秒没有积压再恢复一档，不会超过观看者请求的档位
+}
+
+# 提示画面(等待上传、排队、错误)配置
+PLACEHOLDER_CONFIG = {
+    'size': (640, 480),  # 提示画面的宽高
+    'cache_size': 128  # 缓存多少个已编码的提示画面，按 (文字, 类型, 尺寸, 编码档位) 区分
+}
+
+# 转向提示语缓存配置
+PHRASE_CACHE_CONFIG = {
+    'pool_size': 3,  # 每组用户设置+方向缓存的提示语条数
+    'max_keys': 64,  # 最多缓存多少组，超出时淘汰最久未使用的
+    'ttl': 3600,  # 提示语有效期(秒)
+    'retry_interval': 30  # 生成失败后多久再重试(秒)
+}
+
+# 大模型配置
+LLM_CONFIG = {
+    'model': 'qwen2.5:3b',
+    'host': None,  # Ollama服务地址，None表示使用本地默认地址，测试时可指向本地桩服务
+    'deadline_ms': 800,  # 转向提示等待大模型的最长时间，超时播报固定提示
+    'queue_size': 8,  # 请求队列容量，已满时直接使用固定提示
+    'workers': 1  # 处理请求的后台线程数
+}
+
+# 语音播报配置
+SPEECH_CONFIG = {
+    'max_navigation_age': 5  # 导航提示排队超过多少秒仍未播报则丢弃
+}
+
+# 合成语音磁盘缓存配置
+AUDIO_CACHE_CONFIG = {
+    'enabled': True,  # 是否缓存导航提示的合成音频
+    'directory': 'audio_cache',  # 缓存目录
+    'max_bytes': 50 * 1024 * 1024  # 缓存总大小上限，超出时淘汰最久未使用的文件
+}
+
+# 语音文本推送(SSE)配置
+SSE_CONFIG = {
+    'heartbeat_interval': 15  # 文本没有变化时发送心跳的间隔(秒)，防止代理断开空闲连接
+}
+
+# 盲道走向估计配置
+DIRECTION_CONFIG = {
+    'threshold_slope': 0.41,  # 盲道转向判定的斜率阈值
+    'window_frames': 30,  # 参与拟合的最近帧数
+    'min_points': 6,  # 窗口内至少需要多少个检测框中心才做出判断
+    'confidence_weighting': True  # 是否按检测置信度加权
+}
+
+# 实时视频源配置
+LIVE_SOURCE_CONFIG = {
+    # 以下两类视频源会让服务器打开本机设备或主动连接其他地址，默认只对 STATS_CONFIG['admin_users'] 中的管理员开放；
+    # 浏览器推送(push)对所有用户开放
+    'allow_camera': False,  # 是否允许管理员使用服务器本地摄像头(按设备编号打开)
+    'allowed_schemes': ('rtsp', 'rtsps', 'http', 'https'),  # 允许的网络视频流协议
+    # 普通用户可以连接的视频流主机：主机名(如 'cam.example.com')或网段(如 '192.168.10.0/24')，
+    # 网段按主机名解析出的全部地址判断；管理员不受此限制
+    'allowed_stream_hosts': [],
+    'reconnect_attempts': 10,  # 网络流/摄像头断开后连续重连失败多少次放弃，0表示不限
+    'reconnect_delay': 1.0,  # 首次重连前等待秒数，之后每次翻倍
+    'max_reconnect_delay': 15,  # 重连等待时间上限(秒)
+    'push_timeout': 10,  # 浏览器推送模式下超过该秒数没有收到新帧视为连接中断
+    'latency_window': 100  # 统计 采集->引导 延迟时使用的最近帧数
+}
+
+# 用户会话配置
+SESSION_CONFIG = {
+    'idle_timeout': 30 * 60,  # 会话无请求且无连接超过该秒数后被回收
+    'max_active_pipelines': 4  # 同时运行的视频分析引擎上限，超出时新视频排队等待
+}
+
+# 用户设置缓存配置
+SETTINGS_CONFIG = {
+    'flush_interval': 1.0  # 设置修改后台写回数据库的最小间隔(秒)，间隔内的多次修改合并为一次写入
+}
+
+# 运行状态查询配置
+STATS_CONFIG = {
+    # 管理员用户名：可在 /pipeline_stats 中查看全局状态(所有会话、推理服务、连接池、缓存等)，
+    # 并可使用服务器摄像头和任意视频流地址(见 LIVE_SOURCE_CONFIG)；其他用户只能看到自己的流水线和分析引擎
+    'admin_users': []
+}
 
 # 全局变量
-current_video_path = None
-video_active = False
-last_call_time = 0
 call_interval = 14
-current_speech_text = ""
 latest_speech_text = "等待视频上传和分析..."
-camera = None
 voices_cache = None
+startup_timings = {}  # 冷启动各阶段耗时(毫秒)：模块导入、模型加载、预热、语音引擎、大模型客户端
+
+
+def record_startup_timing(name, started):
+    """记录一个启动阶段从 started(time.perf_counter) 到现在的耗时"""
+    startup_timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"[启动] {name} 用时 {startup_timings[name]:.0f} 毫秒")
 
-# 用户设置
-user_settings = {
+
+# 默认用户设置，每个登录用户的会话在此基础上保存自己的设置
+DEFAULT_USER_SETTINGS = {
     "gender": "未指定",  # 性别：男/女/未指定
     "name": "用户",  # 用户名称
     "age": "未指定",  # 年龄段：青年/中年/老年/未指定
@@ -82,11 +267,173 @@ user_locations = {}  # 格式: {user_id: {'lat': latitude, 'lng': longitude, 'ti
 
 
 # 数据库操作函数
+def connection_in_transaction(conn):
+    """连接上是否还有未提交的事务：pymysql 看服务器返回的状态标志，sqlite3 看 in_transaction，都不需要访问服务器"""
+    if hasattr(conn, 'in_transaction'):
+        return conn.in_transaction
+    return bool(conn.server_status & pymysql.constants.SERVER_STATUS.SERVER_STATUS_IN_TRANS)
+
+
+class ConnectionPool:
+    """线程安全的数据库连接池
+
+    归还的连接放回空闲队列供之后的请求复用，省去每次请求的TCP连接和认证握手。
+    取出空闲较久的连接前先 ping 检查，失效的连接直接丢弃；空闲超过 idle_timeout 的连接
+    在之后的取用/归还时被顺带关闭；连接数已达 max_size 时最多等待 checkout_timeout 秒，超时抛出 TimeoutError。
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, checkout_timeout=5, idle_timeout=300,
+                 health_check_after=30, ping=None):
+        self.connect = connect
+        self.ping = ping or (lambda conn: conn.ping(reconnect=False))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.idle = collections.deque()  # (连接, 归还时间)，右端为最近归还的连接
+        self.size = 0  # 已打开的连接数(空闲 + 使用中)
+        self.condition = threading.Condition()
+        self.checkouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.broken = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+
+    def _expire_idle(self, now):
+        """取出空闲过久的连接(调用方持有锁，取出的连接在锁外关闭)"""
+        expired = []
+        while (self.idle and self.size - len(expired) > self.min_size and
+               now - self.idle[0][1] > self.idle_timeout):
+            expired.append(self.idle.popleft()[0])
+        self.size -= len(expired)
+        self.recycled += len(expired)
+        return expired
+
+    @staticmethod
+    def _close(connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _discard(self, conn):
+        """丢弃失效的连接，空出的名额留给等待中的请求"""
+        self._close([conn])
+        with self.condition:
+            self.size -= 1
+            self.broken += 1
+            self.condition.notify()
+
+    def _healthy(self, conn):
+        try:
+            self.ping(conn)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """取出一个可用连接：优先复用最近归还的空闲连接，没有时在 max_size 以内新建"""
+        started = time.time()
+        deadline = started + self.checkout_timeout
+        while True:
+            conn = None
+            expired = []
+            try:
+                with self.condition:
+                    expired = self._expire_idle(time.time())
+                    while not self.idle and self.size >= self.max_size:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise TimeoutError(f"数据库连接池已满({self.max_size}个)，等待{self.checkout_timeout}秒超时")
+                        self.condition.wait(remaining)
+                    if self.idle:
+                        conn, returned_at = self.idle.pop()
+                    else:
+                        self.size += 1
+            finally:
+                self._close(expired)
+
+            if conn is None:
+                try:
+                    conn = self.connect()
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+                with self.condition:
+                    self.created += 1
+            elif time.time() - returned_at > self.health_check_after and not self._healthy(conn):
+                print("[连接池] 丢弃失效的数据库连接")
+                self._discard(conn)
+                continue
+
+            with self.condition:
+                self.checkouts += 1
+                self.total_wait += time.time() - started
+            return conn
+
+    def release(self, conn):
+        """归还连接；未提交的事务先回滚，回滚失败说明连接已失效，直接丢弃"""
+        try:
+            if connection_in_transaction(conn):
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+
+        with self.condition:
+            self.idle.append((conn, time.time()))
+            expired = self._expire_idle(time.time())
+            self.condition.notify()
+        self._close(expired)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": self.checkouts,
+                "created": self.created,
+                "recycled": self.recycled,
+                "broken": self.broken,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 2) if self.checkouts else 0
+            }
+
+
+class PooledConnection:
+    """连接池中连接的代理，用法与 pymysql 连接相同，只是 close() 把连接归还连接池而不是断开"""
+
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+
+    def __getattr__(self, name):
+        if self.conn is None:
+            raise pymysql.err.InterfaceError(0, "连接已归还连接池")
+        return getattr(self.conn, name)
+
+    def close(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self.pool.release(conn)
+
+
+db_pool = ConnectionPool(lambda: pymysql.connect(**DB_CONFIG), **DB_POOL_CONFIG)
+
+
 def get_db_connection():
-    """创建数据库连接"""
+    """从连接池取出一个数据库连接，用完后照常调用 close() 即归还；连接失败或等待超时返回None"""
     try:
-        connection = pymysql.connect(**DB_CONFIG)
-        return connection
+        return PooledConnection(db_pool, db_pool.acquire())
     except Exception as e:
         print(f"数据库连接错误: {e}")
         return None
@@ -217,10 +564,26 @@ def init_database():
                     voice_volume VARCHAR(10) DEFAULT '中等',
                     user_mode VARCHAR(10) DEFAULT '盲人端',
                     encourage VARCHAR(10) DEFAULT '开',
+                    UNIQUE KEY uniq_user_settings_user_id (user_id),
                     FOREIGN KEY (user_id) REFERENCES users(id)
                 )
             ''')
 
+            # 旧版本创建的表没有 user_id 唯一索引，补上索引前先删除重复的设置行(保留最早的一行)
+            cursor.execute('''
+                SELECT COUNT(*) AS count FROM information_schema.statistics
+                WHERE table_schema = DATABASE() AND table_name = 'user_settings'
+                  AND index_name = 'uniq_user_settings_user_id'
+            ''')
+            if not cursor.fetchone()['count']:
+                cursor.execute('''
+                    DELETE newer FROM user_settings newer
+                    JOIN user_settings older ON newer.user_id = older.user_id AND newer.id > older.id
+                ''')
+                if cursor.rowcount:
+                    print(f"删除重复的用户设置 {cursor.rowcount} 行")
+                cursor.execute("ALTER TABLE user_settings ADD UNIQUE KEY uniq_user_settings_user_id (user_id)")
+
         conn.commit()
         print("数据库初始化成功")
         return True
@@ -232,6 +595,140 @@ def init_database():
 
 
 # 用户相关函数
+def duplicate_key(error):
+    """唯一约束冲突(MySQL 1062)时返回冲突的索引名，如 'username'、'email'；其他完整性错误返回None"""
+    if not error.args or error.args[0] != 1062:
+        return None
+    # 错误信息形如 Duplicate entry 'x' for key 'users.email'(MySQL 8) 或 ... for key 'email'(MySQL 5.7)
+    return str(error.args[-1]).rsplit('for key ', 1)[-1].strip("'").rsplit('.', 1)[-1]
+
+
+class UserRepository:
+    """用户与用户设置的数据访问层
+
+    注册、登录和设置相关的SQL集中在这里，每个方法从连接池取一个连接，结束时归还；
+    数据库不可用时抛出 ConnectionError，SQL执行出错时回滚并继续抛出原异常。
+    """
+
+    def __init__(self, connect=get_db_connection):
+        self.connect = connect
+
+    def _connection(self):
+        conn = self.connect()
+        if conn is None:
+            raise ConnectionError("数据库连接失败")
+        return conn
+
+    def create_user(self, username, password_hash, email, phone=None):
+        """创建用户及默认设置，返回 (新用户ID, None)；用户名或邮箱已存在时返回 (None, 'username' 或 'email')
+
+        不预先查询用户名和邮箱，直接插入，由 users 表的唯一索引判断是否重复。
+        """
+        conn = self._connection()
+        try:
+            with conn.cursor() as cursor:
+                # 插入新用户
+                cursor.execute(
+                    "INSERT INTO users (username, password, email, phone) VALUES (%s, %s, %s, %s)",
+                    (username, password_hash, email, phone)
+                )
+                user_id = cursor.lastrowid
+
+                # 创建用户设置
+                cursor.execute("INSERT INTO user_settings (user_id) VALUES (%s)", (user_id,))
+
+            conn.commit()
+            return user_id, None
+        except pymysql.err.IntegrityError as e:
+            conn.rollback()
+            conflict = duplicate_key(e)
+            if conflict not in ('username', 'email'):
+                raise
+            return None, conflict
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def authenticate(self, username, password_hash):
+        """校验用户名和密码，成功时更新最后登录时间并返回 (用户 {id, username}, 设置)，失败返回None
+
+        用户和设置用一次 JOIN 查询取回；还没有设置行时设置为None，由调用方按需创建。
+        """
+        conn = self._connection()
+        try:
+            with conn.cursor() as cursor:
+                # 查询用户及其设置
+                cursor.execute(f"""
+                    SELECT users.id, users.username, user_settings.user_id AS settings_user_id,
+                           {', '.join(f'user_settings.{key}' for key in DEFAULT_USER_SETTINGS)}
+                    FROM users
+                    LEFT JOIN user_settings ON user_settings.user_id = users.id
+                    WHERE users.username = %s AND users.password = %s
+                    """, (username, password_hash))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+
+                # 更新最后登录时间
+                cursor.execute("UPDATE users SET last_login = NOW() WHERE id = %s", (row['id'],))
+
+            conn.commit()
+            user = {"id": row['id'], "username": row['username']}
+            settings = {key: row[key] for key in DEFAULT_USER_SETTINGS} if row['settings_user_id'] else None
+            return user, settings
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def load_settings(self, user_id):
+        """读取用户设置行，没有时先创建默认设置"""
+        conn = self._connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT * FROM user_settings WHERE user_id = %s", (user_id,))
+                settings = cursor.fetchone()
+
+                if not settings:
+                    # 如果没有设置，创建默认设置；并发创建时由 user_id 唯一索引忽略重复的一行
+                    cursor.execute("INSERT IGNORE INTO user_settings (user_id) VALUES (%s)", (user_id,))
+                    cursor.execute("SELECT * FROM user_settings WHERE user_id = %s", (user_id,))
+                    settings = cursor.fetchone()
+
+            conn.commit()
+            return settings
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def update_settings(self, user_id, fields):
+        """只更新给定的设置字段 {字段: 值}"""
+        columns = [key for key in fields if key in DEFAULT_USER_SETTINGS]  # 字段名来自白名单，不会拼接外部输入
+        if not columns:
+            return
+        conn = self._connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE user_settings SET {', '.join(f'{key} = %s' for key in columns)} WHERE user_id = %s",
+                    [fields[key] for key in columns] + [user_id]
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+user_repository = UserRepository()
+
+
 def register_user(username, password, email, verification_code, phone=None):
     """注册新用户，增加验证码验证"""
     # 验证邮箱验证码
@@ -239,134 +736,235 @@ def register_user(username, password, email, verification_code, phone=None):
     if not code_valid:
         return False, message
 
-    conn = get_db_connection()
-    if not conn:
-        return False, "数据库连接失败"
+    # 密码加密
+    password_hash = hashlib.sha256(password.encode()).hexdigest()
 
     try:
-        # 密码加密
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-
-        with conn.cursor() as cursor:
-            # 检查用户名是否已存在
-            cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-            if cursor.fetchone():
-                return False, "用户名已存在"
-
-            # 检查邮箱是否已存在
-            cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-            if cursor.fetchone():
-                return False, "该邮箱已被注册"
-
-            # 插入新用户
-            cursor.execute(
-                "INSERT INTO users (username, password, email, phone) VALUES (%s, %s, %s, %s)",
-                (username, password_hash, email, phone)
-            )
-
-            # 获取新用户ID
-            user_id = cursor.lastrowid
-
-            # 创建用户设置
-            cursor.execute(
-                "INSERT INTO user_settings (user_id) VALUES (%s)",
-                (user_id,)
-            )
-
-        conn.commit()
-        return True, "注册成功"
+        user_id, conflict = user_repository.create_user(username, password_hash, email, phone)
+    except ConnectionError:
+        return False, "数据库连接失败"
     except Exception as e:
-        conn.rollback()
         print(f"注册用户失败: {e}")
         return False, f"注册失败: {str(e)}"
-    finally:
-        conn.close()
+
+    if conflict == 'username':
+        return False, "用户名已存在"
+    if conflict == 'email':
+        return False, "该邮箱已被注册"
+    return True, "注册成功"
 
 
 def verify_user(username, password):
     """验证用户登录"""
-    conn = get_db_connection()
-    if not conn:
-        return False, "数据库连接失败", None
+    # 密码加密
+    password_hash = hashlib.sha256(password.encode()).hexdigest()
 
     try:
-        # 密码加密
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-
-        with conn.cursor() as cursor:
-            # 查询用户
-            cursor.execute("SELECT id, username FROM users WHERE username = %s AND password = %s",
-                           (username, password_hash))
-            user = cursor.fetchone()
-
-            if not user:
-                return False, "用户名或密码错误", None
-
-            # 更新最后登录时间
-            cursor.execute("UPDATE users SET last_login = NOW() WHERE id = %s", (user['id'],))
-
-            # 获取用户设置
-            cursor.execute("SELECT * FROM user_settings WHERE user_id = %s", (user['id'],))
-            settings = cursor.fetchone()
-
-            if not settings:
-                # 如果没有设置，创建默认设置
-                cursor.execute("INSERT INTO user_settings (user_id) VALUES (%s)", (user['id'],))
-                cursor.execute("SELECT * FROM user_settings WHERE user_id = %s", (user['id'],))
-                settings = cursor.fetchone()
-
-        conn.commit()
-
-        # 将设置转换为应用中使用的格式
-        user_config = {
-            "id": user['id'],
-            "username": user['username'],
-            "gender": settings['gender'],
-            "name": settings['name'],
-            "age": settings['age'],
-            "voice_speed": settings['voice_speed'],
-            "voice_volume": settings['voice_volume'],
-            "user_mode": settings['user_mode'],
-            "encourage": settings['encourage']
-        }
-
-        return True, "登录成功", user_config
+        result = user_repository.authenticate(username, password_hash)
+    except ConnectionError:
+        return False, "数据库连接失败", None
     except Exception as e:
         print(f"验证用户失败: {e}")
         return False, f"登录失败: {str(e)}", None
-    finally:
-        conn.close()
 
+    if result is None:
+        return False, "用户名或密码错误", None
+    user, settings_row = result
+
+    # 缓存中已有该用户时以缓存为准(可能有尚未写回的修改)，否则直接使用登录时一并查到的设置
+    if settings_row is not None:
+        settings_store.prime(user['id'], settings_row)
+    settings = settings_store.get(user['id'])
+
+    # 将设置转换为应用中使用的格式
+    user_config = {
+        "id": user['id'],
+        "username": user['username'],
+        "gender": settings['gender'],
+        "name": settings['name'],
+        "age": settings['age'],
+        "voice_speed": settings['voice_speed'],
+        "voice_volume": settings['voice_volume'],
+        "user_mode": settings['user_mode'],
+        "encourage": settings['encourage']
+    }
 
-def update_user_settings_in_db(user_id, settings):
-    """更新数据库中的用户设置"""
-    conn = get_db_connection()
-    if not conn:
-        return False, "数据库连接失败"
-
-    try:
-        with conn.cursor() as cursor:
-            # 更新用户设置
-            cursor.execute("""
-                UPDATE user_settings 
-                SET gender = %s, name = %s, age = %s, 
-                    voice_speed = %s, voice_volume = %s, user_mode = %s, encourage = %s
-                WHERE user_id = %s
-                """,
-                           (settings["gender"], settings["name"], settings["age"],
-                            settings["voice_speed"], settings["voice_volume"], settings["user_mode"],
-                            settings["encourage"],
-                            user_id)
-                           )
+    return True, "登录成功", user_config
+
+
+class SettingsEntry:
+    """一个用户的缓存设置"""
+
+    def __init__(self, settings, loaded):
+        self.settings = settings  # 用户会话直接引用同一个字典，修改后立即对所有读取者可见
+        self.loaded = loaded  # 是否已从数据库读取成功，读取失败时先使用默认设置，之后再重试
+        self.version = 0  # 每次修改递增
+        self.flushed_version = 0  # 已写回数据库的版本
+        self.dirty = set()  # 修改后尚未写回的字段
+        self.last_flush = 0.0
+
+
+class SettingsStore:
+    """用户设置的进程内缓存：读穿透、延迟合并写回
+
+    读取只访问缓存，缓存中没有该用户时才从数据库读取一次；
+    修改立即生效并递增版本号，后台线程对每个用户最多每 flush_interval 秒写回一次，
+    只写入这段时间内变化过的字段。写回失败的字段保留，下次重试。
+    """
+
+    def __init__(self, repository, flush_interval=1.0):
+        self.repository = repository
+        self.flush_interval = flush_interval
+        self.entries = {}
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()  # 同一时间只有一次写回，避免旧值覆盖新值
+        self.thread = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.fields_written = 0
+        self.failures = 0
+
+    def _load(self, user_id):
+        try:
+            row = self.repository.load_settings(user_id)
+            return {key: row[key] for key in DEFAULT_USER_SETTINGS}, True
+        except Exception as e:
+            print(f"读取用户设置失败: {e}")
+            return dict(DEFAULT_USER_SETTINGS), False
+
+    def get(self, user_id):
+        """返回用户设置字典(缓存中的同一个对象)"""
+        with self.condition:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry.loaded:
+                self.hits += 1
+                return entry.settings
+            self.misses += 1
+
+        settings, loaded = self._load(user_id)
+        if loaded:
+            self.prime(user_id, settings)
+        with self.condition:
+            return self.entries.setdefault(user_id, SettingsEntry(settings, False)).settings
+
+    def prime(self, user_id, settings):
+        """放入已经从数据库查到的设置(如登录时一并取回的)，缓存中已有该用户时不覆盖"""
+        with self.condition:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                self.entries[user_id] = SettingsEntry(dict(settings), True)
+            elif not entry.loaded:
+                # 之前读取失败时使用的是默认设置，读取成功后补上数据库中的值，保留期间用户的修改
+                entry.settings.update({key: value for key, value in settings.items() if key not in entry.dirty})
+                entry.loaded = True
+
+    def version(self, user_id):
+        with self.condition:
+            entry = self.entries.get(user_id)
+            return entry.version if entry else 0
+
+    def update(self, user_id, changes):
+        """修改设置，只接受已知字段；返回 (设置, 版本号)，数据库由后台线程写回"""
+        settings = self.get(user_id)
+        with self.condition:
+            entry = self.entries[user_id]
+            changed = [key for key in DEFAULT_USER_SETTINGS
+                       if key in changes and settings[key] != changes[key]]
+            if changed:
+                settings.update({key: changes[key] for key in changed})
+                entry.dirty.update(changed)
+                entry.version += 1
+                self._start()
+                self.condition.notify()
+            return settings, entry.version
+
+    def _start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _due(self, now):
+        """返回 (到期需要写回的用户, 下一个用户到期前的秒数)"""
+        due = []
+        wait = None
+        for user_id, entry in self.entries.items():
+            if not entry.dirty:
+                continue
+            remaining = entry.last_flush + self.flush_interval - now
+            if remaining <= 0:
+                due.append(user_id)
+            elif wait is None or remaining < wait:
+                wait = remaining
+        return due, wait
+
+    def _run(self):
+        while True:
+            with self.condition:
+                due, wait = self._due(time.time())
+                while not due:
+                    self.condition.wait(wait)
+                    due, wait = self._due(time.time())
+            for user_id in due:
+                self.flush(user_id)
+
+    def flush(self, user_id):
+        """把该用户变化过的字段写回数据库，成功(或没有需要写回的字段)返回True"""
+        with self.flush_lock:
+            with self.condition:
+                entry = self.entries.get(user_id)
+                if entry is None or not entry.dirty:
+                    return True
+                fields = {key: entry.settings[key] for key in entry.dirty}
+                version = entry.version
+                entry.dirty = set()
+                entry.last_flush = time.time()
 
-        conn.commit()
-        return True, "设置更新成功"
-    except Exception as e:
-        conn.rollback()
-        print(f"更新用户设置失败: {e}")
-        return False, f"设置更新失败: {str(e)}"
-    finally:
-        conn.close()
+            try:
+                self.repository.update_settings(user_id, fields)
+            except Exception as e:
+                print(f"[设置] 写回用户 {user_id} 的设置失败，稍后重试: {e}")
+                with self.condition:
+                    entry.dirty.update(fields)
+                    self.failures += 1
+                return False
+
+            with self.condition:
+                entry.flushed_version = max(entry.flushed_version, version)
+                self.flushes += 1
+                self.fields_written += len(fields)
+            return True
+
+    def flush_all(self):
+        """写回所有未保存的修改(服务退出时调用)"""
+        with self.condition:
+            user_ids = [user_id for user_id, entry in self.entries.items() if entry.dirty]
+        for user_id in user_ids:
+            self.flush(user_id)
+
+    def discard(self, user_id):
+        """会话结束时移出缓存，移出前写回未保存的修改；写回失败时保留在缓存中等待重试"""
+        if self.flush(user_id):
+            with self.condition:
+                entry = self.entries.get(user_id)
+                if entry is not None and not entry.dirty:
+                    del self.entries[user_id]
+
+    def stats(self):
+        with self.condition:
+            return {
+                "cached": len(self.entries),
+                "dirty": sum(1 for entry in self.entries.values() if entry.dirty),
+                "hits": self.hits,
+                "misses": self.misses,
+                "flushes": self.flushes,
+                "fields_written": self.fields_written,
+                "failures": self.failures
+            }
+
+
+settings_store = SettingsStore(user_repository, SETTINGS_CONFIG['flush_interval'])
+atexit.register(settings_store.flush_all)
 
 
 # 验证登录的装饰器
@@ -399,17 +997,9 @@ def login():
                 session['user_id'] = user_data['id']
                 session['username'] = user_data['username']
 
-                # 更新全局设置
-                global user_settings
-                user_settings = {
-                    "gender": user_data['gender'],
-                    "name": user_data['name'],
-                    "age": user_data['age'],
-                    "voice_speed": user_data['voice_speed'],
-                    "voice_volume": user_data['voice_volume'],
-                    "user_mode": user_data['user_mode'],
-                    "encourage": user_data['encourage']
-                }
+                # 设置只保存在该用户自己的会话中，不影响其他已登录用户
+                user_session = sessions.open(user_data['id'])
+                phrase_cache.prefill(user_session.settings)
 
                 return redirect(url_for('index'))
             else:
@@ -450,6 +1040,8 @@ def register():
 @app.route('/logout')
 def logout():
     """用户登出"""
+    if 'user_id' in session:
+        sessions.close(session['user_id'])
     session.clear()
     return redirect(url_for('login'))
 
@@ -462,411 +1054,3028 @@ def index():
         'id': session.get('user_id'),
         'username': session.get('username', '用户')
     }
-    return render_template('index.html', settings=user_settings, current_user=user)
+    return render_template('index.html', settings=current_user_session().settings, current_user=user)
+
+
+# 修改更新设置接口以支持数据库
+@app.route('/update_settings', methods=['POST'])
+@login_required
+def update_settings():
+    """更新用户设置"""
+    user_session = current_user_session()
+
+    data = request.get_json()
+    if not data:
+        return jsonify({"status": "error", "message": "未接收到设置数据"}), 400
+
+    # 更新缓存中的设置立即生效，数据库由后台合并写回
+    user_settings, version = settings_store.update(user_session.user_id, data)
+
+    phrase_cache.prefill(user_settings)
+
+    return jsonify({
+        "status": "success",
+        "message": "设置已更新",
+        "settings": user_settings,
+        "version": version
+    })
+
+
+# AI提示模板
+def get_prompt_template(settings):
+    gender_term = ""
+    age_term = ""
+
+    if settings["gender"] == "男":
+        gender_term = "先生"
+    elif settings["gender"] == "女":
+        gender_term = "女士"
+
+    if settings["age"] == "老年":
+        age_term = "年长的"
+    elif settings["age"] == "青年":
+        age_term = "年轻的"
+
+    prompt = f'''
+你是一个服务于盲人行走的语音导航小助手。
+你的用户是{age_term}{settings["name"]}{gender_term}。
+你通过告知盲人盲道的转向，注意一定要说清楚盲道转向方位（左？右？），确保盲人一直行走在盲道上，并适时给予一些关怀。
+注意，盲人因为看不见路面情况，所以才需要你的语音行走提示。
+你的语气要温柔且元气。
+'''
+
+    # 如果开启了鼓励功能，在提示词中添加相关要求
+    if settings["encourage"] == "开":
+        prompt += '''
+请在引导方向的同时，适当给予用户温暖的鼓励和正面的肯定，例如称赞他们走得好、进步明显，或者鼓励他们继续保持自信等。
+'''
+
+    return prompt
+
+
+right_turn_question = "请用亲切且简短的话语告知要往右拐，因为盲道是往右拐的"
+left_turn_question = "请用亲切且简短的话语告知要往左拐，因为盲道是往左拐的"
+
+TURN_QUESTIONS = {
+    'left': left_turn_question,
+    'right': right_turn_question
+}
+
+TURN_NAMES = {
+    'left': '左转',
+    'right': '右转'
+}
+
+# 缓存中没有可用提示语时使用的固定提示
+DEFAULT_TURN_PHRASES = {
+    'left': "前方盲道向左转，请往左拐。",
+    'right': "前方盲道向右转，请往右拐。"
+}
+
+
+llm_client = None
+llm_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """返回Ollama客户端，首次调用时才导入 ollama；配置了 host 时连接指定服务（例如测试用的本地桩服务）"""
+    global llm_client
+    with llm_client_lock:
+        if llm_client is None:
+            started = time.perf_counter()
+            import ollama
+            llm_client = ollama.Client(host=LLM_CONFIG['host']) if LLM_CONFIG['host'] else ollama
+            record_startup_timing('llm_client', started)
+        return llm_client
+
+
+def generate_turn_phrase(direction, settings):
+    """调用大模型生成一条转向提示语（阻塞，只在 LLMRequestQueue 的工作线程中调用）"""
+    response = get_llm_client().chat(model=LLM_CONFIG['model'], messages=[
+        {"role": "system", "content": get_prompt_template(settings)},
+        {"role": "user", "content": TURN_QUESTIONS[direction]}
+    ], stream=True)
+
+    answer_content = ""
+    for chunk in response:
+        content = chunk.get('message', {}).get('content', '')
+        if content:
+            answer_content += content
+
+    return answer_content.strip()
+
+
+class GuidancePhraseCache:
+    """转向提示语缓存
+
+    以 (方向, 称呼, 性别, 年龄段, 是否鼓励) 为键，每个键保存若干条由大模型生成的提示语，
+    取用时随机取出一条，低于 pool_size 时通过大模型请求队列异步补充。
+    键按LRU淘汰，提示语超过 ttl 秒后失效，帧处理循环从不等待大模型。
+    """
+
+    def __init__(self, pool_size=3, max_keys=64, ttl=3600, retry_interval=30):
+        self.pool_size = pool_size
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.entries = collections.OrderedDict()  # 格式: {key: [(text, created_at), ...]}
+        self.refilling = set()
+        self.failed_at = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(direction, settings):
+        return (direction, settings["name"], settings["gender"], settings["age"], settings["encourage"])
+
+    def _fresh(self, key):
+        """返回键对应的未过期提示语列表，并将该键标记为最近使用（需持有锁）"""
+        now = time.time()
+        phrases = [p for p in self.entries.get(key, []) if now - p[1] < self.ttl]
+        self.entries[key] = phrases
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_keys:
+            self.entries.popitem(last=False)
+        return phrases
+
+    def get(self, direction, settings):
+        """立即返回一条缓存的提示语，没有时返回None；必要时触发后台补充"""
+        key = self.key_for(direction, settings)
+        with self.lock:
+            phrases = self._fresh(key)
+            text = phrases.pop(random.randrange(len(phrases)))[0] if phrases else None
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self.refill(direction, settings)
+        return text
+
+    def put(self, key, text):
+        if not text:
+            return
+        with self.lock:
+            phrases = self._fresh(key)
+            if len(phrases) < self.pool_size:
+                phrases.append((text, time.time()))
+
+    def refill(self, direction, settings):
+        """通过大模型请求队列补充某个键的提示语池，已在补充或近期失败时跳过"""
+        key = self.key_for(direction, settings)
+        with self.lock:
+            if key in self.refilling or len(self._fresh(key)) >= self.pool_size:
+                return
+            if time.time() - self.failed_at.get(key, 0) < self.retry_interval:
+                return
+            self.refilling.add(key)
+
+        settings = dict(settings)
+        request = LLMRequest(direction, settings,
+                             on_result=lambda text: self._refilled(key, direction, settings, text))
+        if not llm_queue.submit(request, priority=LLM_PRIORITY_REFILL):
+            with self.lock:
+                self.refilling.discard(key)
+
+    def _refilled(self, key, direction, settings, text):
+        with self.lock:
+            self.refilling.discard(key)
+            if not text:
+                self.failed_at[key] = time.time()
+        if text:
+            self.put(key, text)
+            self.refill(direction, settings)
+
+    def prefill(self, settings):
+        """为当前用户设置预先生成左右转提示语"""
+        for direction in TURN_QUESTIONS:
+            self.refill(direction, settings)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "keys": len(self.entries),
+                "phrases": sum(len(p) for p in self.entries.values()),
+                "refilling": len(self.refilling),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# 大模型请求优先级：数值越小越先处理
+LLM_PRIORITY_TURN = 0  # 正在等待播报的转向提示
+LLM_PRIORITY_REFILL = 1  # 后台补充提示语缓存
+
+
+class LLMRequest:
+    """一次大模型生成请求
+
+    结果只交付一次：截止时间前生成完成则交付大模型的回答，
+    否则在截止时间到达时交付后备提示；没有截止时间的请求在生成结束后交付（失败时为None）。
+    """
+
+    def __init__(self, direction, settings, on_result=None, deadline=None, fallback=None):
+        self.direction = direction
+        self.settings = settings
+        self.key = GuidancePhraseCache.key_for(direction, settings)
+        self.on_result = on_result
+        self.deadline = deadline
+        self.fallback = fallback
+        self.created_at = time.time()
+        self.timer = None
+        self.lock = threading.Lock()
+        self.resolved = False
+
+    def resolve(self, text):
+        """交付结果，已经交付过则返回False"""
+        with self.lock:
+            if self.resolved:
+                return False
+            self.resolved = True
+        if self.timer:
+            self.timer.cancel()
+        if self.on_result:
+            self.on_result(text)
+        return True
+
+
+class LLMRequestQueue:
+    """有界的大模型请求队列
+
+    所有 ollama.chat 调用都在这里的后台工作线程中执行，调用方只负责入队。
+    带截止时间的请求超时后先交付后备提示，迟到的回答放入提示语缓存供下次使用。
+    """
+
+    def __init__(self, maxsize=8, workers=1):
+        self.requests = queue.PriorityQueue(maxsize=maxsize)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.timeouts = 0
+        self.late = 0
+        self.failed = 0
+        self.rejected = 0
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, request, priority=LLM_PRIORITY_REFILL):
+        """请求入队，队列已满时返回False"""
+        try:
+            self.requests.put_nowait((priority, next(self.counter), request))
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+
+        if request.deadline is not None:
+            request.timer = threading.Timer(request.deadline, self._expire, args=(request,))
+            request.timer.daemon = True
+            request.timer.start()
+        return True
+
+    def _expire(self, request):
+        if request.resolve(request.fallback):
+            with self.lock:
+                self.timeouts += 1
+            print(f"[大模型] 超过{request.deadline * 1000:.0f}ms未返回，使用后备提示")
+
+    def _worker(self):
+        while True:
+            _, _, request = self.requests.get()
+            try:
+                text = generate_turn_phrase(request.direction, request.settings)
+            except Exception as e:
+                print(f"[大模型] 生成{TURN_NAMES[request.direction]}提示失败: {e}")
+                with self.lock:
+                    self.failed += 1
+                request.resolve(request.fallback)
+                continue
+
+            with self.lock:
+                self.completed += 1
+            if not request.resolve(text):
+                # 已经超时并播报了后备提示，迟到的回答留给下一次转向使用
+                with self.lock:
+                    self.late += 1
+                phrase_cache.put(request.key, text)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pending": self.requests.qsize(),
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "late": self.late,
+                "failed": self.failed,
+                "rejected": self.rejected
+            }
+
+
+llm_queue = LLMRequestQueue(maxsize=LLM_CONFIG['queue_size'], workers=LLM_CONFIG['workers'])
+
+phrase_cache = GuidancePhraseCache(
+    pool_size=PHRASE_CACHE_CONFIG['pool_size'],
+    max_keys=PHRASE_CACHE_CONFIG['max_keys'],
+    ttl=PHRASE_CACHE_CONFIG['ttl'],
+    retry_interval=PHRASE_CACHE_CONFIG['retry_interval']
+)
+
+
+def get_available_voices():
+    global voices_cache
+    if voices_cache is not None:
+        return voices_cache
+
+    import pyttsx3
+    engine = pyttsx3.init()
+    voices = engine.getProperty('voices')
+    available_voices = []
+
+    for voice in voices:
+        voice_info = {
+            'id': voice.id,
+            'name': voice.name,
+            'gender': '女声' if 'female' in voice.id.lower() or 'Microsoft Huihui' in voice.name else '男声'
+        }
+        available_voices.append(voice_info)
+
+    voices_cache = available_voices
+    return available_voices
+
+
+# 语音播报优先级：数值越小越先播报
+SPEECH_PRIORITY_MESSAGE = 0  # 家属消息
+SPEECH_PRIORITY_NAVIGATION = 1  # 导航提示
+SPEECH_PRIORITY_TEST = 2  # 测试语音
+
+
+def voice_properties(settings):
+    """根据用户设置返回 (语速, 音量)"""
+    if settings["voice_speed"] == "慢":
+        rate = 150
+    elif settings["voice_speed"] == "快":
+        rate = 250
+    else:  # 中等
+        rate = 200
+
+    volume_mapping = {
+        "低": 0.5,
+        "中等": 0.8,
+        "高": 1.0
+    }
+    volume = volume_mapping.get(settings["voice_volume"], 0.8)
+    return rate, volume
+
+
+def select_voice(engine):
+    """从系统语音中优先选择中文语音，找不到时使用第一个可用语音，返回语音ID"""
+    voices = engine.getProperty('voices')
+    print(f"[语音] 系统可用语音列表:")
+    for i, voice in enumerate(voices):
+        print(f"  语音{i + 1}: ID={voice.id}, 名称={voice.name}")
+
+    for voice in voices:
+        voice_name = voice.name.lower()
+        # 检查是否包含中文相关关键词
+        if "chinese" in voice_name or "huihui" in voice_name or "china" in voice_name or "中文" in voice_name or "zhongwen" in voice_name:
+            print(f"[语音] 找到中文语音: {voice.name}")
+            return voice.id
+
+    if len(voices) > 0:
+        print(f"[语音] 未找到中文语音，使用第一个可用语音: {voices[0].name}")
+        return voices[0].id
+
+    print("[语音] 警告: 未找到可用语音")
+    return None
+
+
+@functools.lru_cache(maxsize=1)
+def audio_player():
+    """检测当前系统可用的音频播放方式，返回 'winsound'、播放命令列表或None"""
+    try:
+        import winsound
+        return 'winsound'
+    except ImportError:
+        pass
+
+    for player in (["afplay"], ["paplay"], ["aplay", "-q"]):
+        if shutil.which(player[0]):
+            return player
+    return None
+
+
+def play_audio_file(path):
+    """播放音频文件（阻塞直到播放结束），失败时返回False"""
+    player = audio_player()
+    if player is None:
+        return False
+    if player == 'winsound':
+        import winsound
+        winsound.PlaySound(path, winsound.SND_FILENAME)
+        return True
+    return subprocess.run(player + [path]).returncode == 0
+
+
+class SpeechAudioCache:
+    """合成语音的磁盘缓存
+
+    以 (文本, 语音ID, 语速, 音量) 的哈希为文件名保存 pyttsx3 合成的音频，
+    重复的导航提示直接播放缓存文件，省去每次的合成时间。
+    总大小超过 max_bytes 时按最近使用时间淘汰最旧的文件。
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, text, voice_id, settings):
+        key = "|".join([text, str(voice_id), settings["voice_speed"], settings["voice_volume"]])
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.wav")
+
+    def get_or_render(self, engine, text, voice_id, settings):
+        """返回缓存的音频文件路径，未命中时用引擎合成并写入缓存"""
+        path = self.path_for(text, voice_id, settings)
+        if os.path.exists(path):
+            self.hits += 1
+            # 更新修改时间作为LRU的使用时间
+            os.utime(path)
+            return path
+
+        self.misses += 1
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            engine.save_to_file(text, temp_path)
+            engine.runAndWait()
+            if not os.path.exists(temp_path) or os.path.getsize(temp_path) == 0:
+                return None
+            os.replace(temp_path, path)
+        finally:
+            # 合成失败或生成空文件时临时文件没有被移入缓存，删除它，否则会一直留在目录中且不计入大小上限
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError as e:
+                    print(f"[语音缓存] 删除临时文件失败: {e}")
+        self.evict()
+        return path
+
+    def evict(self):
+        """总大小超过上限时删除最久未使用的文件"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.wav'):
+                continue
+            file_path = os.path.join(self.directory, name)
+            stat = os.stat(file_path)
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file_path)
+                total -= size
+            except OSError as e:
+                print(f"[语音缓存] 删除缓存文件失败: {e}")
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+audio_cache = SpeechAudioCache(AUDIO_CACHE_CONFIG['directory'], AUDIO_CACHE_CONFIG['max_bytes'])
+
+
+class SpeechWorker:
+    """常驻语音播报线程
+
+    pyttsx3 引擎只在工作线程中初始化一次并选定语音，之后按优先级依次播报：
+    家属消息 > 导航提示 > 测试语音。新的导航提示会取代尚未播报的旧导航提示，
+    排队超过 max_navigation_age 秒的导航提示直接丢弃。
+    """
+
+    def __init__(self, max_navigation_age=5):
+        self.max_navigation_age = max_navigation_age
+        self.requests = queue.PriorityQueue()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.latest_navigation = -1
+        self.engine = None
+        self.voice_id = None
+        self.thread = None
+        self.spoken = 0
+        self.dropped = 0
+
+    def submit(self, text, priority=SPEECH_PRIORITY_NAVIGATION, settings=None):
+        """加入播报队列，settings 为本次播报使用的语速/音量设置，默认使用默认设置"""
+        settings = dict(settings or DEFAULT_USER_SETTINGS)
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            seq = next(self.counter)
+            if priority == SPEECH_PRIORITY_NAVIGATION:
+                self.latest_navigation = seq
+        self.requests.put((priority, seq, text, settings, time.time()))
+        return True
+
+    def _init_engine(self):
+        started = time.perf_counter()
+        import pyttsx3
+        self.engine = pyttsx3.init()
+        self.voice_id = select_voice(self.engine)
+        if self.voice_id:
+            print(f"[语音] 最终使用语音ID: {self.voice_id}")
+            self.engine.setProperty('voice', self.voice_id)
+        record_startup_timing('tts_engine', started)
+
+    def _stale(self, priority, seq, queued_at):
+        if priority != SPEECH_PRIORITY_NAVIGATION:
+            return False
+        with self.lock:
+            superseded = seq < self.latest_navigation
+        return superseded or time.time() - queued_at > self.max_navigation_age
+
+    def _run(self):
+        while True:
+            priority, seq, text, settings, queued_at = self.requests.get()
+            if self._stale(priority, seq, queued_at):
+                self.dropped += 1
+                print(f"[语音] 丢弃过时的导航提示: '{text}'")
+                continue
+
+            try:
+                if self.engine is None:
+                    self._init_engine()
+                self._speak(text, settings, cacheable=priority == SPEECH_PRIORITY_NAVIGATION)
+                self.spoken += 1
+            except Exception as e:
+                print(f"[语音] 错误: {e}")
+                import traceback
+                traceback.print_exc()
+                # 引擎出错后下次重新初始化
+                self.engine = None
+
+    def _speak(self, text, settings, cacheable=False):
+        rate, volume = voice_properties(settings)
+        self.engine.setProperty('rate', rate)
+        self.engine.setProperty('volume', volume)
+
+        # 导航提示重复率高，优先播放磁盘缓存中已合成的音频
+        if cacheable and AUDIO_CACHE_CONFIG['enabled'] and audio_player() is not None:
+            path = audio_cache.get_or_render(self.engine, text, self.voice_id, settings)
+            if path and play_audio_file(path):
+                print(f"[语音] 播放缓存音频: {text}")
+                return
+
+        print(f"[语音] 播放文本: {text}")
+        self.engine.say(text)
+        self.engine.runAndWait()
+        print("[语音] 播放完成")
+
+    def stats(self):
+        return {
+            "pending": self.requests.qsize(),
+            "spoken": self.spoken,
+            "dropped": self.dropped,
+            "audio_cache": audio_cache.stats()
+        }
+
+
+speech_worker = SpeechWorker(max_navigation_age=SPEECH_CONFIG['max_navigation_age'])
+
+
+def speak(text, priority=SPEECH_PRIORITY_NAVIGATION, settings=None):
+    """将文本交给常驻语音线程播报，立即返回"""
+    print(f"[语音] 加入播报队列: '{text}'")
+    return speech_worker.submit(text, priority, settings)
+
+
+DEFAULT_SPEECH_TEXT = "提示：系统会实时分析盲道方向，当方向发生变化时会自动播报语音提示。"
+
+
+def sse_event(event_id, text):
+    """按SSE格式组装一条事件，多行文本拆成多个data字段"""
+    lines = [f"id: {event_id}"]
+    lines.extend(f"data: {line}" for line in text.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+class SpeechTextBroadcaster:
+    """语音文本发布/订阅
+
+    文本变化时通过条件变量唤醒所有订阅者，不再逐个客户端轮询；
+    每条文本带递增的事件ID并保留最近 history_size 条，断线重连时按 Last-Event-ID 补发。
+    """
+
+    def __init__(self, text, history_size=20):
+        self.condition = threading.Condition()
+        self.event_id = 1
+        self.text = text
+        self.history = collections.deque([(1, text)], maxlen=history_size)
+        self.listeners = set()
+
+    def add_listener(self, callback):
+        """注册文本变化时调用的回调（供异步服务唤醒协程使用）"""
+        with self.condition:
+            self.listeners.add(callback)
+
+    def remove_listener(self, callback):
+        with self.condition:
+            self.listeners.discard(callback)
+
+    def publish(self, text):
+        """发布新文本，与当前文本相同时不产生事件"""
+        with self.condition:
+            if text == self.text:
+                return
+            self.event_id += 1
+            self.text = text
+            self.history.append((self.event_id, text))
+            self.condition.notify_all()
+            for callback in list(self.listeners):
+                callback()
+
+    def pending(self, last_id):
+        """不等待地返回 last_id 之后尚未发送的事件"""
+        with self.condition:
+            return self._pending(last_id)
+
+    def _pending(self, last_id):
+        """返回 last_id 之后尚未发送的事件（需持有锁）"""
+        if last_id is None or last_id > self.event_id:
+            return [(self.event_id, self.text)]
+        missed = [(event_id, text) for event_id, text in self.history if event_id > last_id]
+        if missed and missed[0][0] != last_id + 1:
+            # 断线太久，历史已被覆盖，只补发最新一条
+            return missed[-1:]
+        return missed
+
+    def events(self, last_id=None, heartbeat_interval=15):
+        """订阅者生成器：产出SSE格式的事件，空闲时定期产出心跳注释"""
+        while True:
+            with self.condition:
+                pending = self._pending(last_id)
+                if not pending:
+                    self.condition.wait(heartbeat_interval)
+                    pending = self._pending(last_id)
+
+            if not pending:
+                yield ": heartbeat\n\n"
+                continue
+
+            for event_id, text in pending:
+                yield sse_event(event_id, text)
+            last_id = pending[-1][0]
+
+
+class UserSession:
+    """单个登录用户的会话状态：设置、当前视频、语音文本频道和转向播报节流时间"""
+
+    def __init__(self, user_id, settings):
+        self.user_id = user_id
+        self.settings = settings  # 与 settings_store 缓存中的是同一个字典
+        self.video_path = None
+        self.video_active = False
+        self.last_call_time = 0
+        self.speech_text = SpeechTextBroadcaster(DEFAULT_SPEECH_TEXT)
+        self.pushed_frames = LatestFrame()
+        self.lock = threading.Lock()
+        self.streams = 0
+        self.last_seen = time.time()
+
+    def touch(self):
+        self.last_seen = time.time()
+
+    def attach(self):
+        """视频流或语音文本长连接开始，连接存在期间会话不会被回收"""
+        with self.lock:
+            self.streams += 1
+            self.last_seen = time.time()
+
+    def detach(self):
+        with self.lock:
+            self.streams -= 1
+            self.last_seen = time.time()
+
+    def is_idle(self, now, timeout):
+        with self.lock:
+            return self.streams == 0 and now - self.last_seen > timeout
+
+    def set_video(self, video_path):
+        """切换到新上传的视频或实时视频源，返回被替换的旧视频路径"""
+        with self.lock:
+            old_path = self.video_path
+            self.video_path = video_path
+            self.video_active = True
+        return old_path
+
+    def is_playing(self, video_path):
+        """video_path 是否仍是该用户正在分析的视频，上传新视频或登出后旧视频的分析随之停止"""
+        return self.video_active and self.video_path == video_path
+
+    def finish_video(self, video_path):
+        """视频分析结束；期间已上传了新视频时不影响新视频"""
+        with self.lock:
+            if self.video_path == video_path:
+                self.video_active = False
+
+    def close(self):
+        """停止分析并删除该用户上传的视频"""
+        with self.lock:
+            video_path = self.video_path
+            self.video_path = None
+            self.video_active = False
+        if video_path and os.path.exists(video_path):
+            try:
+                os.remove(video_path)
+            except Exception as e:
+                print(f"无法删除旧视频文件: {e}")
+
+
+class SessionRegistry:
+    """按 user_id 管理用户会话
+
+    每个用户拥有独立的设置、视频和语音文本频道，互不覆盖；
+    无请求且无长连接超过 idle_timeout 秒的会话在之后的请求中被顺带回收。
+    """
+
+    def __init__(self, idle_timeout=1800, sweep_interval=60):
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.last_sweep = time.time()
+        self.evicted = 0
+
+    def open(self, user_id):
+        """登录时创建会话；同一用户已有会话时沿用"""
+        return self.get(user_id)
+
+    def get(self, user_id):
+        """获取会话，会话已被回收(或服务重启)时从设置缓存重新创建"""
+        self.evict_idle()
+        with self.lock:
+            user_session = self.sessions.get(user_id)
+        if user_session is None:
+            settings = settings_store.get(user_id)
+            with self.lock:
+                user_session = self.sessions.setdefault(user_id, UserSession(user_id, settings))
+        user_session.touch()
+        return user_session
+
+    def close(self, user_id):
+        """登出时关闭会话"""
+        with self.lock:
+            user_session = self.sessions.pop(user_id, None)
+        if user_session is not None:
+            user_session.close()
+            settings_store.discard(user_id)
+
+    def evict_idle(self):
+        """回收空闲会话，每 sweep_interval 秒最多检查一次"""
+        now = time.time()
+        with self.lock:
+            if now - self.last_sweep < self.sweep_interval:
+                return
+            self.last_sweep = now
+            idle = [user_id for user_id, user_session in self.sessions.items()
+                    if user_session.is_idle(now, self.idle_timeout)]
+            evicted = [self.sessions.pop(user_id) for user_id in idle]
+            self.evicted += len(evicted)
+        for user_session in evicted:
+            print(f"[会话] 回收空闲会话: 用户 {user_session.user_id}")
+            user_session.close()
+            settings_store.discard(user_session.user_id)
+
+    def stats(self):
+        with self.lock:
+            user_sessions = list(self.sessions.values())
+        return {
+            "sessions": len(user_sessions),
+            "active_videos": sum(1 for s in user_sessions if s.video_active),
+            "streams": sum(s.streams for s in user_sessions),
+            "evicted": self.evicted,
+            "idle_timeout": self.idle_timeout
+        }
+
+
+sessions = SessionRegistry(SESSION_CONFIG['idle_timeout'])
+
+
+def is_admin_user():
+    """当前登录用户是否为管理员(STATS_CONFIG['admin_users'])"""
+    return session.get('username') in STATS_CONFIG['admin_users']
+
+
+def current_user_session():
+    """当前请求所属用户的会话（需在 login_required 保护的路由中调用）"""
+    return sessions.get(session['user_id'])
+
+
+def allowed_file(filename):
+    """检查文件扩展名是否允许"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def mjpeg_part(jpeg_bytes):
+    """将JPEG数据包装为multipart/x-mixed-replace的一帧"""
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + jpeg_bytes + b'\r\n')
+
+
+def encode_jpeg(frame, quality=95):
+    """将BGR图像编码为JPEG字节"""
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+def resize_to_width(frame, width):
+    """按目标宽度等比缩小，原图不宽于目标宽度时原样返回"""
+    height, frame_width = frame.shape[:2]
+    if width is None or frame_width <= width:
+        return frame
+    return cv2.resize(frame, (width, max(1, round(height * width / frame_width))), interpolation=cv2.INTER_AREA)
+
+
+class EncodedFrame:
+    """一帧标注后的画面，按编码档位缓存JPEG
+
+    同一帧对每个 (宽度, 质量) 只缩放、编码一次，使用相同档位的观看者共享编码结果；
+    广播缓冲区只保留最新一帧，缓存随帧一起释放。
+    """
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.lock = threading.Lock()
+        self.encoded = {}
+
+    def jpeg(self, profile):
+        key = (profile['width'], profile['quality'])
+        with self.lock:
+            data = self.encoded.get(key)
+            if data is None:
+                data = encode_jpeg(resize_to_width(self.frame, profile['width']), profile['quality'])
+                self.encoded[key] = data
+            return data
+
+
+def encode_frame(frame):
+    """包装为 EncodedFrame 并预先编码默认档位(本机画面使用的档位)"""
+    encoded = EncodedFrame(frame)
+    encoded.jpeg(ENCODING_PROFILES[STREAM_CONFIG['default_profile']])
+    return encoded
+
+
+class StreamViewer:
+    """单个 /video_feed 观看者的编码档位
+
+    按观看者请求的档位限制帧率；每帧记录发送耗时，平均发送耗时过长(客户端发送缓冲区积压)时降低一档，
+    一段时间没有积压后逐档恢复，但不会高于请求的档位。
+    """
+
+    def __init__(self, profile_name):
+        names = list(ENCODING_PROFILES)
+        if profile_name not in ENCODING_PROFILES:
+            profile_name = STREAM_CONFIG['default_profile']
+        self.requested = names.index(profile_name)
+        self.level = self.requested
+        self.send_time = 0.0
+        self.last_congested = time.time()
+        self.last_sent = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.step_downs = 0
+        self.started_at = time.time()
+
+    @property
+    def name(self):
+        return list(ENCODING_PROFILES)[self.level]
+
+    @property
+    def profile(self):
+        return ENCODING_PROFILES[self.name]
+
+    def wait_time(self):
+        """距离按最高帧率允许发送下一帧还需等待的秒数"""
+        max_fps = self.profile['max_fps']
+        if not max_fps:
+            return 0
+        return max(0.0, self.last_sent + 1.0 / max_fps - time.time())
+
+    def record_send(self, started, size):
+        """记录一帧的发送耗时，必要时调整档位"""
+        now = time.time()
+        self.last_sent = now
+        self.frames_sent += 1
+        self.bytes_sent += size
+
+        # 服务器的发送缓冲区排空前后，单帧发送耗时会时长时短，因此按平滑后的平均耗时判断
+        duration = now - started
+        self.send_time += STREAM_CONFIG['send_smoothing'] * (duration - self.send_time)
+        if duration > STREAM_CONFIG['slow_send']:
+            self.last_congested = now
+        if self.send_time > STREAM_CONFIG['slow_send']:
+            if self.level < len(ENCODING_PROFILES) - 1:
+                self.level += 1
+                self.step_downs += 1
+                print(f"[视频流] 客户端发送积压，降为 {self.name} 档")
+            self.send_time = 0.0
+            return
+
+        if self.level > self.requested and now - self.last_congested > STREAM_CONFIG['step_up_after']:
+            self.level -= 1
+            self.last_congested = now
+            print(f"[视频流] 网络恢复，升为 {self.name} 档")
+
+    def stats(self):
+        elapsed = time.time() - self.started_at
+        return {
+            "requested": list(ENCODING_PROFILES)[self.requested],
+            "profile": self.name,
+            "frames_sent": self.frames_sent,
+            "step_downs": self.step_downs,
+            "kbps": round(self.bytes_sent * 8 / 1000 / elapsed, 1) if elapsed > 0 else 0
+        }
+
+
+def viewer_profile_name(user_session, requested=None):
+    """观看者的编码档位：优先使用请求参数 ?profile=，否则家属端用户默认使用较低的档位"""
+    if requested in ENCODING_PROFILES:
+        return requested
+    if user_session.settings.get('user_mode') == '家属端':
+        return STREAM_CONFIG['family_profile']
+    return STREAM_CONFIG['default_profile']
+
+
+def detect_container(header):
+    """根据文件头识别视频容器格式，无法识别返回None"""
+    if len(header) >= 12 and header[:4] == b'RIFF' and header[8:12] == b'AVI ':
+        return 'avi'
+    if header[:4] == b'\x1a\x45\xdf\xa3':
+        return 'matroska'  # mkv / webm
+    if header[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip'):
+        return 'mp4'  # mp4 / mov
+    return None
+
+
+def probe_video(file_path):
+    """打开视频并读取前几帧，确认可以正常解码，返回 (是否成功, 错误信息)"""
+    test_cap = cv2.VideoCapture(file_path)
+    if not test_cap.isOpened():
+        test_cap.release()
+        return False, "无法打开视频文件，请检查文件格式或尝试其他视频"
+
+    # 读取几帧确认真的可以读取
+    read_success = False
+    for _ in range(5):  # 尝试读取前5帧
+        ret, _ = test_cap.read()
+        if ret:
+            read_success = True
+            break
+
+    test_cap.release()
+
+    if not read_success:
+        return False, "视频文件无法正常读取帧，请尝试其他视频"
+    return True, ""
+
+
+class ChunkedUpload:
+    """一次可续传的分块上传
+
+    分块按偏移顺序直接写入磁盘，不在内存中缓存整个文件；
+    收到文件头后即可开始分析，分析线程通过 wait_for_data 等待后续数据到达。
+    """
+
+    HEADER_SIZE = 12
+
+    def __init__(self, upload_id, user_session, file_path, size):
+        self.upload_id = upload_id
+        self.user_session = user_session
+        self.file_path = file_path
+        self.size = size
+        self.received = 0
+        self.container = None
+        self.state = 'uploading'  # uploading / complete / failed
+        self.writing = False
+        self.condition = threading.Condition()
+        self.last_activity = time.time()
+        open(file_path, 'wb').close()
+
+    def in_progress(self):
+        return self.state == 'uploading'
+
+    def write(self, offset, stream):
+        """从 offset 处写入请求体中的数据，返回 (是否成功, 信息)
+
+        offset 必须等于已接收的字节数；传输中途断开时已写入的部分仍然有效，
+        客户端查询 received 后从断点继续上传即可。
+        """
+        with self.condition:
+            if not self.in_progress():
+                return False, "上传已结束"
+            if self.writing:
+                return False, "该上传已有分块正在写入"
+            if offset != self.received:
+                return False, f"分块偏移不匹配，已接收 {self.received} 字节"
+            self.writing = True
+
+        try:
+            with open(self.file_path, 'r+b') as f:
+                f.seek(offset)
+                while True:
+                    block = stream.read(UPLOAD_CONFIG['block_size'])
+                    if not block:
+                        break
+                    if self.received + len(block) > min(self.size, app.config['MAX_CONTENT_LENGTH']):
+                        return False, "上传数据超出声明的文件大小或300MB限制"
+                    f.write(block)
+                    f.flush()
+                    with self.condition:
+                        self.received += len(block)
+                        self.last_activity = time.time()
+                        self.condition.notify_all()
+            return True, "分块已写入"
+        finally:
+            with self.condition:
+                self.writing = False
+
+    def check_header(self):
+        """文件头到达后识别容器格式，返回 (是否成功, 信息)；数据不足时视为成功"""
+        if self.container is not None or self.received < self.HEADER_SIZE:
+            return True, ""
+        with open(self.file_path, 'rb') as f:
+            header = f.read(self.HEADER_SIZE)
+        self.container = detect_container(header)
+        if self.container is None:
+            return False, "文件内容不是有效的视频格式"
+        return True, ""
+
+    def finish(self):
+        """所有分块上传完毕"""
+        with self.condition:
+            self.state = 'complete'
+            self.condition.notify_all()
+
+    def fail(self):
+        """作废上传：停止依赖它的分析并删除文件"""
+        with self.condition:
+            self.state = 'failed'
+            self.condition.notify_all()
+        self.user_session.finish_video(self.file_path)
+        if os.path.exists(self.file_path):
+            try:
+                os.remove(self.file_path)
+            except Exception as e:
+                print(f"[上传] 无法删除未完成的文件: {e}")
+
+    def wait_for_data(self, known_size, timeout):
+        """等待文件增长超过 known_size 或上传结束，数据有增长或上传结束时返回True"""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.received > known_size or not self.in_progress(), timeout)
+
+    def status(self):
+        return {
+            "upload_id": self.upload_id,
+            "received": self.received,
+            "size": self.size,
+            "state": self.state,
+            "container": self.container
+        }
+
+
+# 分块上传，格式: {upload_id: ChunkedUpload}
+chunked_uploads = {}
+chunked_uploads_lock = threading.Lock()
+
+
+def sweep_chunked_uploads():
+    """作废长时间没有新分块的上传，清理已结束的上传记录"""
+    now = time.time()
+    with chunked_uploads_lock:
+        expired = [upload for upload in chunked_uploads.values()
+                   if now - upload.last_activity > UPLOAD_CONFIG['stale_timeout']]
+        for upload in expired:
+            del chunked_uploads[upload.upload_id]
+    for upload in expired:
+        if upload.in_progress():
+            print(f"[上传] 上传超时作废: {upload.file_path}")
+            upload.fail()
+
+
+def find_growing_upload(video_path):
+    """返回仍在上传中的 video_path 对应的分块上传，没有时返回None"""
+    with chunked_uploads_lock:
+        for upload in chunked_uploads.values():
+            if upload.file_path == video_path and upload.in_progress():
+                return upload
+    return None
+
+
+class GrowingVideoCapture:
+    """读取仍在上传中的视频，接口与 cv2.VideoCapture 的 read/isOpened/release 相同
+
+    读到当前文件末尾时等待新数据，再重新打开文件并跳到已读帧之后继续解码。
+    分段MP4、MKV/WebM、AVI 可以边传边分析；moov 位于文件末尾的普通MP4要等上传完成才能打开。
+    """
+
+    def __init__(self, upload):
+        self.upload = upload
+        self.cap = None
+        self.opened_size = 0
+        self.frames_read = 0
+        self.released = False
+
+    def _wait_for_data(self):
+        """等待文件增长，上传结束或长时间没有新数据时返回False"""
+        deadline = time.time() + UPLOAD_CONFIG['stall_timeout']
+        while not self.released and time.time() < deadline:
+            if self.upload.wait_for_data(self.opened_size, 1.0):
+                if self.upload.in_progress():
+                    # 多攒一些数据再重新打开，避免每写入一个数据块就重新打开一次文件
+                    time.sleep(UPLOAD_CONFIG['reopen_interval'])
+                return self.upload.received > self.opened_size
+        return False
+
+    def open(self):
+        """打开(或重新打开)文件并跳过已读的帧，成功返回True"""
+        while not self.released:
+            if self.cap is not None:
+                self.cap.release()
+            self.opened_size = self.upload.received
+            self.cap = cv2.VideoCapture(self.upload.file_path)
+            if self.cap.isOpened():
+                if self.frames_read:
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.frames_read)
+                return True
+            if not self._wait_for_data():
+                return False
+        return False
+
+    def isOpened(self):
+        return not self.released and self.cap is not None and self.cap.isOpened()
+
+    def read(self):
+        while not self.released:
+            ret, frame = self.cap.read()
+            if ret:
+                self.frames_read += 1
+                return ret, frame
+            # 已读到打开时的文件末尾：等待新数据后重新打开，没有更多数据才真正结束
+            if not self._wait_for_data() or not self.open():
+                break
+        return False, None
+
+    def release(self):
+        self.released = True
+        if self.cap is not None:
+            self.cap.release()
+
+
+def open_video_capture(video_path):
+    """打开视频文件，失败时尝试使用ffmpeg后端，仍失败返回None
+
+    视频仍在分块上传中时返回 GrowingVideoCapture，边接收边分析。
+    """
+    upload = find_growing_upload(video_path)
+    if upload is not None:
+        cap = GrowingVideoCapture(upload)
+        return cap if cap.open() else None
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"无法打开视频: {video_path}")
+        # 尝试使用ffmpeg参数打开
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+        if not cap.isOpened():
+            return None
+    return cap
+
+
+class LatestFrame:
+    """只保留最新一帧的缓冲区
+
+    采集端不断覆盖旧帧，分析端每次取到的都是最新画面；
+    分析跟不上采集速度时积压的旧帧被直接丢弃，不会分析过时的画面。
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.captured_at = None
+        self.seq = 0
+        self.taken_seq = 0
+        self.dropped = 0
+
+    def put(self, frame, captured_at):
+        with self.condition:
+            if self.seq > self.taken_seq:
+                self.dropped += 1
+            self.seq += 1
+            self.frame = frame
+            self.captured_at = captured_at
+            self.condition.notify_all()
+
+    def take(self, timeout):
+        """取出尚未取过的最新帧 (帧, 采集时间)，超时返回 (None, None)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > self.taken_seq, timeout)
+            if self.seq == self.taken_seq:
+                return None, None
+            self.taken_seq = self.seq
+            return self.frame, self.captured_at
+
+
+class FrameSource:
+    """分析流水线的视频帧来源
+
+    read() 返回 (是否成功, 帧, 采集时间)；实时来源(live)只提供最新帧，
+    分析完每帧后通过 record_latency 记录 采集->引导 的延迟。
+    """
+
+    kind = 'file'
+    live = False
+
+    def __init__(self, name):
+        self.name = name
+        self.frames_read = 0
+        self.latencies = collections.deque(maxlen=LIVE_SOURCE_CONFIG['latency_window'])
+
+    def read(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def end_reason(self):
+        """read() 失败时的结束原因"""
+        return 'source_lost'
+
+    def record_latency(self, captured_at):
+        self.latencies.append(time.time() - captured_at)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        stats = {
+            "kind": self.kind,
+            "name": self.name,
+            "frames": self.frames_read,
+            "latency_ms": None
+        }
+        if latencies:
+            stats["latency_ms"] = {
+                "last": round(self.latencies[-1] * 1000, 1),
+                "mean": round(sum(latencies) / len(latencies) * 1000, 1),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1)
+            }
+        return stats
+
+
+class FileSource(FrameSource):
+    """上传的视频文件(包括仍在分块上传中的文件)，按顺序读取每一帧"""
+
+    def __init__(self, cap, video_path):
+        super().__init__(os.path.basename(video_path))
+        self.cap = cap
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return False, None, None
+        self.frames_read += 1
+        return True, frame, time.time()
+
+    def release(self):
+        self.cap.release()
+
+    def end_reason(self):
+        # 如果连前10帧都读不出来，认为文件损坏
+        return 'read_error' if self.frames_read < 9 else 'finished'
+
+
+class LiveSource(FrameSource):
+    """实时来源的公共部分：从 LatestFrame 中取最新帧，用户切换视频源后停止"""
+
+    live = True
+
+    def __init__(self, name, is_active, timeout=None):
+        super().__init__(name)
+        self.buffer = LatestFrame()
+        self.is_active = is_active
+        self.timeout = timeout
+        self.stopped = threading.Event()
+
+    def read(self):
+        """等待下一帧；超过 timeout 秒没有新帧、来源已断开或用户切换了视频源时返回失败"""
+        waited = 0
+        while not self.stopped.is_set() and self.is_active() and self._connected():
+            frame, captured_at = self.buffer.take(1.0)
+            if frame is not None:
+                self.frames_read += 1
+                return True, frame, captured_at
+            waited += 1
+            if self.timeout and waited >= self.timeout:
+                break
+        return False, None, None
+
+    def _connected(self):
+        return True
+
+    def release(self):
+        self.stopped.set()
+
+    def stats(self):
+        stats = super().stats()
+        stats["dropped"] = self.buffer.dropped
+        return stats
+
+
+class CaptureSource(LiveSource):
+    """本地摄像头或 RTSP/HTTP(MJPEG) 网络流
+
+    后台线程持续读取并只保留最新一帧，避免 OpenCV/网络缓冲中积压的旧帧被分析；
+    读取失败时按指数退避重新连接，连续失败 reconnect_attempts 次后放弃。
+    """
+
+    def __init__(self, target, is_active):
+        # 日志和统计中不显示地址里的用户名和密码
+        super().__init__(str(target).rsplit('@', 1)[-1], is_active)
+        self.kind = 'camera' if isinstance(target, int) else 'stream'
+        self.target = target
+        self.cap = None
+        self.lost = False
+        self.reconnects = 0
+        self.thread = threading.Thread(target=self._grab_loop, daemon=True)
+
+    def open(self):
+        """首次连接，失败返回False"""
+        self.cap = cv2.VideoCapture(self.target)
+        if not self.cap.isOpened():
+            self.cap.release()
+            return False
+        self.thread.start()
+        return True
+
+    def _running(self):
+        return not self.stopped.is_set() and self.is_active()
+
+    def _reconnect(self, failures):
+        """等待退避时间后重新连接，成功返回True"""
+        delay = min(LIVE_SOURCE_CONFIG['reconnect_delay'] * 2 ** (failures - 1),
+                    LIVE_SOURCE_CONFIG['max_reconnect_delay'])
+        if self.stopped.wait(delay) or not self.is_active():
+            return False
+        print(f"[视频源] 第{failures}次重新连接: {self.name}")
+        self.cap = cv2.VideoCapture(self.target)
+        return self.cap.isOpened()
+
+    def _grab_loop(self):
+        failures = 0
+        try:
+            while self._running():
+                ret, frame = self.cap.read()
+                if ret:
+                    failures = 0
+                    self.buffer.put(frame, time.time())
+                    continue
+
+                # 断线重连；连接成功但读不到帧同样计为一次失败，避免无退避地反复重连
+                self.cap.release()
+                failures += 1
+                while self._running():
+                    if failures > LIVE_SOURCE_CONFIG['reconnect_attempts'] > 0:
+                        print(f"[视频源] 多次重连失败，放弃: {self.name}")
+                        return
+                    if self._reconnect(failures):
+                        self.reconnects += 1
+                        break
+                    self.cap.release()
+                    failures += 1
+        finally:
+            self.lost = True
+            self.cap.release()
+
+    def _connected(self):
+        return not self.lost
+
+    def stats(self):
+        stats = super().stats()
+        stats["reconnects"] = self.reconnects
+        return stats
+
+
+class PushedFrameSource(LiveSource):
+    """浏览器推送的帧(WebSocket 或 HTTP POST)，推送端写入用户会话的 LatestFrame"""
+
+    kind = 'push'
+
+    def __init__(self, user_session, is_active):
+        super().__init__(f"用户{user_session.user_id}", is_active, LIVE_SOURCE_CONFIG['push_timeout'])
+        self.buffer = user_session.pushed_frames
+
+
+def decode_pushed_frame(data):
+    """解码浏览器推送的JPEG帧，失败返回None"""
+    if not data:
+        return None
+    try:
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except cv2.error:
+        return None
+
+
+def is_live_source(video_path):
+    """视频源标识是否指向实时视频源而不是上传的文件"""
+    return '://' in video_path or video_path.startswith(('camera:', 'push:'))
+
+
+def stream_host_allowed(host):
+    """视频流主机是否在 allowed_stream_hosts 中：主机名完全一致，或解析出的全部地址都在某个允许的网段内"""
+    host = host.lower()
+    networks = []
+    for entry in LIVE_SOURCE_CONFIG['allowed_stream_hosts']:
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            if host == entry.lower():
+                return True
+    if not networks:
+        return False
+    try:
+        addresses = {ipaddress.ip_address(info[4][0].split('%', 1)[0]) for info in socket.getaddrinfo(host, None)}
+    except (OSError, ValueError):
+        return False
+    return bool(addresses) and all(any(address in network for network in networks) for address in addresses)
+
+
+def live_source_key(data, user_session, is_admin=False):
+    """根据 /start_live 请求生成视频源标识，返回 (标识, 错误信息)
+
+    服务器摄像头只对管理员开放；视频流对管理员开放，普通用户只能连接 allowed_stream_hosts 中的主机。
+    """
+    source = data.get('source')
+    if source == 'camera':
+        if not LIVE_SOURCE_CONFIG['allow_camera'] or not is_admin:
+            return None, "服务器未开放本地摄像头"
+        index = data.get('index', 0)
+        if not isinstance(index, int) or isinstance(index, bool) or index < 0:
+            return None, "摄像头编号无效"
+        return f"camera:{index}", ""
+    if source == 'stream':
+        url = str(data.get('url', '')).strip()
+        if url.split('://', 1)[0].lower() not in LIVE_SOURCE_CONFIG['allowed_schemes'] or '://' not in url:
+            return None, f"视频流地址无效，支持的协议: {', '.join(LIVE_SOURCE_CONFIG['allowed_schemes'])}"
+        try:
+            host = urllib.parse.urlsplit(url).hostname
+        except ValueError:
+            host = None
+        if not host:
+            return None, "视频流地址无效"
+        if not is_admin and not stream_host_allowed(host):
+            return None, "该视频流地址不在允许的范围内"
+        return url, ""
+    if source == 'push':
+        return f"push:{user_session.user_id}", ""
+    return None, "未知的视频源类型"
+
+
+def open_frame_source(video_path, user_session):
+    """按视频源标识打开帧来源，无法打开时返回None
+
+    标识可以是上传文件路径、camera:<编号>、rtsp/http 地址或 push:<用户ID>。
+    """
+    def is_active():
+        return user_session.is_playing(video_path)
+
+    if video_path.startswith('push:'):
+        return PushedFrameSource(user_session, is_active)
+
+    if video_path.startswith('camera:'):
+        source = CaptureSource(int(video_path.split(':', 1)[1]), is_active)
+    elif '://' in video_path:
+        source = CaptureSource(video_path, is_active)
+    else:
+        cap = open_video_capture(video_path)
+        return FileSource(cap, video_path) if cap is not None else None
+
+    return source if source.open() else None
+
+
+def end_of_stream(user_session, video_path, reason, detail=""):
+    """视频流结束时更新用户会话状态，并返回要推送给前端的最后一帧(PlaceholderFrame)"""
+    user_session.finish_video(video_path)
+    speech_text = user_session.speech_text
+    if reason == 'open_error':
+        frame = PlaceholderFrame(f"无法打开视频文件: {detail}", 'error')
+        speech_text.publish("视频无法打开，请尝试上传其他格式的视频。")
+    elif reason == 'read_error':
+        frame = PlaceholderFrame("视频文件损坏或格式不支持", 'error')
+        speech_text.publish("视频文件损坏或格式不支持，请尝试其他视频。")
+    elif reason == 'error':
+        frame = PlaceholderFrame(f"视频处理错误: {detail}", 'error')
+        speech_text.publish("视频处理出错，请尝试上传其他视频。")
+    elif reason == 'source_error':
+        frame = PlaceholderFrame(f"无法连接视频源: {detail}", 'error')
+        speech_text.publish("无法连接实时视频，请检查摄像头或网络。")
+    elif reason == 'source_lost':
+        frame = PlaceholderFrame("实时视频连接中断", 'error')
+        speech_text.publish("实时视频连接中断，请检查摄像头或网络后重新开始。")
+    else:  # finished
+        frame = PlaceholderFrame("视频已播放完毕，请上传新视频", 'info')
+        speech_text.publish("视频播放完毕，请上传新视频。")
+    return frame
+
+
+def letterbox(frame, imgsz):
+    """与YOLO预处理相同：等比缩放后用灰色(114)填充为 imgsz x imgsz，返回 (图像, 缩放比例, (左填充, 上填充))"""
+    height, width = frame.shape[:2]
+    scale = min(imgsz / height, imgsz / width)
+    new_width, new_height = int(round(width * scale)), int(round(height * scale))
+    if (new_width, new_height) != (width, height):
+        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (imgsz - new_width) / 2, (imgsz - new_height) / 2
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    frame = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return frame, scale, (left, top)
+
+
+def preprocess_frames(frames, imgsz):
+    """BGR帧 -> 模型输入 (N, 3, imgsz, imgsz) float32，同时返回每帧的 (缩放比例, 填充, 原始尺寸)"""
+    images = []
+    metas = []
+    for frame in frames:
+        image, scale, pad = letterbox(frame, imgsz)
+        images.append(image[:, :, ::-1].transpose(2, 0, 1))
+        metas.append((scale, pad, frame.shape[:2]))
+    return np.ascontiguousarray(np.stack(images), dtype=np.float32) / 255.0, metas
+
+
+def postprocess_output(output, metas, conf_threshold, iou_threshold, max_det=300):
+    """解析YOLOv8检测头输出 (N, 4+类别数, 锚点数)，按类别做NMS并映射回原图坐标
+
+    返回与 extract_detections 相同格式的 (M, 6) 数组列表：x1, y1, x2, y2, conf, cls。
+    """
+    detections = []
+    for prediction, (scale, (left, top), (height, width)) in zip(output, metas):
+        prediction = prediction.T
+        scores = prediction[:, 4:]
+        classes = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), classes]
+        keep = confidences > conf_threshold
+        prediction, classes, confidences = prediction[keep], classes[keep], confidences[keep]
+
+        boxes = np.empty((len(prediction), 4), dtype=np.float32)
+        boxes[:, :2] = prediction[:, :2] - prediction[:, 2:4] / 2
+        boxes[:, 2:] = prediction[:, :2] + prediction[:, 2:4] / 2
+
+        # 不同类别的框平移到互不重叠的区域，一次NMS即可实现按类别NMS
+        offset_boxes = boxes + classes[:, None] * 7680.0
+        xywh = np.hstack([offset_boxes[:, :2], offset_boxes[:, 2:] - offset_boxes[:, :2]])
+        indices = cv2.dnn.NMSBoxes(xywh.tolist(), confidences.tolist(), conf_threshold, iou_threshold)
+        indices = np.array(indices, dtype=int).reshape(-1)[:max_det]
+
+        boxes = (boxes[indices] - [left, top, left, top]) / scale
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        detections.append(np.hstack([
+            boxes,
+            confidences[indices, None],
+            classes[indices, None]
+        ]).astype(np.float32))
+    return detections
+
+
+class ExportedDetector:
+    """运行导出模型(ONNX Runtime / OpenVINO)的检测器
+
+    调用方式与 YOLO 模型相同：model(frame) 或 model([frame, ...])，
+    每帧返回一个 (N, 6) 检测数组，extract_detections 可以直接处理。
+    """
+
+    def __init__(self, path, backend, names, imgsz, config):
+        self.path = path
+        self.backend = backend
+        self.names = names
+        self.imgsz = imgsz
+        self.conf = config['conf']
+        self.iou = config['iou']
+        self.int8 = False
+        if backend == 'onnx':
+            import onnxruntime
+            self.session = onnxruntime.InferenceSession(path, providers=onnxruntime.get_available_providers())
+            self.input_name = self.session.get_inputs()[0].name
+        else:
+            import openvino
+            self.compiled = openvino.Core().compile_model(path, 'CPU')
+            self.output = self.compiled.output(0)
+
+    def __call__(self, source, imgsz=None, **kwargs):
+        # 导出时使用动态输入尺寸，推理时可以换用其他 imgsz
+        frames = source if isinstance(source, list) else [source]
+        blob, metas = preprocess_frames(frames, imgsz or self.imgsz)
+        if self.backend == 'onnx':
+            output = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            output = self.compiled([blob])[self.output]
+        return postprocess_output(output, metas, self.conf, self.iou)
+
+
+def load_calibration_frames(source, count):
+    """从视频文件或图片/视频目录中均匀抽取 count 帧作为INT8校准数据"""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in sorted(os.listdir(source))]
+    else:
+        paths = [source]
+
+    images = [p for p in paths if p.rsplit('.', 1)[-1].lower() in ('jpg', 'jpeg', 'png', 'bmp')]
+    videos = [p for p in paths if p.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS]
+    frames = [cv2.imread(p) for p in images[:count]]
+
+    per_video = (count - len(frames)) // len(videos) + 1 if videos else 0
+    for video in videos:
+        cap = cv2.VideoCapture(video)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for index in np.linspace(0, max(total - 1, 0), per_video).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = cap.read()
+            if ret:
+                frames.append(frame)
+        cap.release()
+
+    return [frame for frame in frames if frame is not None][:count]
+
+
+class FrameCalibrationReader:
+    """ONNX Runtime 静态量化的校准数据读取器，逐帧提供预处理后的模型输入"""
+
+    def __init__(self, input_name, frames, imgsz):
+        self.inputs = iter([{input_name: preprocess_frames([frame], imgsz)[0]} for frame in frames])
+
+    def get_next(self):
+        return next(self.inputs, None)
+
+
+def quantize_onnx(onnx_path, output_path, frames, imgsz):
+    """用 ONNX Runtime 做INT8静态量化(QDQ格式)"""
+    import onnxruntime
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+
+    input_name = onnxruntime.InferenceSession(onnx_path).get_inputs()[0].name
+    quantize_static(onnx_path, output_path, FrameCalibrationReader(input_name, frames, imgsz),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+
+def quantize_openvino(ov_model, frames, imgsz):
+    """用 NNCF 对 OpenVINO 模型做INT8训练后量化"""
+    import nncf
+
+    dataset = nncf.Dataset(frames, lambda frame: preprocess_frames([frame], imgsz)[0])
+    return nncf.quantize(ov_model, dataset, subset_size=len(frames), preset=nncf.QuantizationPreset.MIXED)
+
+
+def exported_model_path(config):
+    """导出模型的缓存路径，文件名包含输入尺寸和是否量化"""
+    name = os.path.splitext(os.path.basename(config['weights']))[0]
+    name = f"{name}_{config['imgsz']}{'_int8' if config['int8'] else ''}"
+    extension = '.onnx' if config['backend'] == 'onnx' else '.xml'
+    return os.path.join(config['export_dir'], name + extension)
 
 
-# 修改更新设置接口以支持数据库
-@app.route('/update_settings', methods=['POST'])
-@login_required
-def update_settings():
-    """更新用户设置"""
-    global user_settings
+def cached_export_info(config, path):
+    """读取导出模型旁的说明文件；权重文件在导出后被更新过时视为缓存失效，返回None"""
+    info_path = os.path.splitext(path)[0] + '.json'
+    if not os.path.exists(path) or not os.path.exists(info_path):
+        return None
+    with open(info_path, 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    if info.get('weights_mtime') != os.path.getmtime(config['weights']):
+        return None
+    return info
 
-    data = request.get_json()
-    if not data:
-        return jsonify({"status": "error", "message": "未接收到设置数据"}), 400
 
-    # 更新设置
-    for key in user_settings.keys():
-        if key in data:
-            user_settings[key] = data[key]
+def export_model(config, path):
+    """将 .pt 权重导出为ONNX，再按配置转换为OpenVINO IR和/或做INT8量化，返回说明信息
 
-    # 保存设置
+    所有中间文件都写在 export_dir 下的临时目录中(ultralytics 把ONNX写在权重文件旁边，
+    因此先把权重复制进去)，完成后用 os.replace 把模型文件逐个移到最终位置，说明文件最后移入；
+    其他进程要么看不到缓存，要么看到完整的导出结果，不会读到写了一半的文件。
+    """
+    from ultralytics import YOLO
+    os.makedirs(config['export_dir'], exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='export_', dir=config['export_dir'])
     try:
-        user_id = session.get('user_id')
-        # 只更新数据库，移除save_settings调用
-        success, message = update_user_settings_in_db(user_id, user_settings)
-        if not success:
-            return jsonify({"status": "error", "message": message}), 500
-    except Exception as e:
-        return jsonify({"status": "error", "message": f"保存设置失败: {str(e)}"}), 500
-
-    return jsonify({
-        "status": "success",
-        "message": "设置已更新",
-        "settings": user_settings
-    })
+        weights = os.path.join(work_dir, os.path.basename(config['weights']))
+        shutil.copy2(config['weights'], weights)
+        pt_model = YOLO(weights)
+        exported = pt_model.export(format='onnx', imgsz=config['imgsz'], dynamic=True)
+        onnx_path = str(exported[0] if isinstance(exported, (list, tuple)) else exported)
+
+        frames = []
+        if config['int8']:
+            frames = load_calibration_frames(config['calibration_source'], config['calibration_samples'])
+            if not frames:
+                raise RuntimeError(f"INT8量化需要校准帧，但 {config['calibration_source']} 中没有可用的图片或视频")
+            print(f"[模型] 使用 {len(frames)} 帧做INT8校准")
+
+        stem = os.path.splitext(os.path.basename(path))[0]
+        work_path = os.path.join(work_dir, 'output', os.path.basename(path))
+        os.makedirs(os.path.dirname(work_path))
+        if config['backend'] == 'onnx':
+            if config['int8']:
+                quantize_onnx(onnx_path, work_path, frames, config['imgsz'])
+            else:
+                shutil.copyfile(onnx_path, work_path)
+        else:
+            import openvino
+            ov_model = openvino.convert_model(onnx_path)
+            if config['int8']:
+                ov_model = quantize_openvino(ov_model, frames, config['imgsz'])
+            openvino.save_model(ov_model, work_path)
+
+        info = {
+            "backend": config['backend'],
+            "imgsz": config['imgsz'],
+            "int8": config['int8'],
+            "names": {str(k): v for k, v in pt_model.names.items()},
+            "weights_mtime": os.path.getmtime(config['weights'])
+        }
+        with open(os.path.join(work_dir, 'output', stem + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+
+        # OpenVINO 的 .bin 先于 .xml 移入，说明文件(.json)最后移入，cached_export_info 以它为准
+        outputs = [stem + '.bin'] if config['backend'] == 'openvino' else []
+        outputs += [os.path.basename(path), stem + '.json']
+        for name in outputs:
+            os.replace(os.path.join(work_dir, 'output', name), os.path.join(os.path.dirname(path), name))
+        return info
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
 
-# AI提示模板
-def get_prompt_template():
-    gender_term = ""
-    age_term = ""
+def ensure_exported_model(config):
+    """返回导出模型的 (路径, 说明信息)，没有缓存或权重已更新时先导出"""
+    path = exported_model_path(config)
+    info = cached_export_info(config, path)
+    if info is None:
+        print(f"[模型] 导出 {config['backend']} 模型: {path}")
+        info = export_model(config, path)
+    return path, info
 
-    if user_settings["gender"] == "男":
-        gender_term = "先生"
-    elif user_settings["gender"] == "女":
-        gender_term = "女士"
 
-    if user_settings["age"] == "老年":
-        age_term = "年长的"
-    elif user_settings["age"] == "青年":
-        age_term = "年轻的"
+def prepare_model(config=None):
+    """在启动多个工作进程之前由父进程调用：确保导出模型的缓存存在，返回工作进程应使用的后端
 
-    prompt = f'''
-你是一个服务于盲人行走的语音导航小助手。
-你的用户是{age_term}{user_settings["name"]}{gender_term}。
-你通过告知盲人盲道的转向，注意一定要说清楚盲道转向方位（左？右？），确保盲人一直行走在盲道上，并适时给予一些关怀。
-注意，盲人因为看不见路面情况，所以才需要你的语音行走提示。
-你的语气要温柔且元气。
-'''
+    导出失败且允许退回时返回 'pytorch'，各工作进程就不会再各自尝试导出同一个文件。
+    """
+    config = config or MODEL_CONFIG
+    if config['backend'] == 'pytorch':
+        return 'pytorch'
+    try:
+        ensure_exported_model(config)
+        return config['backend']
+    except Exception as e:
+        if not config['fallback_to_pytorch']:
+            raise
+        print(f"[模型] 警告：{config['backend']} 模型导出失败，改用PyTorch: {e}")
+        return 'pytorch'
 
-    # 如果开启了鼓励功能，在提示词中添加相关要求
-    if user_settings["encourage"] == "开":
-        prompt += '''
-请在引导方向的同时，适当给予用户温暖的鼓励和正面的肯定，例如称赞他们走得好、进步明显，或者鼓励他们继续保持自信等。
-'''
 
-    return prompt
+def load_model(config=None):
+    """按配置加载检测模型
 
+    backend 为 pytorch 时直接加载 .pt 权重；为 onnx/openvino 时使用缓存的导出模型，
+    没有缓存或权重已更新时先导出。导出或加载失败时按 fallback_to_pytorch 退回 PyTorch 或抛出异常；
+    实际使用的后端见 describe_model。
+    """
+    from ultralytics import YOLO
 
-right_turn_question = "请用亲切且简短的话语告知要往右拐，因为盲道是往右拐的"
-left_turn_question = "请用亲切且简短的话语告知要往左拐，因为盲道是往左拐的"
+    config = config or MODEL_CONFIG
+    backend = config['backend']
+    if backend == 'pytorch':
+        return YOLO(config['weights'])
 
+    try:
+        path, info = ensure_exported_model(config)
+        names = {int(k): v for k, v in info['names'].items()}
+        detector = ExportedDetector(path, backend, names, info['imgsz'], config)
+        detector.int8 = info['int8']
+        print(f"[模型] 使用 {backend}{' INT8' if info['int8'] else ''} 后端: {path}")
+        return detector
+    except Exception as e:
+        if not config['fallback_to_pytorch']:
+            raise RuntimeError(f"{backend} 后端不可用: {e}") from e
+        print(f"[模型] 警告：{backend} 后端不可用，改用PyTorch: {e}")
+        return YOLO(config['weights'])
+
+
+def describe_model(detector, config=None):
+    """配置要求的后端和实际加载的后端，退回PyTorch时 fallback 为True"""
+    config = config or MODEL_CONFIG
+    exported = isinstance(detector, ExportedDetector)
+    loaded = detector.backend if exported else 'pytorch'
+    return {
+        "requested": config['backend'],
+        "loaded": loaded,
+        "int8": bool(exported and detector.int8),
+        "path": detector.path if exported else config['weights'],
+        "fallback": loaded != config['backend']
+    }
 
-def get_available_voices():
-    global voices_cache
-    if voices_cache is not None:
-        return voices_cache
 
-    engine = pyttsx3.init()
-    voices = engine.getProperty('voices')
-    available_voices = []
+# 模型在第一次检测时才加载(导入 torch/ultralytics 需要数秒)，只处理登录、设置等请求的进程不会加载模型
+model = None
+model_lock = threading.Lock()
+model_info = None  # describe_model 的结果，在 /pipeline_stats 的 startup 中返回
 
-    for voice in voices:
-        voice_info = {
-            'id': voice.id,
-            'name': voice.name,
-            'gender': '女声' if 'female' in voice.id.lower() or 'Microsoft Huihui' in voice.name else '男声'
-        }
-        available_voices.append(voice_info)
 
-    voices_cache = available_voices
-    return available_voices
+def get_model():
+    """获取全局检测模型，首次调用时加载；多个线程同时调用时只加载一次"""
+    global model, model_info
+    if model is None:
+        with model_lock:
+            if model is None:
+                started = time.perf_counter()
+                loaded = load_model()
+                record_startup_timing('model_load', started)
+                model_info = describe_model(loaded)
+                model = loaded
+    return model
 
 
-def speak(text):
-    """每个线程中创建新的 pyttsx3 实例进行语音合成"""
+def warmup_model():
+    """加载模型并对一帧空白图像做一次推理，让首次推理的额外开销(内存分配、算子初始化)发生在启动阶段"""
     try:
-        print(f"[语音] 开始合成语音: '{text}'")
-        local_engine = pyttsx3.init()
-
-        # 获取可用语音列表并打印
-        voices = local_engine.getProperty('voices')
-        print(f"[语音] 系统可用语音列表:")
-        for i, voice in enumerate(voices):
-            print(f"  语音{i + 1}: ID={voice.id}, 名称={voice.name}")
-
-        # 优先查找中文语音
-        found_chinese_voice = False
-        selected_voice = None
-
-        # 首先尝试找中文语音
-        for voice in voices:
-            voice_name = voice.name.lower()
-            # 检查是否包含中文相关关键词
-            if "chinese" in voice_name or "huihui" in voice_name or "china" in voice_name or "中文" in voice_name or "zhongwen" in voice_name:
-                selected_voice = voice.id
-                found_chinese_voice = True
-                print(f"[语音] 找到中文语音: {voice.name}")
+        detector = get_model()
+        started = time.perf_counter()
+        imgsz = MODEL_CONFIG['imgsz']
+        detector(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz)
+        record_startup_timing('warmup', started)
+    except Exception as e:
+        print(f"[启动] 模型预热失败: {e}")
+
+
+def start_warmup():
+    """按配置在后台线程中预热模型，不阻塞服务启动"""
+    if MODEL_CONFIG['warmup']:
+        threading.Thread(target=warmup_model, daemon=True).start()
+
+
+class BatchInferenceService:
+    """YOLO微批推理服务
+
+    收集来自一个或多个视频源的帧，凑满 max_batch_size 或等待超过 max_wait_ms 后
+    作为一个批次送入模型，再把每帧的结果分别返回给提交者。
+    """
+
+    def __init__(self, model, max_batch_size=4, max_wait_ms=15):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.frames = 0
+        self.total_wait = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        """提交一帧，返回 Future，结果为该帧的检测结果列表"""
+        future = concurrent.futures.Future()
+        self.requests.put((frame, future, time.time()))
+        return future
+
+    def _collect_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
                 break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.time()
+            try:
+                results = self.model([frame for frame, _, _ in batch], imgsz=MODEL_CONFIG['imgsz'])
+            except Exception as e:
+                print(f"[批量推理] 推理错误: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            with self.lock:
+                self.batches += 1
+                self.frames += len(batch)
+                self.total_wait += sum(started - submitted for _, _, submitted in batch)
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result([result])
+
+    def stats(self):
+        with self.lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "frames": self.frames,
+                "avg_batch_size": round(self.frames / self.batches, 2) if self.batches else 0,
+                "avg_wait_ms": round(self.total_wait / self.frames * 1000, 2) if self.frames else 0
+            }
+
+
+inference_service = None
+inference_service_lock = threading.Lock()
+
+
+def get_inference_service():
+    """获取全局微批推理服务，首次调用时创建"""
+    global inference_service
+    with inference_service_lock:
+        if inference_service is None:
+            inference_service = BatchInferenceService(
+                get_model(),
+                max_batch_size=INFERENCE_CONFIG['max_batch_size'],
+                max_wait_ms=INFERENCE_CONFIG['max_wait_ms']
+            )
+        return inference_service
+
+
+def run_inference_batch(frames):
+    """对多帧运行检测，返回与 frames 一一对应的检测结果列表"""
+    if not INFERENCE_CONFIG['batching']:
+        detector = get_model()
+        return [detector(frame, imgsz=MODEL_CONFIG['imgsz']) for frame in frames]
+
+    service = get_inference_service()
+    futures = [service.submit(frame) for frame in frames]
+    return [future.result() for future in futures]
+
 
-        # 如果找不到中文语音，使用第一个可用的声音
-        if not found_chinese_voice and len(voices) > 0:
-            selected_voice = voices[0].id
-            print(f"[语音] 未找到中文语音，使用第一个可用语音: {voices[0].name}")
+def extract_detections(results):
+    """从YOLO结果中一次性取出所有检测框，返回 (N, 6) 数组：x1, y1, x2, y2, conf, cls"""
+    arrays = []
+
+    for result in results:
+        if isinstance(result, np.ndarray):
+            # 导出模型的检测器直接返回 (N, 6) 数组
+            if len(result):
+                arrays.append(result)
+            continue
+        boxes = result.boxes
+        if len(boxes) == 0:
+            continue
+        arrays.append(np.hstack([
+            boxes.xyxy.cpu().numpy(),
+            boxes.conf.cpu().numpy()[:, None],
+            boxes.cls.cpu().numpy()[:, None]
+        ]))
+
+    if not arrays:
+        return np.zeros((0, 6), dtype=np.float32)
+    return np.vstack(arrays).astype(np.float32)
+
+
+def crop_roi(frame, roi):
+    """按相对比例 (左, 上, 右, 下) 裁剪检测区域，返回 (区域图像, (左偏移, 上偏移))；区域为整个画面时不复制"""
+    height, width = frame.shape[:2]
+    x1, y1 = int(roi[0] * width), int(roi[1] * height)
+    x2, y2 = int(round(roi[2] * width)), int(round(roi[3] * height))
+    if (x1, y1, x2, y2) == (0, 0, width, height):
+        return frame, (0, 0)
+    return np.ascontiguousarray(frame[y1:y2, x1:x2]), (x1, y1)
+
+
+def offset_detections(detections, offset):
+    """把检测区域内的检测框坐标平移回整个画面的坐标"""
+    if offset != (0, 0) and len(detections):
+        detections[:, :4] += (offset[0], offset[1], offset[0], offset[1])
+    return detections
+
+
+def detect_frames(frames):
+    """对多帧的检测区域运行检测，返回与 frames 一一对应的 (N, 6) 检测数组，坐标均为整个画面的坐标"""
+    crops = [crop_roi(frame, INFERENCE_CONFIG['roi']) for frame in frames]
+    results = run_inference_batch([crop for crop, _ in crops])
+    return [offset_detections(extract_detections(result), offset)
+            for result, (_, offset) in zip(results, crops)]
+
+
+@functools.lru_cache(maxsize=1024)
+def label_sprite(label):
+    """预渲染标签文字，返回 (不透明度图, 基线以上高度)
+
+    置信度保留两位小数，每个类别最多只有101种标签，渲染一次后反复使用，
+    避免每帧对每个框调用 cv2.putText。
+    """
+    (width, height), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
+    canvas = np.zeros((height + baseline + 2, width + 2), dtype=np.uint8)
+    cv2.putText(canvas, label, (1, height + 1), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 255, 2)
+    return (canvas.astype(np.float32) / 255)[:, :, None], height + 1
+
+
+def blit_sprite(frame, alpha, x, y, color):
+    """将预渲染的文字按指定颜色混合到帧的 (x, y) 处，超出画面的部分被裁掉"""
+    height, width = alpha.shape[:2]
+    frame_height, frame_width = frame.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + width, frame_width), min(y + height, frame_height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    region = frame[y0:y1, x0:x1]
+    alpha = alpha[y0 - y:y1 - y, x0 - x:x1 - x]
+    region[:] = (region * (1 - alpha) + np.array(color, dtype=np.float32) * alpha + 0.5).astype(np.uint8)
+
+
+def detection_centers(detections):
+    """检测框中心点组成的 (N, 2) 数组"""
+    return (detections[:, 0:2] + detections[:, 2:4]) / 2
+
+
+def draw_detections(frame, detections):
+    """在帧上绘制检测框，返回所有检测框中心点组成的 (N, 2) 数组"""
+    centers = detection_centers(detections)
+
+    if not OVERLAY_CONFIG['enabled'] or len(detections) == 0:
+        return centers
+
+    class_names = get_model().names
+    corners = detections[:, :4].astype(int)
+    labels = [f"{class_names[int(cls)]}: {conf:.2f}"
+              for conf, cls in zip(detections[:, 4].tolist(), detections[:, 5].tolist())]
+
+    for (x1, y1, x2, y2), label in zip(corners.tolist(), labels):
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        alpha, ascent = label_sprite(label)
+        blit_sprite(frame, alpha, x1 - 1, y1 - 5 - ascent, (0, 255, 0))
+
+    return centers
+
+
+def box_iou(boxes_a, boxes_b):
+    """计算两组检测框 (N,4) 与 (M,4) 之间的IoU矩阵"""
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+class BoxTracker:
+    """基于IoU匹配和匀速运动模型的轻量检测框跟踪器(纯NumPy)
+
+    检测帧调用 update()：按IoU贪心匹配已有轨迹并更新每条轨迹的速度；
+    跳过检测的帧调用 predict()：按速度外推所有轨迹的位置。
+    两者都返回与 extract_detections 相同格式的 (N, 6) 数组，供绘制和转向判断使用。
+    """
+
+    def __init__(self, config=None):
+        config = config or TRACKER_CONFIG
+        self.enabled = config['enabled']
+        self.iou_threshold = config['iou_threshold']
+        self.max_missed = config['max_missed']
+        self.smoothing = config['velocity_smoothing']
+        self.boxes = np.zeros((0, 4))  # 当前(外推后)位置
+        self.velocity = np.zeros((0, 4))  # 每帧位移
+        self.observed = np.zeros((0, 4))  # 最近一次被检测到的位置
+        self.gap = np.zeros(0)  # 距最近一次被检测到经过的帧数
+        self.missed = np.zeros(0, dtype=int)  # 连续未匹配的检测次数
+        self.conf = np.zeros(0)
+        self.cls = np.zeros(0, dtype=int)
+        self.last_detections = np.zeros((0, 6), dtype=np.float32)
+
+    def _output(self):
+        alive = self.missed == 0
+        return np.hstack([self.boxes[alive], self.conf[alive, None],
+                          self.cls[alive, None]]).astype(np.float32)
+
+    def _advance(self):
+        self.boxes = self.boxes + self.velocity
+        self.gap = self.gap + 1
+
+    def _match(self, detected):
+        """按IoU从大到小贪心匹配，返回 [(轨迹下标, 检测下标), ...]"""
+        if len(self.boxes) == 0 or len(detected) == 0:
+            return []
+        iou = box_iou(self.boxes, detected)
+        matches = []
+        used_tracks = set()
+        used_detections = set()
+        for flat in np.argsort(-iou, axis=None):
+            t, d = divmod(int(flat), iou.shape[1])
+            if iou[t, d] < self.iou_threshold:
+                break
+            if t in used_tracks or d in used_detections:
+                continue
+            used_tracks.add(t)
+            used_detections.add(d)
+            matches.append((t, d))
+        return matches
+
+    def update(self, detections):
+        """用新的检测结果更新轨迹"""
+        if not self.enabled:
+            self.last_detections = detections
+            return detections
+
+        # 先把已有轨迹外推到当前帧，再与检测框匹配
+        self._advance()
+        detected = detections[:, :4].astype(float)
+        det_conf = detections[:, 4].astype(float)
+        det_cls = detections[:, 5].astype(int)
+
+        matches = self._match(detected)
+        matched_tracks = np.array([t for t, _ in matches], dtype=int)
+        matched_dets = np.array([d for _, d in matches], dtype=int)
+
+        # 已匹配轨迹：以观测位移更新速度(指数平滑)
+        if len(matches):
+            step = (detected[matched_dets] - self.observed[matched_tracks]) / self.gap[matched_tracks, None]
+            self.velocity[matched_tracks] = (self.smoothing * step +
+                                             (1 - self.smoothing) * self.velocity[matched_tracks])
+            self.boxes[matched_tracks] = detected[matched_dets]
+            self.observed[matched_tracks] = detected[matched_dets]
+            self.gap[matched_tracks] = 0
+            self.conf[matched_tracks] = det_conf[matched_dets]
+            self.cls[matched_tracks] = det_cls[matched_dets]
+
+        # 未匹配轨迹：累计丢失次数，超过上限后删除
+        unmatched = np.ones(len(self.boxes), dtype=bool)
+        unmatched[matched_tracks] = False
+        self.missed[unmatched] += 1
+        self.missed[~unmatched] = 0
+        keep = self.missed <= self.max_missed
+
+        # 未匹配检测：新建轨迹
+        new = np.ones(len(detected), dtype=bool)
+        new[matched_dets] = False
+        self.boxes = np.vstack([self.boxes[keep], detected[new]])
+        self.velocity = np.vstack([self.velocity[keep], np.zeros((new.sum(), 4))])
+        self.observed = np.vstack([self.observed[keep], detected[new]])
+        self.gap = np.concatenate([self.gap[keep], np.zeros(new.sum())])
+        self.missed = np.concatenate([self.missed[keep], np.zeros(new.sum(), dtype=int)])
+        self.conf = np.concatenate([self.conf[keep], det_conf[new]])
+        self.cls = np.concatenate([self.cls[keep], det_cls[new]])
+
+        return self._output()
+
+    def predict(self):
+        """没有新检测结果的帧：按匀速模型外推轨迹位置"""
+        if not self.enabled:
+            return self.last_detections
+
+        self._advance()
+        return self._output()
+
+
+class DetectionScheduler:
+    """决定哪些帧需要运行YOLO检测
+
+    - every_frame: 每帧都检测
+    - interval: 每 interval 帧检测一次
+    - adaptive: 与上次检测帧相比画面变化(帧差能量)超过阈值，或连续跳过 max_skip 帧后才检测
+    未检测的帧沿用上一次的检测框，视频仍然逐帧推送。
+    """
+
+    def __init__(self, config=None):
+        config = config or DETECTION_CONFIG
+        self.mode = config['mode']
+        self.interval = max(1, config['interval'])
+        self.diff_threshold = config['diff_threshold']
+        self.max_skip = max(1, config['max_skip'])
+        self.frames = 0
+        self.inferences = 0
+        self.skipped = 0
+        self.reference = None
+        self.started_at = time.time()
+
+    def _thumbnail(self, frame):
+        small = cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+    def should_detect(self, frame):
+        self.frames += 1
+
+        if self.mode == 'interval':
+            detect = (self.frames - 1) % self.interval == 0
+        elif self.mode == 'adaptive':
+            thumbnail = self._thumbnail(frame)
+            if self.reference is None or self.skipped >= self.max_skip:
+                detect = True
+            else:
+                energy = np.abs(thumbnail - self.reference).mean()
+                detect = energy >= self.diff_threshold
+            if detect:
+                self.reference = thumbnail
+        else:
+            detect = True
 
-        # 设置选定的声音
-        if selected_voice:
-            print(f"[语音] 最终使用语音ID: {selected_voice}")
-            local_engine.setProperty('voice', selected_voice)
+        if detect:
+            self.inferences += 1
+            self.skipped = 0
         else:
-            print("[语音] 警告: 未找到可用语音")
-
-        # 根据用户设置调整语音速度
-        if user_settings["voice_speed"] == "慢":
-            local_engine.setProperty('rate', 150)
-        elif user_settings["voice_speed"] == "快":
-            local_engine.setProperty('rate', 250)
-        else:  # 中等
-            local_engine.setProperty('rate', 200)
-
-        # 设置音量 (新增功能)
-        volume_mapping = {
-            "低": 0.5,
-            "中等": 0.8,
-            "高": 1.0
+            self.skipped += 1
+        return detect
+
+    def stats(self):
+        elapsed = time.time() - self.started_at
+        return {
+            "mode": self.mode,
+            "frames": self.frames,
+            "inferences": self.inferences,
+            "inference_ratio": round(self.inferences / self.frames, 3) if self.frames else 0,
+            "inference_fps": round(self.inferences / elapsed, 2) if elapsed > 0 else 0
         }
-        volume = volume_mapping.get(user_settings["voice_volume"], 0.8)
-        local_engine.setProperty('volume', volume)
 
-        # 实际播放语音
-        print(f"[语音] 播放文本: {text}")
-        local_engine.say(text)
 
-        print("[语音] 开始runAndWait()...")
-        local_engine.runAndWait()
-        print("[语音] 播放完成")
-        return True
-    except Exception as e:
-        print(f"[语音] 错误: {e}")
-        import traceback
-        traceback.print_exc()
+class DirectionEstimator:
+    """滑动窗口上的增量线性回归 x = slope * y + intercept
+
+    每帧只把该帧所有中心点的加权累加和 (n, Σw, Σwy, Σwx, Σwy², Σwxy) 放入窗口，
+    窗口总和随帧进出增减，更新和求斜率都是 O(1)，转向判断基于最近多帧的证据。
+    """
+
+    def __init__(self, config=None):
+        config = config or DIRECTION_CONFIG
+        self.window = max(1, config['window_frames'])
+        self.min_points = max(2, config['min_points'])
+        self.weighted = config['confidence_weighting']
+        self.frames = collections.deque()
+        self.totals = np.zeros(6)
+        self.pushes = 0
+
+    def push(self, centers, confidences=None):
+        """加入一帧的检测框中心点 (N, 2) 及其置信度"""
+        xs = centers[:, 0].astype(np.float64)
+        ys = centers[:, 1].astype(np.float64)
+        if self.weighted and confidences is not None:
+            weights = confidences.astype(np.float64)
+        else:
+            weights = np.ones(len(centers))
+
+        sums = np.array([
+            len(centers),
+            weights.sum(),
+            (weights * ys).sum(),
+            (weights * xs).sum(),
+            (weights * ys * ys).sum(),
+            (weights * xs * ys).sum()
+        ])
+        self.frames.append(sums)
+        self.totals += sums
+        if len(self.frames) > self.window:
+            self.totals -= self.frames.popleft()
+
+        # 定期重新求和，避免反复加减累积浮点误差
+        self.pushes += 1
+        if self.pushes % self.window == 0:
+            self.totals = np.sum(self.frames, axis=0)
+
+    def reset(self):
+        self.frames.clear()
+        self.totals = np.zeros(6)
+
+    def fit(self):
+        """返回 (slope, intercept)，证据不足时返回 None"""
+        count, sw, swy, swx, swyy, swxy = self.totals
+        if count < self.min_points:
+            return None
+        denominator = sw * swyy - swy * swy
+        if sw <= 0 or abs(denominator) < 1e-9 * max(sw * swyy, 1.0):
+            return None
+        slope = (sw * swxy - swy * swx) / denominator
+        intercept = (swx - slope * swy) / sw
+        return slope, intercept
+
+
+def classify_direction(slope):
+    """根据盲道走向的拟合斜率判断转向，返回 'left'/'right'，无需转向时返回None"""
+    threshold = DIRECTION_CONFIG['threshold_slope']
+    if slope < -threshold:
+        # 斜率显著为负，提示左转
+        return 'left'
+    if slope > threshold:
+        # 斜率显著为正，提示右转
+        return 'right'
+    return None
+
+
+def check_direction(user_session, estimator, centers, confidences):
+    """累积检测框中心点估计盲道走向，转向时按该用户的设置播报语音提示"""
+    estimator.push(centers, confidences)
+
+    current_time = time.time()
+    if current_time - user_session.last_call_time >= call_interval:
+        fit = estimator.fit()
+        if fit is None:
+            return
+        slope, intercept = fit
+
+        print(f"[盲道检测] 斜率: {slope}, 拦截: {intercept}")
+
+        direction = classify_direction(slope)
+        if direction is None:
+            return
+
+        print(f"[盲道检测] 检测到{TURN_NAMES[direction]}")
+        fallback = DEFAULT_TURN_PHRASES[direction]
+        answer_content = phrase_cache.get(direction, user_session.settings)
+        if answer_content is not None:
+            announce_turn(user_session, direction, answer_content)
+        else:
+            # 缓存未命中：请求入队后立即返回，由请求队列在截止时间内交付回答或后备提示
+            request = LLMRequest(direction, dict(user_session.settings),
+                                 on_result=lambda text: announce_turn(user_session, direction, text),
+                                 deadline=LLM_CONFIG['deadline_ms'] / 1000,
+                                 fallback=fallback)
+            if not llm_queue.submit(request, priority=LLM_PRIORITY_TURN):
+                announce_turn(user_session, direction, fallback)
+
+        user_session.last_call_time = current_time
+        estimator.reset()
+
+
+def announce_turn(user_session, direction, text):
+    """设置语音文本并播报转向提示"""
+    print(f"[盲道检测] {TURN_NAMES[direction]}提示: {text}")
+    user_session.speech_text.publish(text)
+    speak(text, SPEECH_PRIORITY_NAVIGATION, user_session.settings)
+    print(f"[盲道检测] 启动{TURN_NAMES[direction]}语音提示")
+
+
+class FrameQueue:
+    """流水线各阶段之间的有界队列
+
+    drop_policy 为 'block' 时队列满则等待下游消费；
+    为 'drop_oldest' 时丢弃最旧的一帧，保证下游总是处理最新画面。
+    """
+
+    def __init__(self, maxsize, drop_policy='block'):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.dropped = 0
+
+    def put(self, item, stop_event):
+        """放入一项，流水线停止时返回False"""
+        if self.drop_policy == 'drop_oldest':
+            while not stop_event.is_set():
+                try:
+                    self.queue.put_nowait(item)
+                    return True
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+            return False
+
+        while not stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
         return False
 
+    def get_nowait(self):
+        """不等待地取出一项，队列为空时返回None"""
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
 
-def allowed_file(filename):
-    """检查文件扩展名是否允许"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    def get(self, stop_event):
+        """取出一项，流水线停止时返回None"""
+        while not stop_event.is_set():
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
 
+    def stats(self):
+        return {
+            "size": self.queue.qsize(),
+            "maxsize": self.maxsize,
+            "dropped": self.dropped
+        }
 
-def generate_frames():
-    global last_call_time, current_speech_text, current_video_path, video_active
 
-    # 如果视频未激活，显示等待上传提示
-    if not video_active or not current_video_path:
-        # 设置默认的提示文本
-        current_speech_text = "提示：系统会实时分析盲道方向，当方向发生变化时会自动播报语音提示。"
-        while not video_active or not current_video_path:
-            wait_frame = create_info_frame("请上传视频文件开始分析")
-            ret, buffer = cv2.imencode('.jpg', wait_frame)
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-            time.sleep(1)
+# 正在运行的流水线，用于 /pipeline_stats 查询
+active_pipelines = {}
+active_pipelines_lock = threading.Lock()
+
+
+class FramePipeline:
+    """解码 -> 推理 -> 编码 三段流水线
+
+    每个阶段运行在独立线程中，阶段之间通过有界队列衔接，
+    使解码、YOLO推理和JPEG编码相互重叠，吞吐量接近最慢的阶段而不是各阶段之和。
+    队列中的每一项为 (类型, 数据)，类型为 'frame'、'end' 或 'error'。
+    实时视频源只保留最新一帧，解码队列固定为丢弃旧帧，避免分析过时的画面。
+    """
+
+    def __init__(self, source, video_path, user_session, config=None):
+        config = config or PIPELINE_CONFIG
+        if source.live:
+            config = dict(config, decode_queue_size=1, drop_policy='drop_oldest')
+        drop_policy = config['drop_policy']
+        self.source = source
+        self.video_path = video_path
+        self.user_session = user_session
+        self.stop_event = threading.Event()
+        self.decode_queue = FrameQueue(config['decode_queue_size'], drop_policy)
+        self.infer_queue = FrameQueue(config['infer_queue_size'], drop_policy)
+        self.output_queue = FrameQueue(config['output_queue_size'], drop_policy)
+        self.frames_decoded = 0
+        self.frames_inferred = 0
+        self.frames_encoded = 0
+        self.scheduler = DetectionScheduler()
+        self.tracker = BoxTracker()
+        self.direction = DirectionEstimator()
+        self.started_at = None
+        self.threads = [
+            threading.Thread(target=self._decode_loop, daemon=True),
+            threading.Thread(target=self._infer_loop, daemon=True),
+            threading.Thread(target=self._encode_loop, daemon=True)
+        ]
+
+    def start(self):
+        self.started_at = time.time()
+        with active_pipelines_lock:
+            active_pipelines[id(self)] = self
+        for t in self.threads:
+            t.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for t in self.threads:
+            t.join(timeout=2)
+        self.source.release()
+        with active_pipelines_lock:
+            active_pipelines.pop(id(self), None)
+
+    def _decode_loop(self):
+        """解码阶段：从视频源读取帧，连同采集时间一起送入推理队列"""
+        try:
+            while not self.stop_event.is_set() and self.user_session.is_playing(self.video_path):
+                ret, frame, captured_at = self.source.read()
+                if not ret:
+                    if not self.user_session.is_playing(self.video_path):
+                        break
+                    reason = self.source.end_reason()
+                    if reason == 'read_error':
+                        print(f"无法读取视频帧: {self.video_path}")
+                    self.decode_queue.put(('end', reason), self.stop_event)
+                    return
+                self.frames_decoded += 1
+                if not self.decode_queue.put(('frame', (frame, captured_at)), self.stop_event):
+                    return
+            self.decode_queue.put(('end', 'stopped'), self.stop_event)
+        except Exception as e:
+            print(f"[流水线] 解码错误: {e}")
+            self.decode_queue.put(('error', str(e)), self.stop_event)
+
+    def _infer_loop(self):
+        """推理阶段：批量运行YOLO检测、绘制检测框并判断转向"""
+        while not self.stop_event.is_set():
+            item = self.decode_queue.get(self.stop_event)
+            if item is None:
+                return
 
-    # 视频已激活，开始处理
-    try:
-        cap = cv2.VideoCapture(current_video_path)
+            # 取出当前已解码的帧组成一个批次，遇到结束标记则处理完本批后转发
+            frames = []
+            captured = []
+            tail = None
+            while item is not None:
+                kind, payload = item
+                if kind != 'frame':
+                    tail = item
+                    break
+                frames.append(payload[0])
+                captured.append(payload[1])
+                if len(frames) >= INFERENCE_CONFIG['max_batch_size']:
+                    break
+                item = self.decode_queue.get_nowait()
 
-        if not cap.isOpened():
-            print(f"无法打开视频: {current_video_path}")
-            # 尝试使用ffmpeg参数打开
-            cap = cv2.VideoCapture(current_video_path, cv2.CAP_FFMPEG)
-
-            if not cap.isOpened():
-                # 仍然无法打开，显示错误信息
-                error_frame = create_error_frame(f"无法打开视频文件: {os.path.basename(current_video_path)}")
-                ret, buffer = cv2.imencode('.jpg', error_frame)
-                frame = buffer.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                video_active = False
-                current_speech_text = "视频无法打开，请尝试上传其他格式的视频。"
+            try:
+                # 只有调度器选中的帧送入模型，其余帧沿用前一次的检测框
+                selected = [self.scheduler.should_detect(frame) for frame in frames]
+                batch_detections = iter(detect_frames(
+                    [frame for frame, detect in zip(frames, selected) if detect]))
+                for frame, captured_at, detect in zip(frames, captured, selected):
+                    if detect:
+                        detections = self.tracker.update(next(batch_detections))
+                    else:
+                        detections = self.tracker.predict()
+                    centers = draw_detections(frame, detections)
+                    check_direction(self.user_session, self.direction, centers, detections[:, 4])
+                    self.source.record_latency(captured_at)
+                    self.frames_inferred += 1
+                    if not self.infer_queue.put(('frame', frame), self.stop_event):
+                        return
+            except Exception as e:
+                print(f"[流水线] 推理错误: {e}")
+                import traceback
+                traceback.print_exc()
+                self.infer_queue.put(('error', str(e)), self.stop_event)
                 return
 
-        THRESHOLD_SLOPE = 0.41
-        frame_count = 0
+            if tail is not None:
+                self.infer_queue.put(tail, self.stop_event)
+                return
 
-        while cap.isOpened() and video_active:
-            ret, frame = cap.read()
-            frame_count += 1
+    def _encode_loop(self):
+        """编码阶段：将标注后的帧按默认档位编码为JPEG，其他档位由观看者按需编码"""
+        while not self.stop_event.is_set():
+            item = self.infer_queue.get(self.stop_event)
+            if item is None:
+                return
+            kind, frame = item
+            if kind != 'frame':
+                self.output_queue.put(item, self.stop_event)
+                return
+            try:
+                encoded = encode_frame(frame)
+            except Exception as e:
+                print(f"[流水线] 编码错误: {e}")
+                self.output_queue.put(('error', str(e)), self.stop_event)
+                return
+            self.frames_encoded += 1
+            if not self.output_queue.put(('frame', encoded), self.stop_event):
+                return
+
+    def frames(self):
+        """按顺序产出编码后的帧，结束时产出 ('end'/'error', 原因)"""
+        while not self.stop_event.is_set():
+            item = self.output_queue.get(self.stop_event)
+            if item is None:
+                return
+            yield item
+            if item[0] != 'frame':
+                return
+
+    def stats(self):
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        return {
+            "video": os.path.basename(self.video_path),
+            "drop_policy": self.decode_queue.drop_policy,
+            "queues": {
+                "decode": self.decode_queue.stats(),
+                "infer": self.infer_queue.stats(),
+                "output": self.output_queue.stats()
+            },
+            "frames": {
+                "decoded": self.frames_decoded,
+                "inferred": self.frames_inferred,
+                "encoded": self.frames_encoded
+            },
+            "detection": self.scheduler.stats(),
+            "source": self.source.stats(),
+            "fps": round(self.frames_encoded / elapsed, 2) if elapsed > 0 else 0
+        }
+
+
+def analyze_pipelined(source, video_path, user_session):
+    """流水线模式：解码、推理、编码在独立线程中并行执行，产出编码后的帧"""
+    pipeline = FramePipeline(source, video_path, user_session)
+    pipeline.start()
+    try:
+        for kind, payload in pipeline.frames():
+            if kind == 'frame':
+                yield payload
+            elif kind == 'error':
+                yield end_of_stream(user_session, video_path, 'error', payload)
+            elif payload != 'stopped':
+                yield end_of_stream(user_session, video_path, payload)
+    finally:
+        pipeline.stop()
+
+
+def analyze_sequential(source, video_path, user_session):
+    """顺序模式：依次解码、推理、编码，产出编码后的帧"""
+    scheduler = DetectionScheduler()
+    tracker = BoxTracker()
+    direction = DirectionEstimator()
+
+    try:
+        while user_session.is_playing(video_path):
+            ret, frame, captured_at = source.read()
 
             if not ret:
-                if frame_count < 10:  # 如果连前10帧都读不出来
-                    print(f"无法读取视频帧: {current_video_path}")
-                    error_frame = create_error_frame("视频文件损坏或格式不支持")
-                    ret, buffer = cv2.imencode('.jpg', error_frame)
-                    frame = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                    video_active = False
-                    current_speech_text = "视频文件损坏或格式不支持，请尝试其他视频。"
+                if not user_session.is_playing(video_path):
                     break
-
-                # 视频正常结束
-                end_frame = create_info_frame("视频已播放完毕，请上传新视频")
-                ret, buffer = cv2.imencode('.jpg', end_frame)
-                frame = buffer.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                video_active = False
-                current_speech_text = "视频播放完毕，请上传新视频。"
+                reason = source.end_reason()
+                if reason == 'read_error':
+                    print(f"无法读取视频帧: {video_path}")
+                # 视频正常结束、文件损坏或实时视频源断开
+                yield end_of_stream(user_session, video_path, reason)
                 break
 
-            # 处理视频帧...（剩余代码不变）
-            results = model(frame)
-            centers = []  # 存储所有检测框的 (center_x, center_y)
-
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    x1, y1, x2, y2 = box.xyxy[0]
-                    conf = box.conf[0]
-                    cls = int(box.cls[0])
-                    center_x = (x1 + x2) / 2
-                    center_y = (y1 + y2) / 2
-                    centers.append((center_x, center_y))
-
-                    class_names = model.names
-                    label = f"{class_names[cls]}: {conf:.2f}"
-                    cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                    cv2.putText(frame, label, (int(x1), int(y1) - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-            current_time = time.time()
-            if len(centers) >= 2 and current_time - last_call_time >= call_interval:
-                ys = np.array([c[1] for c in centers])
-                xs = np.array([c[0] for c in centers])
-                slope, intercept = np.polyfit(ys, xs, 1)
-
-                print(f"[盲道检测] 斜率: {slope}, 拦截: {intercept}")
-
-                if slope < -THRESHOLD_SLOPE:
-                    # 斜率显著为负，提示左转
-                    print("[盲道检测] 检测到左转")
-                    response = ollama.chat(model="qwen2.5:3b", messages=[
-                        {"role": "system", "content": get_prompt_template()},
-                        {"role": "user", "content": left_turn_question}
-                    ], stream=True)
-
-                    answer_content = ""
-                    for chunk in response:
-                        content = chunk.get('message', {}).get('content', '')
-                        if content:
-                            answer_content += content
-
-                    print(f"[盲道检测] 生成的左转提示: {answer_content}")
-
-                    # 设置语音文本并播放
-                    current_speech_text = answer_content
-                    threading.Thread(target=speak, args=(answer_content,)).start()
-                    last_call_time = current_time
-                    print(f"[盲道检测] 启动左转语音提示")
-
-                elif slope > THRESHOLD_SLOPE:
-                    # 斜率显著为正，提示右转
-                    print("[盲道检测] 检测到右转")
-                    response = ollama.chat(model="qwen2.5:3b", messages=[
-                        {"role": "system", "content": get_prompt_template()},
-                        {"role": "user", "content": right_turn_question}
-                    ], stream=True)
-
-                    answer_content = ""
-                    for chunk in response:
-                        content = chunk.get('message', {}).get('content', '')
-                        if content:
-                            answer_content += content
-
-                    print(f"[盲道检测] 生成的右转提示: {answer_content}")
-
-                    # 设置语音文本并播放
-                    current_speech_text = answer_content
-                    threading.Thread(target=speak, args=(answer_content,)).start()
-                    last_call_time = current_time
-                    print(f"[盲道检测] 启动右转语音提示")
-
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+            if scheduler.should_detect(frame):
+                detections = tracker.update(detect_frames([frame])[0])
+            else:
+                detections = tracker.predict()
+            centers = draw_detections(frame, detections)
+            check_direction(user_session, direction, centers, detections[:, 4])
+            source.record_latency(captured_at)
+            yield encode_frame(frame)
+    finally:
+        source.release()
+
 
-        cap.release()
+def analyze_video(video_path, user_session):
+    """分析视频源并依次产出标注后的帧(EncodedFrame)，最后一帧为结束或错误提示"""
+    try:
+        source = open_frame_source(video_path, user_session)
+        if source is None:
+            # 仍然无法打开，显示错误信息
+            if is_live_source(video_path):
+                # 不在画面上显示地址中的用户名和密码
+                yield end_of_stream(user_session, video_path, 'source_error', video_path.rsplit('@', 1)[-1])
+            else:
+                yield end_of_stream(user_session, video_path, 'open_error', os.path.basename(video_path))
+            return
+
+        if PIPELINE_CONFIG['enabled']:
+            yield from analyze_pipelined(source, video_path, user_session)
+        else:
+            yield from analyze_sequential(source, video_path, user_session)
 
     except Exception as e:
         print(f"视频处理错误: {e}")
         import traceback
         traceback.print_exc()
-        error_frame = create_error_frame(f"视频处理错误: {str(e)}")
-        ret, buffer = cv2.imencode('.jpg', error_frame)
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-        video_active = False
-        current_speech_text = "视频处理出错，请尝试上传其他视频。"
+        yield end_of_stream(user_session, video_path, 'error', str(e))
+
+
+class FrameBroadcast:
+    """最新帧广播缓冲区
+
+    由单个分析线程发布帧，任意数量的订阅者各自按自己的节奏读取最新一帧；
+    读取慢的订阅者会直接跳过中间帧，而不会拖慢分析或其他订阅者。
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.frame = None
+        self.closed = False
+        self.listeners = set()
+
+    def add_listener(self, callback):
+        """注册有新帧或关闭时调用的回调（供异步服务唤醒协程使用）"""
+        with self.condition:
+            self.listeners.add(callback)
+
+    def remove_listener(self, callback):
+        with self.condition:
+            self.listeners.discard(callback)
+
+    def _notify(self):
+        self.condition.notify_all()
+        for callback in list(self.listeners):
+            callback()
+
+    def publish(self, frame):
+        with self.condition:
+            self.seq += 1
+            self.frame = frame
+            self._notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self._notify()
+
+    def latest(self, last_seq):
+        """不等待地返回比 last_seq 更新的帧 (seq, frame)，没有时返回 (last_seq, None)"""
+        with self.condition:
+            if self.seq > last_seq:
+                return self.seq, self.frame
+            return last_seq, None
+
+    def wait_next(self, last_seq, timeout=1.0):
+        """等待比 last_seq 更新的帧，返回 (seq, frame)；超时返回 (last_seq, None)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > last_seq or self.closed, timeout)
+            if self.seq > last_seq:
+                return self.seq, self.frame
+            return last_seq, None
+
+
+# 每个用户的每个视频源对应一个分析引擎，格式: {(user_id, video_path): AnalysisEngine}
+# 摄像头和视频流的标识(camera:0、rtsp://...)在用户之间可能相同，必须带上 user_id，
+# 否则后开始的用户会拿到前一个用户的引擎，转向提示和语音都发给前一个用户
+analysis_engines = {}
+analysis_engines_lock = threading.Lock()
+
+
+class AnalysisEngine:
+    """单个视频源的共享分析引擎
+
+    一个后台线程对视频运行一次检测，将标注后的帧发布到 FrameBroadcast，
+    所有 /video_feed 观看者共享同一份结果；相同编码档位的观看者共享同一份JPEG，
+    增加观看者几乎不增加计算量。
+    没有观看者超过 idle_timeout 秒后引擎自动停止。
+    """
+
+    def __init__(self, video_path, user_session):
+        self.video_path = video_path
+        self.user_session = user_session
+        self.key = (user_session.user_id, video_path)
+        self.broadcast = FrameBroadcast()
+        self.lock = threading.Lock()
+        self.subscribers = 0
+        self.viewers = set()
+        self.last_unsubscribe = time.time()
+        self.frames_published = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _idle(self):
+        with self.lock:
+            return (self.subscribers == 0 and
+                    time.time() - self.last_unsubscribe > PIPELINE_CONFIG['idle_timeout'])
+
+    def _run(self):
+        frames = analyze_video(self.video_path, self.user_session)
+        try:
+            for frame in frames:
+                self.broadcast.publish(frame)
+                self.frames_published += 1
+                if self._idle():
+                    print(f"[分析引擎] 无观看者，停止分析: {self.video_path}")
+                    break
+        finally:
+            frames.close()
+            with analysis_engines_lock:
+                if analysis_engines.get(self.key) is self:
+                    del analysis_engines[self.key]
+            self.broadcast.close()
+
+    def subscribe(self, viewer):
+        with self.lock:
+            self.subscribers += 1
+            self.viewers.add(viewer)
+
+    def unsubscribe(self, viewer):
+        with self.lock:
+            self.subscribers -= 1
+            self.viewers.discard(viewer)
+            self.last_unsubscribe = time.time()
+
+    def stream(self, viewer):
+        """订阅者生成器：按观看者档位的最高帧率产出最新的帧(EncodedFrame)"""
+        self.subscribe(viewer)
+        try:
+            last_seq = 0
+            while True:
+                delay = viewer.wait_time()
+                if delay > 0:
+                    time.sleep(delay)
+                last_seq, frame = self.broadcast.wait_next(last_seq)
+                if frame is not None:
+                    yield frame
+                elif self.broadcast.closed:
+                    return
+        finally:
+            self.unsubscribe(viewer)
+
+    def stats(self):
+        with self.lock:
+            subscribers = self.subscribers
+            viewers = [viewer.stats() for viewer in self.viewers]
+        return {
+            "video": os.path.basename(self.video_path),
+            "user_id": self.user_session.user_id,
+            "subscribers": subscribers,
+            "viewers": viewers,
+            "frames_published": self.frames_published
+        }
 
 
-def create_error_frame(message):
-    """创建错误信息帧 - 使用PIL支持中文"""
-    img = Image.new('RGB', (640, 480), color=(0, 0, 0))
-    draw = ImageDraw.Draw(img)
+def get_analysis_engine(user_session):
+    """获取用户当前视频对应的分析引擎，不存在时创建并启动
+
+    同时运行的引擎数达到 max_active_pipelines 时返回None，由调用方稍后重试。
+    """
+    key = (user_session.user_id, user_session.video_path)
+    with analysis_engines_lock:
+        engine = analysis_engines.get(key)
+        if engine is None:
+            if len(analysis_engines) >= SESSION_CONFIG['max_active_pipelines']:
+                return None
+            engine = AnalysisEngine(user_session.video_path, user_session)
+            analysis_engines[key] = engine
+            engine.start()
+        return engine
+
 
+def generate_frames(user_session, viewer):
+    user_session.attach()
     try:
-        font = ImageFont.truetype("simhei.ttf", 30)
+        # 如果视频未激活，显示等待上传提示
+        if not user_session.video_active or not user_session.video_path:
+            # 设置默认的提示文本
+            user_session.speech_text.publish(DEFAULT_SPEECH_TEXT)
+            while not user_session.video_active or not user_session.video_path:
+                wait_frame = PlaceholderFrame("请上传视频文件开始分析")
+                yield mjpeg_part(wait_frame.jpeg(viewer.profile))
+                time.sleep(1)
+
+        # 视频已激活，订阅该视频源的分析引擎；分析任务已满时排队等待
+        engine = get_analysis_engine(user_session)
+        while engine is None:
+            busy_frame = PlaceholderFrame("当前分析任务较多，正在排队...")
+            yield mjpeg_part(busy_frame.jpeg(viewer.profile))
+            time.sleep(1)
+            engine = get_analysis_engine(user_session)
+
+        for frame in engine.stream(viewer):
+            part = mjpeg_part(frame.jpeg(viewer.profile))
+            # 服务器写完这一帧后才会继续执行生成器，yield 的耗时即为发送耗时
+            started = time.time()
+            yield part
+            viewer.record_send(started, len(part))
+    finally:
+        user_session.detach()
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(size):
+    """加载指定字号的中文字体，每个字号只加载一次"""
+    try:
+        return ImageFont.truetype("simhei.ttf", size)
     except IOError:
-        font = ImageFont.load_default()
+        return ImageFont.load_default()
+
+
+def create_error_frame(message, size=(640, 480)):
+    """创建错误信息帧 - 使用PIL支持中文"""
+    width, height = size
+    img = Image.new('RGB', size, color=(0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    font = load_font(30)
 
     bbox = draw.textbbox((0, 0), message, font=font)
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
-    position = ((640 - text_width) // 2, (480 - text_height) // 2)
+    position = ((width - text_width) // 2, (height - text_height) // 2)
 
     draw.text(position, message, font=font, fill=(255, 0, 0))
 
     return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
 
 
-def create_info_frame(message):
+def create_info_frame(message, size=(640, 480)):
     """创建信息提示帧 - 使用PIL支持中文"""
-    img = Image.new('RGB', (640, 480), color=(41, 128, 185))
+    width, height = size
+    img = Image.new('RGB', size, color=(41, 128, 185))
     draw = ImageDraw.Draw(img)
-
-    try:
-        font = ImageFont.truetype("simhei.ttf", 30)
-    except IOError:
-        font = ImageFont.load_default()
+    font = load_font(30)
 
     bbox = draw.textbbox((0, 0), message, font=font)
     text_width = bbox[2] - bbox[0]
     text_height = bbox[3] - bbox[1]
-    position = ((640 - text_width) // 2, (480 - text_height) // 2)
+    position = ((width - text_width) // 2, (height - text_height) // 2)
 
     draw.text(position, message, font=font, fill=(255, 255, 255))
 
-    try:
-        small_font = ImageFont.truetype("simhei.ttf", 20)
-    except IOError:
-        small_font = ImageFont.load_default()
-
+    small_font = load_font(20)
     help_text = "支持mp4, avi, mov, mkv, webm格式"
     bbox = draw.textbbox((0, 0), help_text, font=small_font)
     help_width = bbox[2] - bbox[0]
     help_height = bbox[3] - bbox[1]
-    help_position = ((640 - help_width) // 2, position[1] + text_height + 20)
+    help_position = ((width - help_width) // 2, position[1] + text_height + 20)
     draw.text(help_position, help_text, font=small_font, fill=(200, 200, 200))
 
     return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
 
 
+@functools.lru_cache(maxsize=PLACEHOLDER_CONFIG['cache_size'])
+def placeholder_jpeg(message, kind, size, width, quality):
+    """渲染并编码一个提示画面；结果按参数缓存，等待中的观看者每秒重复取用同一份JPEG而不再重新绘制"""
+    frame = create_error_frame(message, size) if kind == 'error' else create_info_frame(message, size)
+    return encode_jpeg(resize_to_width(frame, width), quality)
+
+
+class PlaceholderFrame:
+    """提示画面，接口与 EncodedFrame 相同，可直接发布到 FrameBroadcast"""
+
+    def __init__(self, message, kind='info', size=None):
+        self.message = message
+        self.kind = kind
+        self.size = tuple(size or PLACEHOLDER_CONFIG['size'])
+
+    def jpeg(self, profile):
+        return placeholder_jpeg(self.message, self.kind, self.size, profile['width'], profile['quality'])
+
+
 @app.route('/video_feed')
+@login_required
 def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # 可用 ?profile=full/high/medium/low/minimal 指定编码档位
+    user_session = current_user_session()
+    viewer = StreamViewer(viewer_profile_name(user_session, request.args.get('profile')))
+    return Response(generate_frames(user_session, viewer), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/pipeline_stats', methods=['GET'])
+@login_required
+def pipeline_stats():
+    """获取当前用户视频处理流水线各阶段队列占用情况；管理员用户另外返回全局状态"""
+    user_id = session['user_id']
+    with active_pipelines_lock:
+        pipelines = [p.stats() for p in active_pipelines.values() if p.user_session.user_id == user_id]
+    with analysis_engines_lock:
+        engines = [e.stats() for e in analysis_engines.values() if e.user_session.user_id == user_id]
+
+    stats = {
+        "status": "success",
+        "enabled": PIPELINE_CONFIG['enabled'],
+        "pipelines": pipelines,
+        "engines": engines,
+        "max_active_pipelines": SESSION_CONFIG['max_active_pipelines']
+    }
+    if not is_admin_user():
+        return jsonify(stats)
+
+    # 全局状态包含所有用户的会话和视频，只返回给管理员
+    with active_pipelines_lock:
+        stats["all_pipelines"] = [p.stats() for p in active_pipelines.values()]
+    with analysis_engines_lock:
+        stats["all_engines"] = [e.stats() for e in analysis_engines.values()]
+    stats.update({
+        "inference": inference_service.stats() if inference_service else None,
+        "phrase_cache": phrase_cache.stats(),
+        "llm": llm_queue.stats(),
+        "speech": speech_worker.stats(),
+        "sessions": sessions.stats(),
+        "startup": dict(startup_timings, model=model_info),
+        "placeholders": placeholder_jpeg.cache_info()._asdict(),
+        "db_pool": db_pool.stats(),
+        "settings": settings_store.stats()
+    })
+    return jsonify(stats)
 
 
 @app.route('/stream_speech_text')
+@login_required
 def stream_speech_text():
-    def generate():
-        global current_speech_text
-        last_sent = ""
-
-        # 设置初始默认消息
-        if not current_speech_text:
-            current_speech_text = "提示：系统会实时分析盲道方向，当方向发生变化时会自动播报语音提示。"
+    """以SSE推送当前用户的语音文本，支持通过 Last-Event-ID 断线续传"""
+    user_session = current_user_session()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_id = None
 
-        while True:
-            if current_speech_text != last_sent:
-                last_sent = current_speech_text
-                # 不要添加data:前缀，保持原始格式
-                yield f"{current_speech_text}\n\n"
-            time.sleep(0.5)
+    def generate():
+        user_session.attach()
+        try:
+            # 建议浏览器断线3秒后重连
+            yield "retry: 3000\n\n"
+            for event in user_session.speech_text.events(last_id, SSE_CONFIG['heartbeat_interval']):
+                yield event
+        finally:
+            user_session.detach()
 
-    return Response(generate(), mimetype='text/event-stream')
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @app.route('/send_message', methods=['POST'])
+@login_required
 def send_message():
     """接收来自前端的家属消息，添加前缀后调用语音播报"""
+    user_session = current_user_session()
     # 检查是否为盲人端模式，如果是则拒绝发送消息
-    if user_settings["user_mode"] == "盲人端":
+    if user_session.settings["user_mode"] == "盲人端":
         return jsonify({"status": "error", "message": "盲人端模式不能发送消息"}), 403
 
     data = request.get_json()
@@ -879,11 +4088,10 @@ def send_message():
         full_text = f"您有一条来自家属的消息：{message}"
         print(f"[消息] 收到家属消息: {message}")
 
-        global current_speech_text
-        current_speech_text = full_text
+        user_session.speech_text.publish(full_text)
 
-        # 使用和旧版本一样的方式启动语音线程
-        threading.Thread(target=speak, args=(full_text,)).start()
+        # 家属消息优先于导航提示播报
+        speak(full_text, SPEECH_PRIORITY_MESSAGE, user_session.settings)
         print(f"[消息] 启动语音播报")
 
         return jsonify({"status": "success", "message": "消息发送成功"})
@@ -894,10 +4102,32 @@ def send_message():
         return jsonify({"status": "error", "message": f"发送失败: {str(e)}"}), 500
 
 
+def new_upload_path(user_session, filename):
+    """使用用户ID和时间戳生成唯一文件路径，避免不同用户的文件名冲突"""
+    # 创建上传目录（如果不存在）
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    timestamp = int(time.time())
+    filename = f"{user_session.user_id}_{timestamp}_{secure_filename(filename)}"
+    return os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+
+def activate_video(user_session, file_path):
+    """将新视频设为用户当前分析的视频，并删除之前的视频"""
+    old_video_path = user_session.set_video(file_path)
+    if old_video_path and old_video_path != file_path and os.path.exists(old_video_path):
+        try:
+            os.remove(old_video_path)
+        except Exception as e:
+            print(f"无法删除旧视频文件: {e}")
+
+    phrase_cache.prefill(user_session.settings)
+
+
 @app.route('/upload_video', methods=['POST'])
+@login_required
 def upload_video():
-    """处理视频上传"""
-    global current_video_path, video_active
+    """处理视频上传，新视频只替换当前用户自己的视频"""
+    user_session = current_user_session()
 
     if 'video' not in request.files:
         return jsonify({"status": "error", "message": "没有上传文件"}), 400
@@ -912,47 +4142,17 @@ def upload_video():
             {"status": "error", "message": f"不支持的文件类型，允许的类型: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
 
     try:
-        # 创建上传目录（如果不存在）
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-        # 使用时间戳生成唯一文件名，避免文件名冲突
-        timestamp = int(time.time())
-        filename = f"{timestamp}_{secure_filename(file.filename)}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file_path = new_upload_path(user_session, file.filename)
         file.save(file_path)
 
-        # 检查视频是否可以打开
-        test_cap = cv2.VideoCapture(file_path)
-        if not test_cap.isOpened():
-            test_cap.release()
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            return jsonify({"status": "error", "message": "无法打开视频文件，请检查文件格式或尝试其他视频"}), 400
-
-        # 读取几帧确认真的可以读取
-        read_success = False
-        for _ in range(5):  # 尝试读取前5帧
-            ret, _ = test_cap.read()
-            if ret:
-                read_success = True
-                break
-
-        test_cap.release()
-
-        if not read_success:
+        # 检查视频是否可以打开并读取帧
+        success, message = probe_video(file_path)
+        if not success:
             if os.path.exists(file_path):
                 os.remove(file_path)
-            return jsonify({"status": "error", "message": "视频文件无法正常读取帧，请尝试其他视频"}), 400
-
-        # 如果之前有视频文件，先删除
-        if current_video_path and os.path.exists(current_video_path):
-            try:
-                os.remove(current_video_path)
-            except Exception as e:
-                print(f"无法删除旧视频文件: {e}")
+            return jsonify({"status": "error", "message": message}), 400
 
-        current_video_path = file_path
-        video_active = True
+        activate_video(user_session, file_path)
         print(f"成功上传视频: {file_path}")
 
         return jsonify({
@@ -967,12 +4167,183 @@ def upload_video():
         return jsonify({"status": "error", "message": f"上传失败: {str(e)}"}), 500
 
 
+def get_chunked_upload(upload_id):
+    """获取属于当前用户的分块上传，不存在时返回None"""
+    with chunked_uploads_lock:
+        upload = chunked_uploads.get(upload_id)
+    if upload is None or upload.user_session.user_id != session['user_id']:
+        return None
+    return upload
+
+
+@app.route('/upload_video/init', methods=['POST'])
+@login_required
+def init_chunked_upload():
+    """开始一次分块上传，返回上传ID和建议的分块大小"""
+    user_session = current_user_session()
+    sweep_chunked_uploads()
+
+    data = request.get_json() or {}
+    filename = data.get('filename', '')
+    size = data.get('size')
+
+    if not filename:
+        return jsonify({"status": "error", "message": "未选择文件"}), 400
+
+    if not allowed_file(filename):
+        return jsonify(
+            {"status": "error", "message": f"不支持的文件类型，允许的类型: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
+
+    # 必须声明文件大小：每个分块请求各自都在 MAX_CONTENT_LENGTH 之内，只有按声明大小限制总量才能保证整个文件不超过300MB
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0 or size > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({"status": "error", "message": "文件大小无效或超过300MB限制"}), 400
+
+    try:
+        upload_id = uuid.uuid4().hex
+        upload = ChunkedUpload(upload_id, user_session, new_upload_path(user_session, filename), size)
+        with chunked_uploads_lock:
+            chunked_uploads[upload_id] = upload
+    except Exception as e:
+        print(f"[上传] 创建上传失败: {e}")
+        return jsonify({"status": "error", "message": f"上传失败: {str(e)}"}), 500
+
+    print(f"[上传] 开始分块上传: {upload.file_path}")
+    return jsonify({
+        "status": "success",
+        "upload_id": upload_id,
+        "chunk_size": UPLOAD_CONFIG['chunk_size'],
+        "received": 0
+    })
+
+
+@app.route('/upload_video/<upload_id>', methods=['GET'])
+@login_required
+def chunked_upload_status(upload_id):
+    """查询分块上传进度，断线后客户端据此从 received 处续传"""
+    upload = get_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({"status": "error", "message": "上传不存在或已过期"}), 404
+    return jsonify({"status": "success", **upload.status()})
+
+
+@app.route('/upload_video/<upload_id>/chunk', methods=['PUT'])
+@login_required
+def upload_video_chunk(upload_id):
+    """写入一个分块，请求体为原始字节，offset 参数为该分块在文件中的起始位置
+
+    文件头到达后立即校验容器格式，校验通过即开始分析，不必等待整个文件上传完毕。
+    """
+    upload = get_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({"status": "error", "message": "上传不存在或已过期"}), 404
+
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({"status": "error", "message": "缺少分块偏移"}), 400
+
+    try:
+        success, message = upload.write(offset, request.stream)
+    except Exception as e:
+        print(f"[上传] 写入分块出错: {e}")
+        success, message = False, f"写入失败: {str(e)}"
+    if not success:
+        return jsonify({"status": "error", "message": message, **upload.status()}), 409
+
+    was_validated = upload.container is not None
+    success, message = upload.check_header()
+    if not success:
+        upload.fail()
+        return jsonify({"status": "error", "message": message}), 400
+
+    analysis_started = upload.container is not None and not was_validated
+    if analysis_started:
+        # 文件头有效，立即开始边接收边分析
+        activate_video(upload.user_session, upload.file_path)
+        print(f"[上传] 文件头校验通过({upload.container})，开始分析: {upload.file_path}")
+
+    return jsonify({"status": "success", "analysis_started": analysis_started, **upload.status()})
+
+
+@app.route('/upload_video/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_chunked_upload(upload_id):
+    """结束分块上传并确认视频可以正常解码"""
+    upload = get_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({"status": "error", "message": "上传不存在或已过期"}), 404
+
+    if upload.received != upload.size:
+        return jsonify({"status": "error", "message": "文件尚未上传完整", **upload.status()}), 409
+
+    if upload.container is None:
+        upload.fail()
+        return jsonify({"status": "error", "message": "文件内容不是有效的视频格式"}), 400
+
+    upload.finish()
+    success, message = probe_video(upload.file_path)
+    if not success:
+        upload.fail()
+        return jsonify({"status": "error", "message": message}), 400
+
+    print(f"成功上传视频: {upload.file_path}")
+    return jsonify({
+        "status": "success",
+        "message": "视频上传成功",
+        "file_path": upload.file_path
+    })
+
+
+@app.route('/start_live', methods=['POST'])
+@login_required
+def start_live():
+    """切换到实时视频源：服务器摄像头、RTSP/HTTP视频流或浏览器推送的摄像头画面"""
+    user_session = current_user_session()
+    data = request.get_json() or {}
+
+    source_key, message = live_source_key(data, user_session, is_admin_user())
+    if source_key is None:
+        return jsonify({"status": "error", "message": message}), 400
+
+    activate_video(user_session, source_key)
+    print(f"[视频源] 用户 {user_session.user_id} 开始实时分析: {data.get('source')}")
+
+    return jsonify({"status": "success", "message": "实时分析已开始"})
+
+
+@app.route('/stop_live', methods=['POST'])
+@login_required
+def stop_live():
+    """停止当前的实时视频分析"""
+    user_session = current_user_session()
+    video_path = user_session.video_path
+    if video_path and is_live_source(video_path):
+        user_session.finish_video(video_path)
+    return jsonify({"status": "success", "message": "实时分析已停止"})
+
+
+@app.route('/push_frame', methods=['POST'])
+@login_required
+def push_frame():
+    """接收浏览器推送的一帧JPEG画面（无法使用WebSocket时的备用方式）
+
+    采集时间按服务器收到该帧的时间计算。
+    """
+    frame = decode_pushed_frame(request.get_data())
+    if frame is None:
+        return jsonify({"status": "error", "message": "无法解码图像"}), 400
+    current_user_session().pushed_frames.put(frame, time.time())
+    return jsonify({"status": "success"})
+
+
 @app.route('/get_settings', methods=['GET'])
+@login_required
 def get_settings():
     """获取当前用户设置"""
+    user_session = current_user_session()
     return jsonify({
         "status": "success",
-        "settings": user_settings
+        "settings": user_session.settings,
+        "version": settings_store.version(user_session.user_id)
     })
 
 
@@ -994,28 +4365,21 @@ def get_available_voices():
 
 
 @app.route('/test_voice', methods=['POST'])
+@login_required
 def voice_test():
-    """测试语音设置，使用和旧版本相同的线程方式"""
+    """测试语音设置，测试用的语速/音量只作用于本次播报，不修改用户设置"""
     try:
+        user_settings = current_user_session().settings
         data = request.get_json()
         print(f"[测试语音] 收到请求数据: {data}")
 
-        test_settings = {
+        test_settings = dict(user_settings)
+        test_settings.update({
             "voice_speed": data.get("voice_speed", user_settings["voice_speed"]),
             "voice_volume": data.get("voice_volume", user_settings["voice_volume"])
-        }
-
-        # 临时保存当前设置
-        temp_settings = {
-            "voice_speed": user_settings["voice_speed"],
-            "voice_volume": user_settings["voice_volume"]
-        }
-
-        print(f"[测试语音] 当前设置: {temp_settings}")
-        print(f"[测试语音] 测试设置: {test_settings}")
+        })
 
-        # 应用测试设置
-        user_settings.update(test_settings)
+        print(f"[测试语音] 测试设置: 语速={test_settings['voice_speed']}, 音量={test_settings['voice_volume']}")
 
         # 获取自定义测试文本，确保包含鼓励功能状态
         test_text = data.get("test_text")
@@ -1027,17 +4391,8 @@ def voice_test():
 
         print(f"[测试语音] 将播放文本: {test_text}")
 
-        # 启动新线程来播放测试语音
-        threading.Thread(target=speak, args=(test_text,)).start()
-
-        # 恢复原始设置 - 等待一小段时间后恢复，确保语音播放使用测试设置
-        def restore_settings():
-            time.sleep(2)  # 等待2秒，确保语音播放已经开始
-            user_settings.update(temp_settings)
-            print("[测试语音] 已恢复原始设置")
-
-        # 在单独线程中恢复设置，确保响应可以立即返回
-        threading.Thread(target=restore_settings).start()
+        # 测试语音优先级最低，不会打断家属消息和导航提示
+        speak(test_text, SPEECH_PRIORITY_TEST, test_settings)
 
         print("[测试语音] 已启动语音测试")
         return jsonify({"status": "success", "message": "语音测试已开始"})
@@ -1226,6 +4581,7 @@ def nearby_blindways():
     ]
 
     # 计算每条盲道到用户的距离
+    import geopy.distance
     user_coord = (lat, lng)
     for blindway in sample_blindways:
         min_distance = float('inf')
@@ -1291,8 +4647,14 @@ def get_user_details():
         conn.close()
 
 
+record_startup_timing('import', startup_started)
+
+
 if __name__ == '__main__':
     # 初始化数据库
     init_database()
+    # debug 模式下 reloader 的父进程只负责监视文件，只在实际提供服务的子进程中预热
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup()
     app.run(debug=True)
 
@@ -0,0 +1,323 @@
+"""
+盲道导航助手的异步(ASGI)服务入口
+
+/video_feed 和 /stream_speech_text 两个长连接接口在这里用协程实现，URL 以及
+multipart/SSE 格式与 Flask 版本完全相同，每个观看者只占用一个协程而不是一个线程；
+浏览器推送摄像头画面的 WebSocket 接口 /push_frames 也只在这里提供(Flask 版本使用
+POST /push_frame 逐帧推送)。其余请求仍交给 app.py 中的 Flask 应用处理。
+
+运行方式：
+    uvicorn asgi:application --host 127.0.0.1 --port 5000
+"""
+import asyncio
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+
+import app as navigation
+
+wsgi_application = WsgiToAsgi(navigation.app)
+
+MJPEG_HEADERS = [
+    (b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+    (b'cache-control', b'no-cache')
+]
+
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no')
+]
+
+
+class Wakeup:
+    """把后台线程(分析引擎、语音文本发布)的通知转交给事件循环中的协程"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def __call__(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    async def wait(self, timeout):
+        """等待通知，被唤醒返回True，超时返回False"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        self.event.clear()
+        return woken
+
+
+def session_user_id(scope):
+    """解析 Flask 会话 Cookie，返回登录用户ID，未登录或签名无效时返回None"""
+    flask_app = navigation.app
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if serializer is None:
+        return None
+
+    cookie = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookie.load(value.decode('latin-1'))
+    morsel = cookie.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return None
+
+    try:
+        data = serializer.loads(morsel.value,
+                                max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('user_id')
+
+
+async def current_user_session(scope):
+    """当前连接所属用户的会话；会话可能需要从数据库恢复，因此放到线程池中获取"""
+    user_id = session_user_id(scope)
+    if user_id is None:
+        return None
+    return await asyncio.get_running_loop().run_in_executor(None, navigation.sessions.get, user_id)
+
+
+async def redirect_to_login(send):
+    """未登录时与 login_required 一样重定向到登录页"""
+    await send({'type': 'http.response.start', 'status': 302,
+                'headers': [(b'location', b'/login'), (b'content-length', b'0')]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def watch_disconnect(receive, disconnected, wakeup=None):
+    """监听客户端断开连接"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            if wakeup:
+                wakeup.event.set()
+            return
+
+
+async def send_chunk(send, body):
+    """发送一段响应体
+
+    uvicorn 在客户端接收缓慢、发送缓冲区积压时会让 await send 等待缓冲区排空，
+    等待期间分析引擎发布的新帧会覆盖旧帧，慢速客户端因此跳帧而不是在内存中堆积；
+    await 的耗时也用于判断是否需要降低观看者的编码档位。
+    """
+    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+
+async def stream_engine(engine, viewer, send, disconnected):
+    """订阅分析引擎，按客户端自己的节奏和编码档位发送最新帧"""
+    wakeup = Wakeup()
+    loop = asyncio.get_running_loop()
+    engine.subscribe(viewer)
+    engine.broadcast.add_listener(wakeup)
+    try:
+        last_seq = 0
+        while not disconnected.is_set():
+            delay = viewer.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # 先读关闭标记再取帧，保证关闭前发布的最后一帧不会漏发
+            closed = engine.broadcast.closed
+            last_seq, frame = engine.broadcast.latest(last_seq)
+            if frame is not None:
+                # 非默认档位需要缩放和编码，放到线程池中执行，不阻塞事件循环
+                jpeg = await loop.run_in_executor(None, frame.jpeg, viewer.profile)
+                part = navigation.mjpeg_part(jpeg)
+                started = time.time()
+                await send_chunk(send, part)
+                viewer.record_send(started, len(part))
+            elif closed:
+                return
+            else:
+                await wakeup.wait(1.0)
+    finally:
+        engine.broadcast.remove_listener(wakeup)
+        engine.unsubscribe(viewer)
+
+
+async def send_info_frame(send, disconnected, viewer, message):
+    """发送一帧提示画面并等待1秒，期间客户端断开返回True"""
+    info_frame = navigation.PlaceholderFrame(message)
+    await send_chunk(send, navigation.mjpeg_part(info_frame.jpeg(viewer.profile)))
+    try:
+        await asyncio.wait_for(disconnected.wait(), 1)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def video_feed(scope, receive, send):
+    """异步版 /video_feed"""
+    user_session = await current_user_session(scope)
+    if user_session is None:
+        await redirect_to_login(send)
+        return
+
+    # 与 Flask 版本相同，可用 ?profile= 指定编码档位
+    profile = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('profile', [None])[0]
+    viewer = navigation.StreamViewer(navigation.viewer_profile_name(user_session, profile))
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': MJPEG_HEADERS})
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+    user_session.attach()
+
+    try:
+        # 如果视频未激活，显示等待上传提示
+        if not user_session.video_active or not user_session.video_path:
+            user_session.speech_text.publish(navigation.DEFAULT_SPEECH_TEXT)
+        while not user_session.video_active or not user_session.video_path:
+            if await send_info_frame(send, disconnected, viewer, "请上传视频文件开始分析"):
+                return
+
+        # 视频已激活，订阅该视频源的分析引擎；分析任务已满时排队等待
+        engine = navigation.get_analysis_engine(user_session)
+        while engine is None:
+            if await send_info_frame(send, disconnected, viewer, "当前分析任务较多，正在排队..."):
+                return
+            engine = navigation.get_analysis_engine(user_session)
+
+        await stream_engine(engine, viewer, send, disconnected)
+    finally:
+        user_session.detach()
+        watcher.cancel()
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+def last_event_id(scope):
+    """从请求头 Last-Event-ID 或查询参数 lastEventId 中取出断线前收到的事件ID"""
+    value = None
+    for name, header_value in scope['headers']:
+        if name == b'last-event-id':
+            value = header_value.decode('latin-1')
+    if value is None:
+        value = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('lastEventId', [None])[0]
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+async def stream_speech_text(scope, receive, send):
+    """异步版 /stream_speech_text"""
+    user_session = await current_user_session(scope)
+    if user_session is None:
+        await redirect_to_login(send)
+        return
+
+    last_id = last_event_id(scope)
+    await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+
+    speech_text = user_session.speech_text
+    wakeup = Wakeup()
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(watch_disconnect(receive, disconnected, wakeup))
+    speech_text.add_listener(wakeup)
+    user_session.attach()
+
+    try:
+        # 建议浏览器断线3秒后重连
+        await send_chunk(send, b"retry: 3000\n\n")
+        while not disconnected.is_set():
+            pending = speech_text.pending(last_id)
+            if pending:
+                body = "".join(navigation.sse_event(event_id, text) for event_id, text in pending)
+                await send_chunk(send, body.encode('utf-8'))
+                last_id = pending[-1][0]
+                continue
+
+            woken = await wakeup.wait(navigation.SSE_CONFIG['heartbeat_interval'])
+            if not woken:
+                await send_chunk(send, b": heartbeat\n\n")
+    finally:
+        speech_text.remove_listener(wakeup)
+        user_session.detach()
+        watcher.cancel()
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def push_frames(scope, receive, send):
+    """WebSocket /push_frames：浏览器推送摄像头画面，每条二进制消息为一帧JPEG
+
+    采集时间按服务器收到消息的时间计算；解码在线程池中进行，
+    解码后的帧写入用户会话的最新帧缓冲区，分析跟不上时旧帧被直接覆盖。
+    """
+    await receive()  # websocket.connect
+    user_session = await current_user_session(scope)
+    if user_session is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+
+    await send({'type': 'websocket.accept'})
+    loop = asyncio.get_running_loop()
+    user_session.attach()
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            data = message.get('bytes')
+            if not data:
+                continue
+            captured_at = time.time()
+            frame = await loop.run_in_executor(None, navigation.decode_pushed_frame, data)
+            if frame is not None:
+                user_session.pushed_frames.put(frame, captured_at)
+    finally:
+        user_session.detach()
+
+
+WEBSOCKET_ROUTES = {
+    '/push_frames': push_frames
+}
+
+
+async def lifespan(scope, receive, send):
+    """服务启动时初始化数据库，并按配置在后台预热模型"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(None, navigation.init_database)
+            navigation.start_warmup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+STREAMING_ROUTES = {
+    '/video_feed': video_feed,
+    '/stream_speech_text': stream_speech_text
+}
+
+
+async def application(scope, receive, send):
+    """ASGI入口：长连接接口走协程，其余请求转交Flask"""
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] in STREAMING_ROUTES:
+        await STREAMING_ROUTES[scope['path']](scope, receive, send)
+        return
+
+    if scope['type'] == 'websocket':
+        if scope['path'] in WEBSOCKET_ROUTES:
+            await WEBSOCKET_ROUTES[scope['path']](scope, receive, send)
+        else:
+            await receive()
+            await send({'type': 'websocket.close'})
+        return
+
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,257 @@
+"""
+盲道视频离线批量分析
+
+对一批视频运行与在线分析相同的YOLO检测和盲道走向判断(DirectionEstimator + classify_direction)，
+不编码MJPEG、不播报语音、不调用大模型。每个视频的逐帧检测结果和转向事件写入一个NPZ文件，
+用于审查检测效果和转向提示的时机。多个视频分配到进程池中并行处理，每个工作进程只加载一次模型。
+
+运行方式：
+    python batch_analyze.py uploads/ archive/walk_01.mp4 --output batch_results --workers 4
+
+输出文件按视频相对于命令行中所给目录的路径存放，例如 archive/day1/walk.mp4 写到
+batch_results/day1/walk.npz；直接给出的视频文件写到输出目录下。两个输入对应同一个输出文件时报错退出。
+
+NPZ文件中的数组（按列存储，同一行对应同一个检测框/转向事件）：
+    det_frame, det_box(x1, y1, x2, y2), det_conf, det_cls   逐帧检测结果
+    turn_frame, turn_direction(-1左转/1右转), turn_slope, turn_intercept   转向事件
+    fps, width, height, frame_count, class_names   视频信息
+"""
+import argparse
+import concurrent.futures
+import os
+import time
+
+import cv2
+import numpy as np
+
+# 与 app.ALLOWED_EXTENSIONS 相同
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'webm'}
+
+TURN_CODES = {'left': -1, 'right': 1}
+
+navigation = None  # 工作进程中导入的 app 模块
+
+
+def init_worker(threads, backend):
+    """工作进程初始化：导入 app 并加载一次YOLO模型，限制每个进程的计算线程数，避免进程之间争抢CPU
+
+    backend 为主进程 prepare_model 确认可用的后端，导出模型已在主进程中准备好，工作进程只读取缓存。
+    """
+    global navigation
+    cv2.setNumThreads(1)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    import app
+    navigation = app
+    navigation.MODEL_CONFIG['backend'] = backend
+    navigation.get_model()
+
+
+def read_batch(cap, batch_size):
+    """连续读取最多 batch_size 帧"""
+    frames = []
+    while len(frames) < batch_size:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    return frames
+
+
+def analyze_file(video_path, output_path, batch_size):
+    """分析单个视频并写出NPZ文件，返回统计信息"""
+    started = time.time()
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return {"video": video_path, "error": "无法打开视频文件"}
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps or fps <= 0:
+        fps = 25.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    estimator = navigation.DirectionEstimator()
+    last_turn_time = None
+    det_frames = []
+    detections_list = []
+    turns = []
+    frame_count = 0
+
+    try:
+        while True:
+            frames = read_batch(cap, batch_size)
+            if not frames:
+                break
+
+            # 与在线分析相同：只把检测区域送入模型，检测框再平移回整个画面的坐标
+            crops = [navigation.crop_roi(frame, navigation.INFERENCE_CONFIG['roi']) for frame in frames]
+            results = navigation.get_model()([crop for crop, _ in crops], imgsz=navigation.MODEL_CONFIG['imgsz'])
+            for offset, (result, (_, roi_offset)) in enumerate(zip(results, crops)):
+                index = frame_count + offset
+                detections = navigation.offset_detections(navigation.extract_detections([result]), roi_offset)
+                det_frames.append(np.full(len(detections), index, dtype=np.int32))
+                detections_list.append(detections)
+
+                estimator.push(navigation.detection_centers(detections), detections[:, 4])
+
+                # 与在线分析相同：两次转向提示至少间隔 call_interval 秒，这里按视频时间计算
+                current_time = index / fps
+                if last_turn_time is not None and current_time - last_turn_time < navigation.call_interval:
+                    continue
+                fit = estimator.fit()
+                if fit is None:
+                    continue
+                direction = navigation.classify_direction(fit[0])
+                if direction is None:
+                    continue
+                turns.append((index, TURN_CODES[direction], fit[0], fit[1]))
+                last_turn_time = current_time
+                estimator.reset()
+
+            frame_count += len(frames)
+    finally:
+        cap.release()
+
+    names = navigation.get_model().names
+    detections = np.vstack(detections_list) if detections_list else np.zeros((0, 6), dtype=np.float32)
+    turn_array = np.array(turns, dtype=np.float64).reshape(-1, 4)
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    np.savez_compressed(
+        output_path,
+        det_frame=np.concatenate(det_frames) if det_frames else np.zeros(0, dtype=np.int32),
+        det_box=detections[:, :4],
+        det_conf=detections[:, 4],
+        det_cls=detections[:, 5].astype(np.int16),
+        turn_frame=turn_array[:, 0].astype(np.int32),
+        turn_direction=turn_array[:, 1].astype(np.int8),
+        turn_slope=turn_array[:, 2].astype(np.float32),
+        turn_intercept=turn_array[:, 3].astype(np.float32),
+        fps=np.float32(fps),
+        width=np.int32(width),
+        height=np.int32(height),
+        frame_count=np.int32(frame_count),
+        class_names=np.array([names[i] for i in sorted(names)])
+    )
+
+    elapsed = time.time() - started
+    return {
+        "video": video_path,
+        "output": output_path,
+        "frames": frame_count,
+        "detections": len(detections),
+        "turns": len(turns),
+        "seconds": elapsed,
+        "fps": frame_count / elapsed if elapsed > 0 else 0
+    }
+
+
+def collect_videos(paths):
+    """展开命令行参数中的文件和目录，返回 [(视频文件, 相对路径)]
+
+    目录中的视频使用相对于该目录的路径，直接给出的文件使用文件名；同一个文件只保留一次。
+    """
+    videos = []
+    seen = set()
+
+    def add(video_path, relative_path):
+        real_path = os.path.realpath(video_path)
+        if real_path not in seen:
+            seen.add(real_path)
+            videos.append((video_path, relative_path))
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.rsplit('.', 1)[-1].lower() in VIDEO_EXTENSIONS:
+                        video_path = os.path.join(root, name)
+                        add(video_path, os.path.relpath(video_path, path))
+        elif os.path.isfile(path):
+            add(path, os.path.basename(path))
+        else:
+            print(f"[批量分析] 跳过不存在的路径: {path}")
+    return videos
+
+
+def plan_outputs(videos, output_dir):
+    """为每个视频确定NPZ输出路径，返回 ([(视频文件, 输出路径)], {输出路径: [冲突的视频文件]})"""
+    jobs = []
+    targets = {}
+    for video_path, relative_path in videos:
+        output_path = os.path.join(output_dir, os.path.splitext(relative_path)[0] + '.npz')
+        jobs.append((video_path, output_path))
+        targets.setdefault(os.path.normcase(os.path.normpath(output_path)), []).append(video_path)
+    conflicts = {target: sources for target, sources in targets.items() if len(sources) > 1}
+    return jobs, conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="盲道视频离线批量分析")
+    parser.add_argument('paths', nargs='+', help="视频文件或包含视频的目录")
+    parser.add_argument('--output', default='batch_results', help="NPZ结果输出目录")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="并行进程数，默认等于CPU核数")
+    parser.add_argument('--batch-size', type=int, default=8, help="每次送入模型的帧数")
+    args = parser.parse_args()
+
+    videos = collect_videos(args.paths)
+    if not videos:
+        print("[批量分析] 没有找到视频文件")
+        return 1
+
+    jobs, conflicts = plan_outputs(videos, args.output)
+    if conflicts:
+        # 同名输出会互相覆盖，审查结果丢失；给出它们共同的上级目录即可按子目录区分
+        for target, sources in conflicts.items():
+            print(f"[批量分析] 多个视频对应同一个输出文件 {target}: {', '.join(sources)}")
+        print("[批量分析] 请改为给出这些视频共同的上级目录，输出会按子目录分开存放")
+        return 1
+
+    # 导出模型(onnx/openvino)在主进程中只做一次；导入 app 不会加载模型，模型只在工作进程中加载
+    import app
+    try:
+        backend = app.prepare_model()
+    except Exception as e:
+        print(f"[批量分析] {app.MODEL_CONFIG['backend']} 模型导出失败: {e}")
+        return 1
+
+    workers = max(1, min(args.workers, len(videos)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"[批量分析] {len(videos)} 个视频，{workers} 个进程，每个进程 {threads} 个计算线程，推理后端 {backend}")
+
+    started = time.time()
+    total_frames = 0
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                initargs=(threads, backend)) as executor:
+        futures = [executor.submit(analyze_file, video, output_path, args.batch_size)
+                   for video, output_path in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f"[批量分析] 分析出错: {e}")
+                failures += 1
+                continue
+            if "error" in stats:
+                print(f"[批量分析] {stats['video']}: {stats['error']}")
+                failures += 1
+                continue
+            total_frames += stats['frames']
+            print(f"[批量分析] {stats['video']}: {stats['frames']}帧, {stats['detections']}个检测框, "
+                  f"{stats['turns']}次转向, {stats['fps']:.1f} 帧/秒 -> {stats['output']}")
+
+    elapsed = time.time() - started
+    print(f"[批量分析] 完成 {len(videos) - failures}/{len(videos)} 个视频，共 {total_frames} 帧，"
+          f"用时 {elapsed:.1f} 秒，总吞吐 {total_frames / elapsed if elapsed > 0 else 0:.1f} 帧/秒")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
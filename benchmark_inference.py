@@ -0,0 +1,94 @@
+"""
+推理尺寸与检测区域的速度/召回权衡测试
+
+在同一批帧上依次测试多组 (推理输入尺寸, 检测区域) 组合，统计逐帧推理延迟，
+并以 640 整画面的检测结果为参照计算相对召回率。训练验证集没有随项目提供，
+因此用 models/results.csv 中 best.pt 对应轮次(按 ultralytics 的 fitness 选出)的验证集
+精确率/召回率作为基准，估算召回率 = 验证集召回率 x 相对召回率。
+
+运行方式：
+    python benchmark_inference.py archive/walk_01.mp4 --sizes 320 416 640 --rois 0,0,1,1 0.15,0.4,0.85,1
+"""
+import argparse
+import csv
+import time
+
+import numpy as np
+
+import app as navigation
+from check_backend import match_detections, read_frames
+
+
+def best_epoch(results_path):
+    """读取训练记录，返回 fitness(0.1 x mAP50 + 0.9 x mAP50-95) 最高的一轮，即 best.pt 对应的轮次"""
+    with open(results_path, 'r', encoding='utf-8') as f:
+        rows = [{key.strip(): float(value) for key, value in row.items()} for row in csv.DictReader(f)]
+    return max(rows, key=lambda row: 0.1 * row['metrics/mAP50(B)'] + 0.9 * row['metrics/mAP50-95(B)'])
+
+
+def parse_roi(text):
+    """'左,上,右,下' -> 元组"""
+    roi = tuple(float(value) for value in text.split(','))
+    if len(roi) != 4 or not (0 <= roi[0] < roi[2] <= 1 and 0 <= roi[1] < roi[3] <= 1):
+        raise argparse.ArgumentTypeError(f"检测区域格式应为 左,上,右,下 且取值在0~1之间: {text}")
+    return roi
+
+
+def run_setting(model, frames, imgsz, roi):
+    """逐帧推理(与在线分析相同，每帧单独计时)，返回每帧检测结果和延迟(毫秒)"""
+    crop, _ = navigation.crop_roi(frames[0], roi)
+    model(crop, imgsz=imgsz)  # 预热，不计入耗时
+
+    detections = []
+    latencies = []
+    for frame in frames:
+        started = time.perf_counter()
+        crop, offset = navigation.crop_roi(frame, roi)
+        result = model(crop, imgsz=imgsz)
+        detections.append(navigation.offset_detections(navigation.extract_detections(result), offset))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return detections, np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测试推理输入尺寸和检测区域对速度与召回率的影响")
+    parser.add_argument('source', help="视频文件，或包含图片/视频的目录")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[320, 416, 640], help="要测试的推理输入尺寸")
+    parser.add_argument('--rois', type=parse_roi, nargs='+',
+                        default=[(0.0, 0.0, 1.0, 1.0), (0.15, 0.4, 0.85, 1.0)], help="要测试的检测区域 左,上,右,下")
+    parser.add_argument('--frames', type=int, default=200, help="参与测试的帧数")
+    parser.add_argument('--match-iou', type=float, default=0.5, help="视为同一目标的最小IoU")
+    parser.add_argument('--results', default='models/results.csv', help="训练记录文件")
+    args = parser.parse_args()
+
+    frames = read_frames(args.source, args.frames)
+    if not frames:
+        print(f"[推理测试] {args.source} 中没有可读取的帧")
+        return 1
+
+    epoch = best_epoch(args.results)
+    val_precision, val_recall = epoch['metrics/precision(B)'], epoch['metrics/recall(B)']
+    print(f"[推理测试] 共 {len(frames)} 帧；best.pt 为第 {int(epoch['epoch'])} 轮，验证集(640整画面) "
+          f"精确率 {val_precision:.3f}，召回率 {val_recall:.3f}，"
+          f"mAP50 {epoch['metrics/mAP50(B)']:.3f}，mAP50-95 {epoch['metrics/mAP50-95(B)']:.3f}")
+
+    model = navigation.get_model()
+    reference, _ = run_setting(model, frames, 640, (0.0, 0.0, 1.0, 1.0))
+    reference_total = sum(len(d) for d in reference)
+
+    print(f"{'尺寸':>6} {'检测区域':>22} {'平均延迟ms':>10} {'P95延迟ms':>10} {'相对召回':>8} {'估算召回':>8} {'检测框':>6}")
+    for roi in args.rois:
+        for imgsz in args.sizes:
+            detections, latencies = run_setting(model, frames, imgsz, roi)
+            matched = sum(len(match_detections(ref, cand, args.match_iou))
+                          for ref, cand in zip(reference, detections))
+            relative_recall = matched / reference_total if reference_total else 1.0
+            roi_text = ','.join(f"{value:g}" for value in roi)
+            print(f"{imgsz:>6} {roi_text:>22} {latencies.mean():>10.1f} {np.percentile(latencies, 95):>10.1f} "
+                  f"{relative_recall:>8.3f} {val_recall * relative_recall:>8.3f} "
+                  f"{sum(len(d) for d in detections):>6}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,145 @@
+"""
+登录数据库往返压测
+
+用多个线程并发登录同一个测试账号，分别统计两种查询方式每秒能完成的登录次数：
+    旧方式  查询用户 -> 更新最后登录时间 -> 查询设置(没有时插入默认设置再查询)，共3~5条SQL
+    新方式  UserRepository.authenticate：一次 JOIN 查询用户和设置 -> 更新最后登录时间，共2条SQL
+两种方式都使用 app 中的连接池，只比较数据库往返次数的差别，不经过设置缓存和 Flask。
+
+测试账号不存在时自动创建，测试结束后删除(已存在的账号保留)。
+
+运行方式：
+    python benchmark_login.py --threads 8 --seconds 10
+"""
+import argparse
+import hashlib
+import threading
+import time
+
+import app as navigation
+
+
+def legacy_authenticate(username, password_hash):
+    """旧版 verify_user 中的查询顺序，作为对照"""
+    conn = navigation.get_db_connection()
+    if conn is None:
+        raise ConnectionError("数据库连接失败")
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id, username FROM users WHERE username = %s AND password = %s",
+                           (username, password_hash))
+            user = cursor.fetchone()
+            if not user:
+                return None
+
+            cursor.execute("UPDATE users SET last_login = NOW() WHERE id = %s", (user['id'],))
+
+            cursor.execute("SELECT * FROM user_settings WHERE user_id = %s", (user['id'],))
+            settings = cursor.fetchone()
+
+            if not settings:
+                cursor.execute("INSERT INTO user_settings (user_id) VALUES (%s)", (user['id'],))
+                cursor.execute("SELECT * FROM user_settings WHERE user_id = %s", (user['id'],))
+                settings = cursor.fetchone()
+
+        conn.commit()
+        return user, settings
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def run_logins(authenticate, username, password_hash, threads, seconds):
+    """多个线程在 seconds 秒内反复登录，返回 (每秒登录次数, 平均延迟毫秒, 失败次数)"""
+    deadline = time.perf_counter() + seconds
+    counts = []
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def worker():
+        count = 0
+        total = 0.0
+        failed = 0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if authenticate(username, password_hash) is None:
+                    failed += 1
+            except Exception as e:
+                print(f"[登录压测] 登录出错: {e}")
+                failed += 1
+            total += time.perf_counter() - started
+            count += 1
+        with lock:
+            counts.append(count)
+            latencies.append(total)
+            failures.append(failed)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(counts)
+    return total / elapsed, sum(latencies) / total * 1000 if total else 0, sum(failures)
+
+
+def delete_user(user_id):
+    conn = navigation.get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM user_settings WHERE user_id = %s", (user_id,))
+            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比旧/新登录查询方式的每秒登录次数")
+    parser.add_argument('--username', default='benchmark_login', help="测试账号用户名")
+    parser.add_argument('--password', default='benchmark_login', help="测试账号密码")
+    parser.add_argument('--threads', type=int, default=8, help="并发登录线程数")
+    parser.add_argument('--seconds', type=float, default=10, help="每种方式的测试时长(秒)")
+    args = parser.parse_args()
+
+    password_hash = hashlib.sha256(args.password.encode()).hexdigest()
+    repository = navigation.user_repository
+
+    created_id = None
+    try:
+        if repository.authenticate(args.username, password_hash) is None:
+            created_id, conflict = repository.create_user(args.username, password_hash,
+                                                          f"{args.username}@benchmark.invalid")
+            if conflict:
+                print(f"[登录压测] 账号 {args.username} 已存在但密码不符，请用 --username/--password 指定测试账号")
+                return 1
+    except ConnectionError as e:
+        print(f"[登录压测] {e}")
+        return 1
+
+    print(f"[登录压测] {args.threads} 个线程，每种方式 {args.seconds:g} 秒，"
+          f"连接池最多 {navigation.DB_POOL_CONFIG['max_size']} 个连接")
+    try:
+        results = {}
+        for name, authenticate in (("旧方式", legacy_authenticate), ("新方式", repository.authenticate)):
+            rate, latency, failures = run_logins(authenticate, args.username, password_hash,
+                                                 args.threads, args.seconds)
+            results[name] = rate
+            print(f"[登录压测] {name}: {rate:.1f} 次/秒，平均延迟 {latency:.2f} 毫秒，失败 {failures} 次")
+        if results["旧方式"]:
+            print(f"[登录压测] 新方式吞吐为旧方式的 {results['新方式'] / results['旧方式']:.2f} 倍")
+    finally:
+        if created_id is not None:
+            delete_user(created_id)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
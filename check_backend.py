@@ -0,0 +1,117 @@
+"""
+推理后端精度与速度对比
+
+用 PyTorch 模型的检测结果作为参照，检查导出后端(ONNX Runtime / OpenVINO，可选INT8量化)
+在同一批帧上的检测结果是否一致，并分别统计各后端的推理速度。
+
+运行方式：
+    python check_backend.py models/calibration --backend onnx --int8 --frames 200
+
+对每一帧，把候选后端的检测框按置信度从高到低与 PyTorch 的同类别检测框贪心匹配(IoU >= --match-iou)，
+输出：
+    匹配框平均IoU、匹配框平均置信度差
+    召回率(PyTorch框中被匹配的比例)、精确率(候选后端框中被匹配的比例)
+    各后端的推理帧率
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+import app as navigation
+
+
+def read_frames(path, count):
+    """从视频文件或图片/视频目录中均匀抽取最多 count 帧"""
+    frames = navigation.load_calibration_frames(path, count)
+    if not frames and os.path.isfile(path):
+        cap = cv2.VideoCapture(path)
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    return frames
+
+
+def run_model(model, frames, batch_size):
+    """逐批推理，返回每帧的 (N, 6) 检测数组和推理帧率"""
+    imgsz = navigation.MODEL_CONFIG['imgsz']
+    model(frames[:1], imgsz=imgsz)  # 预热，不计入耗时
+    detections = []
+    started = time.time()
+    for start in range(0, len(frames), batch_size):
+        results = model(frames[start:start + batch_size], imgsz=imgsz)
+        detections.extend(navigation.extract_detections([result]) for result in results)
+    elapsed = time.time() - started
+    return detections, len(frames) / elapsed if elapsed > 0 else 0
+
+
+def match_detections(reference, candidate, min_iou):
+    """同类别贪心匹配，返回匹配对的 (IoU, 置信度差) 列表"""
+    matches = []
+    if len(reference) == 0 or len(candidate) == 0:
+        return matches
+
+    ious = navigation.box_iou(candidate[:, :4], reference[:, :4])
+    ious[candidate[:, 5][:, None] != reference[:, 5][None, :]] = 0
+    used = np.zeros(len(reference), dtype=bool)
+    for i in np.argsort(-candidate[:, 4]):
+        row = np.where(used, 0, ious[i])
+        j = int(row.argmax())
+        if row[j] >= min_iou:
+            used[j] = True
+            matches.append((row[j], candidate[i, 4] - reference[j, 4]))
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比导出后端与PyTorch模型的检测结果和速度")
+    parser.add_argument('source', help="视频文件，或包含图片/视频的目录")
+    parser.add_argument('--backend', choices=['onnx', 'openvino'], default='onnx', help="要检查的推理后端")
+    parser.add_argument('--int8', action='store_true', help="检查INT8量化后的模型")
+    parser.add_argument('--frames', type=int, default=200, help="参与对比的帧数")
+    parser.add_argument('--batch-size', type=int, default=4, help="每次送入模型的帧数")
+    parser.add_argument('--match-iou', type=float, default=0.5, help="视为同一目标的最小IoU")
+    args = parser.parse_args()
+
+    frames = read_frames(args.source, args.frames)
+    if not frames:
+        print(f"[后端对比] {args.source} 中没有可读取的帧")
+        return 1
+    print(f"[后端对比] 共 {len(frames)} 帧")
+
+    reference_model = navigation.load_model(dict(navigation.MODEL_CONFIG, backend='pytorch'))
+    candidate_model = navigation.load_model(dict(navigation.MODEL_CONFIG, backend=args.backend, int8=args.int8))
+    if not isinstance(candidate_model, navigation.ExportedDetector):
+        print(f"[后端对比] {args.backend} 后端加载失败")
+        return 1
+
+    reference, reference_fps = run_model(reference_model, frames, args.batch_size)
+    candidate, candidate_fps = run_model(candidate_model, frames, args.batch_size)
+
+    matches = []
+    for ref, cand in zip(reference, candidate):
+        matches.extend(match_detections(ref, cand, args.match_iou))
+    reference_total = sum(len(d) for d in reference)
+    candidate_total = sum(len(d) for d in candidate)
+    ious = np.array([m[0] for m in matches])
+    conf_diffs = np.array([m[1] for m in matches])
+
+    label = f"{args.backend}{' INT8' if args.int8 else ''}"
+    print(f"[后端对比] PyTorch 检测框 {reference_total} 个，{label} 检测框 {candidate_total} 个，匹配 {len(matches)} 个")
+    if matches:
+        print(f"[后端对比] 匹配框平均IoU {ious.mean():.4f}，最小IoU {ious.min():.4f}")
+        print(f"[后端对比] 置信度差 平均 {conf_diffs.mean():+.4f}，最大绝对值 {np.abs(conf_diffs).max():.4f}")
+    print(f"[后端对比] 召回率 {len(matches) / reference_total if reference_total else 1:.4f}，"
+          f"精确率 {len(matches) / candidate_total if candidate_total else 1:.4f}（以PyTorch结果为参照）")
+    print(f"[后端对比] 推理速度 PyTorch {reference_fps:.1f} 帧/秒，{label} {candidate_fps:.1f} 帧/秒，"
+          f"加速 {candidate_fps / reference_fps if reference_fps else 0:.2f} 倍")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import sys
+
+import pymysql
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as navigation  # noqa: E402
+
+# 与 init_database 中的表结构一致，只把 MySQL 类型换成 SQLite 的写法
+SQLITE_SCHEMA = [
+    '''
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username VARCHAR(50) NOT NULL UNIQUE,
+        password VARCHAR(255) NOT NULL,
+        email VARCHAR(100) NOT NULL UNIQUE,
+        phone VARCHAR(20),
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        last_login DATETIME
+    )
+    ''',
+    '''
+    CREATE TABLE user_settings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INT NOT NULL UNIQUE,
+        gender VARCHAR(10) DEFAULT '未指定',
+        name VARCHAR(50) DEFAULT '用户',
+        age VARCHAR(10) DEFAULT '未指定',
+        voice_speed VARCHAR(10) DEFAULT '中等',
+        voice_volume VARCHAR(10) DEFAULT '中等',
+        user_mode VARCHAR(10) DEFAULT '盲人端',
+        encourage VARCHAR(10) DEFAULT '开',
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    '''
+]
+
+
+class SqliteCursor:
+    """pymysql DictCursor 的 SQLite 替身：把 %s 占位符和用到的 MySQL 语法改写成 SQLite 的写法"""
+
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cursor.close()
+
+    def execute(self, query, args=()):
+        query = (query.replace('%s', '?')
+                 .replace('NOW()', 'CURRENT_TIMESTAMP')
+                 .replace('INSERT IGNORE', 'INSERT OR IGNORE'))
+        try:
+            self.cursor.execute(query, tuple(args))
+        except sqlite3.IntegrityError as e:
+            # 与 MySQL 一样以 1062 错误报告唯一约束冲突: UNIQUE constraint failed: users.email
+            if 'UNIQUE' in str(e):
+                key = str(e).rsplit(': ', 1)[-1]
+                raise pymysql.err.IntegrityError(1062, f"Duplicate entry for key '{key}'")
+            raise
+        self.lastrowid = self.cursor.lastrowid
+        self.rowcount = self.cursor.rowcount
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return {column[0]: value for column, value in zip(self.cursor.description, row)}
+
+
+class SqliteConnection:
+    """pymysql 连接的 SQLite 替身，ping 在 broken 为True时失败，用于模拟服务器断开的连接"""
+
+    opened = 0
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.broken = False
+        self.closed = False
+        SqliteConnection.opened += 1
+
+    def cursor(self):
+        return SqliteCursor(self.db)
+
+    @property
+    def in_transaction(self):
+        return self.db.in_transaction
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def close(self):
+        self.closed = True
+        self.db.close()
+
+    def ping(self, reconnect=False):
+        if self.broken:
+            raise pymysql.err.OperationalError(2006, "MySQL server has gone away")
+        self.db.execute('SELECT 1')
+
+
+@pytest.fixture
+def sqlite_connect(tmp_path):
+    """建好表的 SQLite 数据库，返回新建连接的函数"""
+    path = str(tmp_path / 'navigation.db')
+    db = sqlite3.connect(path)
+    for statement in SQLITE_SCHEMA:
+        db.execute(statement)
+    db.commit()
+    db.close()
+    return lambda: SqliteConnection(path)
+
+
+@pytest.fixture
+def db_pool(sqlite_connect, monkeypatch):
+    """替换 app.db_pool 的 SQLite 连接池，get_db_connection 和 UserRepository 都从这里取连接"""
+    pool = navigation.ConnectionPool(sqlite_connect, min_size=1, max_size=3, checkout_timeout=0.5,
+                                     idle_timeout=300, health_check_after=30)
+    monkeypatch.setattr(navigation, 'db_pool', pool)
+    return pool
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+import app as navigation
+
+pytest.importorskip('asgiref')
+import asgi  # noqa: E402
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """独立的会话表，设置不从数据库读取"""
+    monkeypatch.setattr(navigation.settings_store, 'get', lambda user_id: dict(navigation.DEFAULT_USER_SETTINGS))
+    monkeypatch.setattr(navigation, 'sessions', navigation.SessionRegistry())
+    return navigation.sessions
+
+
+def session_cookie(user_id):
+    """与 Flask 登录后下发的一样签名的会话 Cookie"""
+    flask_app = navigation.app
+    value = flask_app.session_interface.get_signing_serializer(flask_app).dumps({"user_id": user_id})
+    return (b'cookie', f"{flask_app.config['SESSION_COOKIE_NAME']}={value}".encode('latin-1'))
+
+
+def http_scope(path, query=b'', headers=()):
+    return {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'headers': list(headers)}
+
+
+def call(scope, disconnect_when=lambda body: False):
+    """直接调用 ASGI 入口，响应体满足 disconnect_when 时模拟客户端断开，返回发送的全部消息"""
+    async def run():
+        sent = []
+        done = asyncio.Event()
+
+        async def send(message):
+            sent.append(message)
+            if disconnect_when(b"".join(m.get('body', b'') for m in sent)):
+                done.set()
+
+        async def receive():
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        await asyncio.wait_for(asgi.application(scope, receive, send), 5)
+        return sent
+
+    return asyncio.run(run())
+
+
+def test_session_cookie_is_decoded(registry):
+    assert asgi.session_user_id(http_scope('/', headers=[session_cookie(7)])) == 7
+    assert asgi.session_user_id(http_scope('/', headers=[(b'cookie', b'session=forged.value')])) is None
+    assert asgi.session_user_id(http_scope('/')) is None
+
+
+@pytest.mark.parametrize('path', ['/video_feed', '/stream_speech_text'])
+def test_streams_redirect_to_login_without_session(registry, path):
+    sent = call(http_scope(path, headers=[(b'cookie', b'session=forged.value')]))
+
+    assert sent[0]['status'] == 302
+    assert (b'location', b'/login') in sent[0]['headers']
+    assert registry.stats()["sessions"] == 0
+
+
+def test_speech_text_resumes_from_last_event_id(registry):
+    user_session = registry.get(7)
+    for text in ("前方直行", "请往右拐", "请往左拐"):
+        user_session.speech_text.publish(text)
+
+    # 浏览器断线前收到了事件2，重连后只补发事件3和4
+    sent = call(http_scope('/stream_speech_text', b'lastEventId=2', [session_cookie(7)]),
+                disconnect_when=lambda body: b"id: 4" in body)
+
+    assert sent[0]['status'] == 200
+    body = b"".join(m.get('body', b'') for m in sent).decode('utf-8')
+    assert "id: 2" not in body
+    assert body.endswith(navigation.sse_event(3, "请往右拐") + navigation.sse_event(4, "请往左拐"))
+
+    # 断开后不再持有会话，也不再被文本发布唤醒
+    assert user_session.streams == 0
+    assert not user_session.speech_text.listeners
+
+
+def test_last_event_id_header_takes_precedence(registry, monkeypatch):
+    monkeypatch.setitem(navigation.SSE_CONFIG, 'heartbeat_interval', 0.05)
+    registry.get(7).speech_text.publish("请往右拐")
+    scope = http_scope('/stream_speech_text', b'lastEventId=1', [session_cookie(7), (b'last-event-id', b'2')])
+
+    assert asgi.last_event_id(scope) == 2
+    sent = call(scope, disconnect_when=lambda body: b"heartbeat" in body or b"id:" in body)
+    assert b"id:" not in b"".join(m.get('body', b'') for m in sent)
+
+
+class FakeEngine:
+    """代替分析引擎：只有帧广播和订阅计数"""
+
+    def __init__(self):
+        self.broadcast = navigation.FrameBroadcast()
+        self.subscribers = 0
+
+    def subscribe(self, viewer):
+        self.subscribers += 1
+
+    def unsubscribe(self, viewer):
+        self.subscribers -= 1
+
+
+def test_video_feed_stops_streaming_on_disconnect(registry, monkeypatch):
+    user_session = registry.get(7)
+    user_session.set_video('push:7')
+    engine = FakeEngine()
+    engine.broadcast.publish(navigation.PlaceholderFrame("测试画面"))
+    monkeypatch.setattr(navigation, 'get_analysis_engine', lambda user_session: engine)
+
+    sent = call(http_scope('/video_feed', b'profile=minimal', [session_cookie(7)]),
+                disconnect_when=lambda body: b'--frame' in body)
+
+    assert sent[0]['status'] == 200
+    assert sent[1]['body'].startswith(b'--frame\r\nContent-Type: image/jpeg')
+    # 客户端断开后不再发送结束消息，退订引擎并释放会话
+    assert all(m.get('more_body') for m in sent[1:])
+    assert engine.subscribers == 0
+    assert not engine.broadcast.listeners
+    assert user_session.streams == 0
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import app as navigation
+
+SETTINGS = dict(navigation.DEFAULT_USER_SETTINGS)
+
+
+class FakeEngine:
+    """代替 pyttsx3 引擎：runAndWait 时把 save_to_file 的内容写入文件"""
+
+    def __init__(self, audio=b'RIFF....WAVE', error=None):
+        self.audio = audio
+        self.error = error
+        self.pending = None
+        self.renders = 0
+
+    def save_to_file(self, text, path):
+        self.pending = path
+
+    def runAndWait(self):
+        self.renders += 1
+        with open(self.pending, 'wb') as f:
+            f.write(self.audio)
+        if self.error:
+            raise self.error
+
+
+def test_repeated_prompt_is_rendered_once(tmp_path):
+    cache = navigation.SpeechAudioCache(str(tmp_path), max_bytes=1024)
+    engine = FakeEngine()
+
+    first = cache.get_or_render(engine, "请往右拐", None, SETTINGS)
+    second = cache.get_or_render(engine, "请往右拐", None, SETTINGS)
+
+    assert first == second and os.path.exists(first)
+    assert engine.renders == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_empty_render_leaves_no_temp_file(tmp_path):
+    cache = navigation.SpeechAudioCache(str(tmp_path), max_bytes=1024)
+
+    assert cache.get_or_render(FakeEngine(audio=b''), "请往左拐", None, SETTINGS) is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_render_leaves_no_temp_file(tmp_path):
+    cache = navigation.SpeechAudioCache(str(tmp_path), max_bytes=1024)
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_render(FakeEngine(error=RuntimeError("TTS failed")), "请往左拐", None, SETTINGS)
+    assert os.listdir(tmp_path) == []
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = navigation.SpeechAudioCache(str(tmp_path), max_bytes=25)
+    engine = FakeEngine(audio=b'x' * 10)
+
+    oldest = cache.get_or_render(engine, "一", None, SETTINGS)
+    os.utime(oldest, (1, 1))
+    cache.get_or_render(engine, "二", None, SETTINGS)
+    cache.get_or_render(engine, "三", None, SETTINGS)
+
+    assert not os.path.exists(oldest)
+    assert len(os.listdir(tmp_path)) == 2
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+
+import app as navigation
+import batch_analyze
+from test_live_sources import write_video
+
+
+class FakeModel:
+    """代替YOLO模型：每帧返回一个空结果"""
+
+    names = {0: 'blind_path'}
+
+    def __call__(self, frames, imgsz=None):
+        return [None for _ in frames]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """两个不同日期目录中同名的视频"""
+    for day in ('day1', 'day2'):
+        os.makedirs(tmp_path / 'archive' / day)
+        write_video(tmp_path / 'archive' / day / 'walk.mp4', frames=5)
+    return tmp_path / 'archive'
+
+
+def test_same_named_videos_get_separate_outputs(archive, tmp_path):
+    videos = batch_analyze.collect_videos([str(archive)])
+    jobs, conflicts = batch_analyze.plan_outputs(videos, str(tmp_path / 'out'))
+
+    assert not conflicts
+    assert [os.path.relpath(output, tmp_path / 'out') for _, output in jobs] == [
+        os.path.join('day1', 'walk.npz'), os.path.join('day2', 'walk.npz')]
+
+
+def test_same_named_files_given_directly_conflict(archive, tmp_path):
+    videos = batch_analyze.collect_videos([str(archive / 'day1' / 'walk.mp4'), str(archive / 'day2' / 'walk.mp4')])
+    _, conflicts = batch_analyze.plan_outputs(videos, str(tmp_path / 'out'))
+
+    assert list(conflicts.values()) == [[str(archive / 'day1' / 'walk.mp4'), str(archive / 'day2' / 'walk.mp4')]]
+
+
+def test_same_file_listed_twice_is_analyzed_once(archive, tmp_path):
+    videos = batch_analyze.collect_videos([str(archive), str(archive / 'day1' / 'walk.mp4')])
+
+    assert len(videos) == 2
+    assert not batch_analyze.plan_outputs(videos, str(tmp_path / 'out'))[1]
+
+
+def test_main_refuses_conflicting_outputs(archive, tmp_path, monkeypatch):
+    monkeypatch.setattr('sys.argv', ['batch_analyze.py', str(archive / 'day1' / 'walk.mp4'),
+                                     str(archive / 'day2' / 'walk.mp4'), '--output', str(tmp_path / 'out')])
+
+    assert batch_analyze.main() == 1
+    assert not os.path.exists(tmp_path / 'out')
+
+
+def test_analyze_file_writes_each_output(archive, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_analyze, 'navigation', navigation)
+    monkeypatch.setattr(navigation, 'get_model', lambda: FakeModel())
+    monkeypatch.setattr(navigation, 'extract_detections', lambda results: np.zeros((0, 6), dtype=np.float32))
+
+    videos = batch_analyze.collect_videos([str(archive)])
+    jobs, _ = batch_analyze.plan_outputs(videos, str(tmp_path / 'out'))
+    for video_path, output_path in jobs:
+        stats = batch_analyze.analyze_file(video_path, output_path, batch_size=4)
+        assert stats["frames"] == 5
+
+    assert sorted(os.listdir(tmp_path / 'out')) == ['day1', 'day2']
+    for day in ('day1', 'day2'):
+        with np.load(tmp_path / 'out' / day / 'walk.npz') as result:
+            assert int(result['frame_count']) == 5
@@ -0,0 +1,198 @@
+import hashlib
+import threading
+import time
+
+import pytest
+
+import app as navigation
+
+
+def password_hash(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+@pytest.fixture
+def repository(db_pool):
+    return navigation.UserRepository(navigation.get_db_connection)
+
+
+def test_pool_reuses_released_connections(db_pool):
+    for _ in range(5):
+        conn = navigation.get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.close()
+
+    stats = db_pool.stats()
+    assert stats["created"] == 1
+    assert stats["checkouts"] == 5
+    assert stats["idle"] == 1
+
+
+def test_closed_proxy_cannot_be_used(db_pool):
+    conn = navigation.get_db_connection()
+    conn.close()
+    conn.close()  # 重复 close 不会把同一个连接归还两次
+    with pytest.raises(navigation.pymysql.err.InterfaceError):
+        conn.cursor()
+    assert db_pool.stats()["idle"] == 1
+
+
+def test_exhausted_pool_times_out(db_pool):
+    held = [navigation.get_db_connection() for _ in range(db_pool.max_size)]
+
+    started = time.time()
+    assert navigation.get_db_connection() is None
+    assert time.time() - started >= db_pool.checkout_timeout
+    assert db_pool.stats()["timeouts"] == 1
+
+    for conn in held:
+        conn.close()
+
+
+def test_waiting_checkout_gets_released_connection(db_pool):
+    held = [navigation.get_db_connection() for _ in range(db_pool.max_size)]
+    threading.Timer(0.1, held[0].close).start()
+
+    conn = navigation.get_db_connection()
+    assert conn is not None
+    assert db_pool.stats()["created"] == db_pool.max_size
+
+    conn.close()
+    for other in held[1:]:
+        other.close()
+
+
+def test_release_rolls_back_open_transaction(db_pool, repository):
+    user_id, _ = repository.create_user('alice', password_hash('pw'), 'alice@example.com')
+
+    conn = navigation.get_db_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE users SET phone = %s WHERE id = %s", ('123', user_id))
+    assert conn.in_transaction
+    conn.close()
+
+    conn = navigation.get_db_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT phone FROM users WHERE id = %s", (user_id,))
+        assert cursor.fetchone()["phone"] is None
+    conn.close()
+
+
+def test_broken_idle_connection_is_discarded(db_pool):
+    db_pool.health_check_after = 0
+    conn = navigation.get_db_connection()
+    raw = conn.conn
+    conn.close()
+    raw.broken = True
+
+    conn = navigation.get_db_connection()
+    assert conn.conn is not raw
+    assert raw.closed
+    assert db_pool.stats()["broken"] == 1
+    conn.close()
+
+
+def test_idle_connections_are_recycled_down_to_min_size(db_pool):
+    db_pool.idle_timeout = 0.05
+    held = [navigation.get_db_connection() for _ in range(db_pool.max_size)]
+    for conn in held:
+        conn.close()
+
+    time.sleep(0.1)
+    navigation.get_db_connection().close()
+
+    stats = db_pool.stats()
+    assert stats["size"] == db_pool.min_size
+    assert stats["recycled"] == db_pool.max_size - db_pool.min_size
+
+
+def test_concurrent_logins_share_pool(db_pool, repository):
+    repository.create_user('alice', password_hash('pw'), 'alice@example.com')
+    errors = []
+
+    def worker():
+        for _ in range(20):
+            if repository.authenticate('alice', password_hash('pw')) is None:
+                errors.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert db_pool.stats()["size"] <= db_pool.max_size
+    assert db_pool.stats()["in_use"] == 0
+
+
+def test_create_user_reports_duplicates(repository):
+    user_id, conflict = repository.create_user('alice', password_hash('pw'), 'alice@example.com')
+    assert user_id and conflict is None
+
+    assert repository.create_user('alice', password_hash('pw'), 'other@example.com') == (None, 'username')
+    assert repository.create_user('bob', password_hash('pw'), 'alice@example.com') == (None, 'email')
+    # 冲突后事务已回滚、连接正常归还，之后的注册不受影响
+    assert repository.create_user('bob', password_hash('pw'), 'bob@example.com')[1] is None
+
+
+def test_authenticate_returns_user_and_settings(repository):
+    user_id, _ = repository.create_user('alice', password_hash('pw'), 'alice@example.com')
+
+    assert repository.authenticate('alice', password_hash('wrong')) is None
+    user, settings = repository.authenticate('alice', password_hash('pw'))
+    assert user == {"id": user_id, "username": 'alice'}
+    assert settings == navigation.DEFAULT_USER_SETTINGS
+
+
+def test_missing_settings_are_created_on_load(repository):
+    user_id, _ = repository.create_user('alice', password_hash('pw'), 'alice@example.com')
+    conn = navigation.get_db_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM user_settings WHERE user_id = %s", (user_id,))
+    conn.commit()
+    conn.close()
+
+    assert repository.authenticate('alice', password_hash('pw'))[1] is None
+    settings = repository.load_settings(user_id)
+    assert settings["name"] == navigation.DEFAULT_USER_SETTINGS["name"]
+    assert repository.authenticate('alice', password_hash('pw'))[1] is not None
+
+
+def test_update_settings_writes_only_given_fields(repository):
+    user_id, _ = repository.create_user('alice', password_hash('pw'), 'alice@example.com')
+
+    repository.update_settings(user_id, {"name": '小A', "unknown": 'ignored'})
+
+    settings = repository.load_settings(user_id)
+    assert settings["name"] == '小A'
+    assert settings["age"] == navigation.DEFAULT_USER_SETTINGS["age"]
+
+
+def test_register_and_verify_user(db_pool, repository, monkeypatch):
+    monkeypatch.setattr(navigation, 'user_repository', repository)
+    monkeypatch.setattr(navigation, 'settings_store', navigation.SettingsStore(repository, 0.05))
+    monkeypatch.setattr(navigation, 'verify_code', lambda email, code: (True, "验证成功"))
+
+    assert navigation.register_user('alice', 'pw', 'alice@example.com', '000000') == (True, "注册成功")
+    assert navigation.register_user('alice', 'pw', 'b@example.com', '000000') == (False, "用户名已存在")
+    assert navigation.register_user('bob', 'pw', 'alice@example.com', '000000') == (False, "该邮箱已被注册")
+
+    assert navigation.verify_user('alice', 'wrong')[:2] == (False, "用户名或密码错误")
+    success, message, user_config = navigation.verify_user('alice', 'pw')
+    assert success and user_config["username"] == 'alice'
+    assert user_config["name"] == navigation.DEFAULT_USER_SETTINGS["name"]
+
+
+def test_unreachable_database_is_reported(monkeypatch):
+    def refuse():
+        raise navigation.pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+
+    pool = navigation.ConnectionPool(refuse, checkout_timeout=0.1)
+    monkeypatch.setattr(navigation, 'db_pool', pool)
+
+    assert navigation.get_db_connection() is None
+    assert pool.stats()["size"] == 0
+    with pytest.raises(ConnectionError):
+        navigation.UserRepository(navigation.get_db_connection).authenticate('alice', 'x')
@@ -0,0 +1,183 @@
+import functools
+import http.server
+import socket
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+import app as navigation
+
+
+def write_video(path, frames=30, size=(160, 120)):
+    """写一段移动白点的测试视频"""
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), 25, size)
+    for i in range(frames):
+        frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        cv2.circle(frame, (i * 5 % size[0], size[1] // 2), 10, (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stream_url(tmp_path):
+    """用本地HTTP服务提供的MP4文件代替网络摄像头/RTSP流，每次重连都从头播放"""
+    write_video(tmp_path / 'walk.mp4')
+    handler = functools.partial(QuietHandler, directory=str(tmp_path))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/walk.mp4"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fast_reconnect(monkeypatch):
+    monkeypatch.setitem(navigation.LIVE_SOURCE_CONFIG, 'reconnect_delay', 0.05)
+    monkeypatch.setitem(navigation.LIVE_SOURCE_CONFIG, 'max_reconnect_delay', 0.1)
+    monkeypatch.setitem(navigation.LIVE_SOURCE_CONFIG, 'reconnect_attempts', 3)
+
+
+def user_session(user_id=1):
+    return navigation.UserSession(user_id, dict(navigation.DEFAULT_USER_SETTINGS))
+
+
+def test_stream_source_delivers_frames_and_latency(stream_url, fast_reconnect):
+    session = user_session()
+    session.set_video(stream_url)
+    source = navigation.open_frame_source(stream_url, session)
+    assert isinstance(source, navigation.CaptureSource)
+    try:
+        ret, frame, captured_at = source.read()
+        assert ret and frame.shape == (120, 160, 3)
+        source.record_latency(captured_at)
+
+        stats = source.stats()
+        assert stats["kind"] == 'stream'
+        assert stats["frames"] == 1
+        assert stats["latency_ms"]["last"] >= 0
+    finally:
+        source.release()
+
+
+def test_slow_reader_only_gets_latest_frame(stream_url, fast_reconnect):
+    source = navigation.CaptureSource(stream_url, lambda: True)
+    assert source.open()
+    try:
+        assert source.read()[0]
+        time.sleep(0.3)  # 分析跟不上采集，期间的旧帧被丢弃
+        assert source.read()[0]
+        assert source.stats()["dropped"] > 0
+    finally:
+        source.release()
+
+
+def test_stream_reconnects_after_end(stream_url, fast_reconnect):
+    source = navigation.CaptureSource(stream_url, lambda: True)
+    assert source.open()
+    try:
+        deadline = time.time() + 5
+        while source.reconnects == 0 and time.time() < deadline:
+            source.read()
+        assert source.reconnects >= 1
+        assert source.read()[0]
+    finally:
+        source.release()
+
+
+def test_source_stops_when_user_switches_video(stream_url, fast_reconnect):
+    session = user_session()
+    session.set_video(stream_url)
+    source = navigation.open_frame_source(stream_url, session)
+    try:
+        assert source.read()[0]
+        session.set_video('push:1')
+        assert source.read() == (False, None, None)
+    finally:
+        source.release()
+
+
+def test_unreachable_stream_is_not_opened(fast_reconnect):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    url = f"http://127.0.0.1:{port}/walk.mp4"
+    session = user_session()
+    session.set_video(url)
+    assert navigation.open_frame_source(url, session) is None
+
+
+def test_pushed_frames_and_timeout(monkeypatch):
+    monkeypatch.setitem(navigation.LIVE_SOURCE_CONFIG, 'push_timeout', 1)
+    session = user_session()
+    session.set_video('push:1')
+    source = navigation.open_frame_source('push:1', session)
+
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    session.pushed_frames.put(frame, time.time())
+    ret, received, _ = source.read()
+    assert ret and received is frame
+
+    # 推送端超过 push_timeout 秒没有新帧视为断开
+    assert source.read() == (False, None, None)
+
+
+def test_same_source_gets_separate_engines_per_user(monkeypatch):
+    monkeypatch.setattr(navigation.AnalysisEngine, 'start', lambda self: None)
+    monkeypatch.setattr(navigation, 'analysis_engines', {})
+    first, second = user_session(1), user_session(2)
+    first.set_video('camera:0')
+    second.set_video('camera:0')
+
+    first_engine = navigation.get_analysis_engine(first)
+    second_engine = navigation.get_analysis_engine(second)
+
+    assert first_engine is not second_engine
+    assert second_engine.user_session is second
+    assert navigation.get_analysis_engine(first) is first_engine
+
+
+def test_camera_is_closed_to_regular_users(monkeypatch):
+    session = user_session()
+    assert navigation.live_source_key({"source": 'camera'}, session)[0] is None
+    assert navigation.live_source_key({"source": 'camera'}, session, is_admin=True)[0] is None
+
+    monkeypatch.setitem(navigation.LIVE_SOURCE_CONFIG, 'allow_camera', True)
+    assert navigation.live_source_key({"source": 'camera'}, session)[0] is None
+    assert navigation.live_source_key({"source": 'camera', "index": 1}, session, is_admin=True)[0] == 'camera:1'
+
+
+def test_stream_hosts_are_limited_to_allowlist(monkeypatch):
+    session = user_session()
+    internal = {"source": 'stream', "url": 'http://10.0.0.5/admin'}
+    assert navigation.live_source_key(internal, session)[0] is None
+    assert navigation.live_source_key(internal, session, is_admin=True)[0] == internal["url"]
+
+    monkeypatch.setitem(navigation.LIVE_SOURCE_CONFIG, 'allowed_stream_hosts', ['cam.example.com', '192.168.10.0/24'])
+    assert navigation.live_source_key(internal, session)[0] is None
+    assert navigation.live_source_key({"source": 'stream', "url": 'rtsp://user:pw@CAM.example.com:554/live'},
+                                      session)[0] is not None
+    assert navigation.live_source_key({"source": 'stream', "url": 'rtsp://192.168.10.20/live'}, session)[0] is not None
+    assert navigation.live_source_key({"source": 'stream', "url": 'rtsp://192.168.11.20/live'}, session)[0] is None
+    assert navigation.live_source_key({"source": 'push'}, session) == ('push:1', "")
+
+
+def test_start_live_checks_admin(monkeypatch):
+    monkeypatch.setitem(navigation.LIVE_SOURCE_CONFIG, 'allow_camera', True)
+    monkeypatch.setattr(navigation.settings_store, 'get', lambda user_id: dict(navigation.DEFAULT_USER_SETTINGS))
+    monkeypatch.setattr(navigation, 'activate_video', lambda user_session, source_key: None)
+    client = navigation.app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['user_id'] = 41
+        flask_session['username'] = 'alice'
+
+    assert client.post('/start_live', json={"source": 'camera'}).status_code == 400
+    monkeypatch.setitem(navigation.STATS_CONFIG, 'admin_users', ['alice'])
+    assert client.post('/start_live', json={"source": 'camera'}).status_code == 200
@@ -0,0 +1,127 @@
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import app as navigation
+
+pytest.importorskip('ollama')
+
+SETTINGS = dict(navigation.DEFAULT_USER_SETTINGS)
+
+
+class StubOllamaHandler(http.server.BaseHTTPRequestHandler):
+    """按 Ollama /api/chat 流式接口的格式逐行返回回答，可设置延迟和失败"""
+
+    delay = 0.0
+    answer = "前方向右转，慢慢走"
+    fail = False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.delay)
+        if self.fail:
+            self.send_response(500)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "model failed"}).encode())
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        half = len(self.answer) // 2
+        for content, done in ((self.answer[:half], False), (self.answer[half:], False), ("", True)):
+            chunk = {
+                "model": navigation.LLM_CONFIG['model'],
+                "created_at": "2024-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": content},
+                "done": done
+            }
+            self.wfile.write(json.dumps(chunk).encode() + b"\n")
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_ollama(monkeypatch):
+    """启动本地桩服务代替 Ollama，并让 app 使用新的客户端、请求队列和提示语缓存"""
+    handler = type('Handler', (StubOllamaHandler,), {})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setitem(navigation.LLM_CONFIG, 'host', f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(navigation, 'llm_client', None)
+    monkeypatch.setattr(navigation, 'llm_queue', navigation.LLMRequestQueue(maxsize=2, workers=1))
+    monkeypatch.setattr(navigation, 'phrase_cache', navigation.GuidancePhraseCache())
+    yield handler
+    server.shutdown()
+    server.server_close()
+
+
+def submit_turn(deadline):
+    """像 check_direction 一样提交一个带截止时间的转向提示请求，返回 (结果事件, 结果列表)"""
+    delivered = threading.Event()
+    results = []
+
+    def on_result(text):
+        results.append(text)
+        delivered.set()
+
+    request = navigation.LLMRequest('right', dict(SETTINGS), on_result=on_result, deadline=deadline,
+                                    fallback=navigation.DEFAULT_TURN_PHRASES['right'])
+    assert navigation.llm_queue.submit(request, priority=navigation.LLM_PRIORITY_TURN)
+    return request, delivered, results
+
+
+def test_answer_within_deadline_is_delivered(stub_ollama):
+    request, delivered, results = submit_turn(deadline=2.0)
+
+    assert delivered.wait(3)
+    assert results == [stub_ollama.answer]
+    assert navigation.llm_queue.stats()["timeouts"] == 0
+
+
+def test_slow_model_falls_back_and_caches_late_answer(stub_ollama):
+    stub_ollama.delay = 0.5
+    started = time.time()
+    request, delivered, results = submit_turn(deadline=0.1)
+
+    assert delivered.wait(1)
+    assert time.time() - started < 0.4
+    assert results == [navigation.DEFAULT_TURN_PHRASES['right']]
+
+    # 迟到的回答不再播报，而是放入提示语缓存供下一次同样的转向使用
+    deadline = time.time() + 3
+    while navigation.llm_queue.stats()["late"] == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    assert results == [navigation.DEFAULT_TURN_PHRASES['right']]
+    assert navigation.llm_queue.stats()["timeouts"] == 1
+    assert navigation.phrase_cache.get('right', SETTINGS) == stub_ollama.answer
+
+
+def test_model_error_delivers_fallback(stub_ollama):
+    stub_ollama.fail = True
+    request, delivered, results = submit_turn(deadline=2.0)
+
+    assert delivered.wait(3)
+    assert results == [navigation.DEFAULT_TURN_PHRASES['right']]
+    assert navigation.llm_queue.stats()["failed"] == 1
+
+
+def test_full_queue_rejects_without_blocking(stub_ollama):
+    stub_ollama.delay = 0.5
+    # 一个请求正在工作线程中生成，两个在队列中等待，第四个被拒绝
+    requests = [navigation.LLMRequest('left', dict(SETTINGS)) for _ in range(4)]
+    assert navigation.llm_queue.submit(requests[0])
+    time.sleep(0.1)
+
+    started = time.time()
+    accepted = [navigation.llm_queue.submit(request) for request in requests[1:]]
+    assert time.time() - started < 0.1
+    assert accepted == [True, True, False]
+    assert navigation.llm_queue.stats()["rejected"] == 1
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import app as navigation
+
+onnx = pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+from onnx import TensorProto, helper, numpy_helper  # noqa: E402
+
+
+def write_detector_onnx(path):
+    """一个输出格式与YOLOv8检测头相同 (N, 4+1, 锚点数) 的小模型：每个锚点输出画面中央的同一个框"""
+    weight = np.zeros((5, 3, 1, 1), dtype=np.float32)
+    weight[4, 0, 0, 0] = 1
+    nodes = [
+        helper.make_node('Conv', ['images', 'weight'], ['features']),
+        helper.make_node('AveragePool', ['features'], ['pooled'], kernel_shape=[32, 32], strides=[32, 32]),
+        helper.make_node('Reshape', ['pooled', 'shape'], ['raw']),
+        helper.make_node('Add', ['raw', 'box'], ['output0'])
+    ]
+    initializers = [
+        numpy_helper.from_array(weight, 'weight'),
+        numpy_helper.from_array(np.array([0, 5, -1], dtype=np.int64), 'shape'),
+        numpy_helper.from_array(np.array([320, 320, 100, 100, 0], dtype=np.float32).reshape(1, 5, 1), 'box')
+    ]
+    graph = helper.make_graph(
+        nodes, 'detector',
+        [helper.make_tensor_value_info('images', TensorProto.FLOAT, ['n', 3, 'h', 'w'])],
+        [helper.make_tensor_value_info('output0', TensorProto.FLOAT, None)],
+        initializers)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+class FakeYOLO:
+    """代替 ultralytics.YOLO：与真实实现一样把导出的ONNX写在权重文件旁边"""
+
+    names = {0: 'blind_path'}
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def export(self, format, imgsz, dynamic):
+        path = os.path.splitext(self.weights)[0] + '.onnx'
+        write_detector_onnx(path)
+        return path
+
+
+@pytest.fixture
+def export_config(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'ultralytics', types.SimpleNamespace(YOLO=FakeYOLO))
+    os.makedirs(tmp_path / 'weights')
+    (tmp_path / 'weights' / 'best.pt').write_bytes(b'weights')
+    return dict(navigation.MODEL_CONFIG, weights=str(tmp_path / 'weights' / 'best.pt'), backend='onnx',
+                int8=False, export_dir=str(tmp_path / 'exported'))
+
+
+def test_export_leaves_no_intermediate_files(export_config, tmp_path):
+    detector = navigation.load_model(export_config)
+
+    assert isinstance(detector, navigation.ExportedDetector)
+    assert os.listdir(tmp_path / 'weights') == ['best.pt']
+    assert sorted(os.listdir(tmp_path / 'exported')) == ['best_640.json', 'best_640.onnx']
+
+    frame = np.full((480, 640, 3), 255, dtype=np.uint8)
+    assert len(navigation.extract_detections(detector(frame))) == 1
+
+
+def test_cached_export_is_reused(export_config, monkeypatch):
+    navigation.load_model(export_config)
+    monkeypatch.setattr(FakeYOLO, 'export', lambda *args, **kwargs: pytest.fail("不应再次导出"))
+
+    assert isinstance(navigation.load_model(export_config), navigation.ExportedDetector)
+
+
+def load_in_process(config, results):
+    sys.modules['ultralytics'] = types.SimpleNamespace(YOLO=FakeYOLO)
+    try:
+        results.put(type(navigation.load_model(dict(config, fallback_to_pytorch=False))).__name__)
+    except Exception as e:
+        results.put(repr(e))
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="需要 fork 启动方式")
+def test_concurrent_exports_never_expose_partial_files(export_config, tmp_path):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=load_in_process, args=(export_config, results)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+
+    assert [results.get(timeout=5) for _ in processes] == ['ExportedDetector'] * 4
+    assert sorted(os.listdir(tmp_path / 'exported')) == ['best_640.json', 'best_640.onnx']
+
+
+def test_failed_backend_is_reported_or_raised(export_config, monkeypatch):
+    def broken_export(self, format, imgsz, dynamic):
+        raise RuntimeError("onnx export failed")
+
+    monkeypatch.setattr(FakeYOLO, 'export', broken_export)
+
+    detector = navigation.load_model(export_config)
+    assert isinstance(detector, FakeYOLO)
+    info = navigation.describe_model(detector, export_config)
+    assert info["requested"] == 'onnx' and info["loaded"] == 'pytorch' and info["fallback"]
+    assert navigation.prepare_model(export_config) == 'pytorch'
+
+    strict = dict(export_config, fallback_to_pytorch=False)
+    with pytest.raises(RuntimeError):
+        navigation.load_model(strict)
+    with pytest.raises(RuntimeError):
+        navigation.prepare_model(strict)
+
+
+def test_prepare_model_exports_once_for_workers(export_config, tmp_path):
+    assert navigation.prepare_model(export_config) == 'onnx'
+    assert os.path.exists(tmp_path / 'exported' / 'best_640.onnx')
+
+    info = navigation.describe_model(navigation.load_model(export_config), export_config)
+    assert info["loaded"] == 'onnx' and not info["fallback"]